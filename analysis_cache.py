@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 90 * 24 * 3600
+DEFAULT_MEMORY_MAX_ENTRIES = 50000
+DEFAULT_DISK_MAX_ENTRIES = 200000
+DEFAULT_DISK_DIR = '/tmp/comment-analyzer-cache'
+DEFAULT_S3_PREFIX = 'cache/'
+S3_FETCH_CONCURRENCY = 16
+
+_whitespace_re = re.compile(r'\s+')
+
+def normalize_cache_text(text) -> str:
+    text = unicodedata.normalize('NFKC', str(text))
+    return _whitespace_re.sub(' ', text).strip()
+
+def make_cache_key(comment, template_version: str, model_id: str) -> str:
+    payload = '\x1f'.join([normalize_cache_text(comment), template_version, model_id])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries: int = DEFAULT_MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class DiskCacheBackend:
+    def __init__(self, directory: str = DEFAULT_DISK_DIR, max_entries: int = DEFAULT_DISK_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes_since_check = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, entry):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._writes_since_check += 1
+            if self._writes_since_check < 100:
+                return
+            self._writes_since_check = 0
+        self._evict_overflow()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict_overflow(self):
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith('.json')]
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        target = int(self.max_entries * 0.9)
+        for entry in entries[:len(entries) - target]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+class S3CacheBackend:
+    def __init__(self, bucket: str, prefix: str = DEFAULT_S3_PREFIX, s3_client=None):
+        if s3_client is None:
+            import boto3
+            s3_client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_client = s3_client
+
+    def _key(self, key):
+        return f"{self.prefix}{key[:2]}/{key}.json"
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except Exception as e:
+            code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code', '')
+            if code not in ('NoSuchKey', '404'):
+                logger.warning(f"キャッシュ取得エラー: {e}")
+            return None
+
+    def set(self, key, entry):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=json.dumps(entry, ensure_ascii=False),
+            ContentType='application/json'
+        )
+
+    def delete(self, key):
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            logger.warning(f"キャッシュ削除エラー: {e}")
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        with ThreadPoolExecutor(max_workers=min(S3_FETCH_CONCURRENCY, len(keys))) as executor:
+            return list(executor.map(self.get, keys))
+
+class AnalysisCache:
+    def __init__(self, backend, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def _unwrap(self, key, entry):
+        if entry is None:
+            return None
+        if self.ttl_seconds and time.time() - entry.get('stored_at', 0) > self.ttl_seconds:
+            self.backend.delete(key)
+            return None
+        return entry.get('value')
+
+    def get_many(self, keys: list) -> list:
+        if hasattr(self.backend, 'get_many'):
+            entries = self.backend.get_many(keys)
+        else:
+            entries = [self.backend.get(key) for key in keys]
+
+        values = [self._unwrap(key, entry) for key, entry in zip(keys, entries)]
+        hit_count = sum(1 for v in values if v is not None)
+        with self._lock:
+            self.hits += hit_count
+            self.misses += len(values) - hit_count
+        return values
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, {'value': value, 'stored_at': time.time()})
+            with self._lock:
+                self.writes += 1
+        except Exception as e:
+            logger.warning(f"キャッシュ保存エラー: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+_shared_memory_backend = None
+
+def create_analysis_cache(backend_name: str, bucket: str = None, ttl_seconds: int = DEFAULT_TTL_SECONDS, s3_client=None):
+    global _shared_memory_backend
+
+    if not backend_name or backend_name == 'none':
+        return None
+    if backend_name == 'memory':
+        if _shared_memory_backend is None:
+            _shared_memory_backend = MemoryCacheBackend()
+        return AnalysisCache(_shared_memory_backend, ttl_seconds)
+    if backend_name == 'disk':
+        return AnalysisCache(DiskCacheBackend(), ttl_seconds)
+    if backend_name == 's3':
+        if not bucket:
+            raise ValueError("S3キャッシュにはバケット名が必要です")
+        return AnalysisCache(S3CacheBackend(bucket, s3_client=s3_client), ttl_seconds)
+    raise ValueError(f"不明なキャッシュバックエンド: {backend_name}")
@@ -0,0 +1,293 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+MAX_CALL_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_MULTIPLIER = 1.5
+HEDGE_MIN_DELAY_SECONDS = 1.0
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 15.0
+
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException')
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES + (
+    'ServiceUnavailableException', 'InternalServerException', 'ModelTimeoutException',
+    'ModelNotReadyException', 'ModelStreamErrorException', 'RequestTimeout', 'RequestTimeoutException'
+)
+RETRYABLE_EXCEPTION_NAMES = (
+    'EndpointConnectionError', 'ConnectionClosedError', 'ReadTimeoutError',
+    'ConnectTimeoutError', 'ConnectionError', 'TimeoutError'
+)
+
+class BedrockUnavailableError(Exception):
+    pass
+
+class AttemptCancelled(Exception):
+    pass
+
+def error_code(error: Exception) -> str:
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code', '')
+    # ストリーム途中のエラーイベントは先頭が小文字（throttlingException等）で届く
+    return code[:1].upper() + code[1:]
+
+def is_throttling_error(error: Exception) -> bool:
+    return error_code(error) in THROTTLING_ERROR_CODES or type(error).__name__ in THROTTLING_ERROR_CODES
+
+def is_retryable_error(error: Exception) -> bool:
+    if isinstance(error, AttemptCancelled):
+        return False
+    if error_code(error) in RETRYABLE_ERROR_CODES:
+        return True
+    status = (getattr(error, 'response', None) or {}).get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    if status >= 500 or status == 429:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_CODES + RETRYABLE_EXCEPTION_NAMES
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    def hedge_delay(self):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+        return max(HEDGE_MIN_DELAY_SECONDS, self.percentile(0.95) * HEDGE_LATENCY_MULTIPLIER)
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.opens = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._cancelled = False
+        self._cond = threading.Condition()
+
+    def before_call(self):
+        with self._cond:
+            while True:
+                if self._cancelled:
+                    raise BedrockUnavailableError("呼び出しは打ち切られました")
+                if self.state == 'closed':
+                    return
+                if self.state == 'open':
+                    remaining = self._opened_at + self.reset_seconds - time.monotonic()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    self.state = 'half_open'
+                    logger.info('サーキットブレーカー: 試行リクエストを送信します')
+                if not self._trial_in_flight:
+                    self._trial_in_flight = True
+                    return
+                self._cond.wait(self.reset_seconds)
+
+    def cancel(self):
+        # 回復待ちで止まっている呼び出しも含めて打ち切る
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def record_success(self):
+        with self._cond:
+            if self.state != 'closed':
+                logger.info('サーキットブレーカー: Bedrockの応答が回復しました')
+            self.state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._trial_in_flight = False
+            self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or (self.state == 'closed' and self._failures >= self.failure_threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self.opens += 1
+                logger.warning(f'サーキットブレーカー作動: {self.reset_seconds}秒間リクエストを停止します')
+            self._cond.notify_all()
+
+class InvocationAttempt:
+    # ヘッジで負けた側の応答を読み続けないよう、本文を保持して中断できるようにする
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._body = None
+
+    def watch(self, response):
+        self._body = response.get('body')
+        if self.cancelled.is_set():
+            self._close()
+            raise AttemptCancelled()
+        if self._body is not None and not hasattr(self._body, 'read'):
+            response = dict(response, body=self._events(self._body))
+        return response
+
+    def _events(self, body):
+        for event in body:
+            if self.cancelled.is_set():
+                raise AttemptCancelled()
+            yield event
+
+    def cancel(self):
+        self.cancelled.set()
+        self._close()
+
+    def _close(self):
+        close = getattr(self._body, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"ヘッジした応答のクローズに失敗: {e}")
+
+class ResilientInvoker:
+    def __init__(self, call, max_workers: int, max_attempts: int = MAX_CALL_ATTEMPTS, hedging: bool = True):
+        self.call = call
+        self.max_workers = max(2, max_workers * 2)
+        self.max_attempts = max_attempts
+        self.hedging = hedging
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.retries = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        # 実行時間の上限が近いときは、リトライ待ち・ブレーカーの回復待ちをやめて呼び出し元に制御を返す
+        self._stopped.set()
+        self.breaker.cancel()
+
+    def invoke(self, limiter=None, read=None, **kwargs):
+        # readを渡すと応答本文（ストリーム）の読み込みまでを1回の試行として扱い、
+        # 同時実行枠・応答時間の計測・リトライ・ヘッジの対象を生成の完了までにする
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if self._stopped.is_set():
+                raise BedrockUnavailableError(f"分析の中断により呼び出しを打ち切りました: {last_error}")
+            self.breaker.before_call()
+            if limiter is not None:
+                limiter.acquire()
+            throttled = False
+            try:
+                response = self._call_hedged(kwargs, read)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # 入力エラー等はBedrockの回復を示さないため、ブレーカーの状態は変えずに試行枠だけ返す
+                    self.breaker.release()
+                    raise
+                throttled = is_throttling_error(e)
+                last_error = e
+                self.breaker.record_failure()
+                with self._lock:
+                    self.retries += 1
+                logger.warning(f"Bedrock呼び出し失敗 ({attempt + 1}/{self.max_attempts}回目): {e}")
+            else:
+                self.breaker.record_success()
+                return response
+            finally:
+                if limiter is not None:
+                    limiter.release(throttled=throttled)
+            self._stopped.wait(backoff_delay(attempt))
+
+        raise BedrockUnavailableError(f"リトライ上限に到達しました: {last_error}")
+
+    def _timed_call(self, kwargs, read=None, attempt=None):
+        started = time.monotonic()
+        response = self.call(**kwargs)
+        if read is not None:
+            response = read(attempt.watch(response) if attempt is not None else response)
+        self.latency.record(time.monotonic() - started)
+        return response
+
+    def _call_hedged(self, kwargs, read=None):
+        delay = self.latency.hedge_delay() if self.hedging else None
+        if delay is None:
+            return self._timed_call(kwargs, read)
+
+        executor = self._get_executor()
+        attempts = {}
+        primary_attempt = InvocationAttempt()
+        primary = executor.submit(self._timed_call, kwargs, read, primary_attempt)
+        attempts[primary] = primary_attempt
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge_attempt = InvocationAttempt()
+        hedge = executor.submit(self._timed_call, kwargs, read, hedge_attempt)
+        attempts[hedge] = hedge_attempt
+        with self._lock:
+            self.hedged_requests += 1
+        pending = [primary, hedge]
+        first_error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                        attempts[other].cancel()
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'retries': self.retries,
+                'hedged_requests': self.hedged_requests,
+                'hedge_wins': self.hedge_wins,
+                'circuit_opens': self.breaker.opens
+            }
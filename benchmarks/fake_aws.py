@@ -0,0 +1,316 @@
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import boto3
+from botocore.exceptions import ClientError
+
+DANGER_MARKERS = ('死ね', 'ゴミ', '消えろ', 'キモい')
+NEGATIVE_MARKERS = ('ない', 'にく', 'すぎ', '良かった')
+POSITIVE_MARKERS = ('分かりやす', '理解しやす', '面白', '楽し', '興味')
+FIRST_TOKEN_SHARE = 0.2
+
+class LatencyModel:
+    def __init__(self, median_ms: float = 200.0, sigma: float = 0.3, seed: int = 0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        with self._lock:
+            return self._rng.lognormvariate(math.log(self.median_ms / 1000.0), self.sigma)
+
+class StreamingBody:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self, *args):
+        data, self._data = self._data, b''
+        return data
+
+class FakeBedrockClient:
+    def __init__(self, latency: LatencyModel = None, throttle_rate: float = 0.0, malformed_rate: float = 0.0,
+                 output_tokens_per_item: int = 80, seed: int = 0):
+        self.latency = latency or LatencyModel()
+        self.throttle_rate = throttle_rate
+        self.malformed_rate = malformed_rate
+        self.output_tokens_per_item = output_tokens_per_item
+        self.calls = 0
+        self.throttled = 0
+        self.malformed = 0
+        self.call_latencies = []
+        self.cached_prefixes = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = 0
+            self.throttled = 0
+            self.malformed = 0
+            self.call_latencies = []
+
+    def invoke_model(self, modelId, body, **kwargs):
+        started = time.monotonic()
+        completion, stop_reason = self._complete(body)
+        self._record_latency(started)
+        return {'body': StreamingBody(json.dumps(self._response(body, completion, stop_reason), ensure_ascii=False).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        # 実際のAPIと同じく応答ヘッダーの時点で返し、生成にかかる時間はイベントを読む側で待たせる
+        started = time.monotonic()
+        latency = self.latency.sample()
+        completion, stop_reason = self._complete(body, delay=False)
+        request = json.loads(body)
+        usage = self._usage(request, completion)
+        chunk_size = 64
+
+        def encode(payload):
+            return {'chunk': {'bytes': json.dumps(payload, ensure_ascii=False).encode('utf-8')}}
+
+        def events():
+            pieces = [completion[i:i + chunk_size] for i in range(0, len(completion), chunk_size)] or ['']
+            metrics = {'inputTokenCount': usage['input_tokens'], 'outputTokenCount': usage['output_tokens']}
+            # 最初のトークンまでに2割、残りを各チャンクに振り分ける
+            time.sleep(latency * FIRST_TOKEN_SHARE)
+            piece_delay = latency * (1 - FIRST_TOKEN_SHARE) / len(pieces)
+            if 'messages' in request:
+                yield encode({'type': 'message_start', 'message': {'usage': dict(usage, output_tokens=1)}})
+                for piece in pieces:
+                    time.sleep(piece_delay)
+                    yield encode({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}})
+                yield encode({'type': 'message_delta', 'delta': {'stop_reason': self._messages_stop_reason(stop_reason)},
+                              'usage': {'output_tokens': usage['output_tokens']}})
+                yield encode({'type': 'message_stop', 'amazon-bedrock-invocationMetrics': metrics})
+            else:
+                for index, piece in enumerate(pieces):
+                    time.sleep(piece_delay)
+                    last = index == len(pieces) - 1
+                    payload = {'completion': piece, 'stop_reason': stop_reason if last else None}
+                    if last:
+                        payload['amazon-bedrock-invocationMetrics'] = metrics
+                    yield encode(payload)
+            self._record_latency(started)
+
+        return {'body': events()}
+
+    def _record_latency(self, started):
+        with self._lock:
+            self.call_latencies.append(time.monotonic() - started)
+
+    def _complete(self, body, delay: bool = True):
+        with self._lock:
+            self.calls += 1
+            throttled = self._rng.random() < self.throttle_rate
+            malformed = not throttled and self._rng.random() < self.malformed_rate
+            if throttled:
+                self.throttled += 1
+            if malformed:
+                self.malformed += 1
+            mode = self._rng.choice(('truncated', 'prose', 'missing')) if malformed else None
+
+        if delay:
+            time.sleep(self.latency.sample())
+        if throttled:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+                               'ResponseMetadata': {'HTTPStatusCode': 429}}, 'InvokeModel')
+
+        comments = re.findall(r'^\[(\d+)\] (.*)$', self._prompt_text(json.loads(body)), re.M)
+        items = [self._analyze(int(item_id), text) for item_id, text in comments]
+
+        if mode == 'prose':
+            return '申し訳ありませんが、その内容については回答できません。', 'stop_sequence'
+        if mode == 'missing' and items:
+            items = items[:len(items) // 2]
+        completion = json.dumps(items, ensure_ascii=False)
+        if mode == 'truncated':
+            return completion[:len(completion) * 2 // 3], 'max_tokens'
+        return completion, 'stop_sequence'
+
+    def _analyze(self, item_id: int, text: str) -> dict:
+        dangerous = any(marker in text for marker in DANGER_MARKERS)
+        if dangerous or any(marker in text for marker in NEGATIVE_MARKERS):
+            sentiment = 'negative'
+        elif any(marker in text for marker in POSITIVE_MARKERS):
+            sentiment = 'positive'
+        else:
+            sentiment = 'neutral'
+        return {
+            'id': item_id,
+            'sentiment': sentiment,
+            'sentiment_score': 0.2 if sentiment == 'negative' else 0.8 if sentiment == 'positive' else 0.5,
+            'category': '講義資料' if 'スライド' in text or '資料' in text else '講義内容',
+            'category_confidence': 0.8,
+            'is_dangerous': dangerous,
+            'danger_score': 0.9 if dangerous else 0.1,
+            'importance_score': 0.9 if dangerous else 0.4,
+            'danger_reasons': '攻撃的な表現' if dangerous else ''
+        }
+
+    def _prompt_text(self, request: dict) -> str:
+        if 'prompt' in request:
+            return request['prompt']
+        system = request.get('system') or []
+        blocks = [{'text': system}] if isinstance(system, str) else list(system)
+        for message in request.get('messages', []):
+            content = message.get('content')
+            blocks.extend([{'text': content}] if isinstance(content, str) else content)
+        return '\n'.join(block.get('text', '') if isinstance(block, dict) else str(block) for block in blocks)
+
+    def _usage(self, request: dict, completion: str) -> dict:
+        # 日本語はおおむね1文字1トークンとして数える
+        usage = {'input_tokens': len(self._prompt_text(request)), 'output_tokens': max(1, len(completion) // 2)}
+        system = request.get('system')
+        cached = [block for block in system if isinstance(block, dict) and 'cache_control' in block] if isinstance(system, list) else []
+        if cached:
+            # cache_controlまでの接頭辞を2回目以降はキャッシュから読み込んだものとして数える
+            prefix = '\n'.join(block.get('text', '') for block in cached)
+            with self._lock:
+                hit = prefix in self.cached_prefixes
+                self.cached_prefixes.add(prefix)
+            usage['input_tokens'] -= len(prefix)
+            usage['cache_read_input_tokens' if hit else 'cache_creation_input_tokens'] = len(prefix)
+        return usage
+
+    def _messages_stop_reason(self, stop_reason):
+        return 'max_tokens' if stop_reason == 'max_tokens' else 'end_turn'
+
+    def _response(self, body, completion, stop_reason):
+        request = json.loads(body)
+        if 'messages' in request:
+            return {
+                'content': [{'type': 'text', 'text': completion}],
+                'stop_reason': self._messages_stop_reason(stop_reason),
+                'usage': self._usage(request, completion)
+            }
+        return {'completion': completion, 'stop_reason': stop_reason}
+
+    def latency_percentiles(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.call_latencies)
+        if not ordered:
+            return {'p50_ms': None, 'p95_ms': None}
+        pick = lambda pct: round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000, 1)
+        return {'p50_ms': pick(0.5), 'p95_ms': pick(0.95)}
+
+class InMemoryS3:
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.request_counts = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.request_counts[operation] = self.request_counts.get(operation, 0) + 1
+
+    def _etag(self, data: bytes) -> str:
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def _precondition_failed(self):
+        return ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'At least one of the pre-conditions you specified did not hold'},
+                            'ResponseMetadata': {'HTTPStatusCode': 412}}, 'PutObject')
+
+    def _missing(self, operation):
+        return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'},
+                            'ResponseMetadata': {'HTTPStatusCode': 404}}, operation)
+
+    def put_object(self, Bucket, Key, Body=b'', IfNoneMatch=None, IfMatch=None, Metadata=None, **kwargs):
+        self._count('PutObject')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        with self._lock:
+            if IfNoneMatch == '*' and Key in self.objects:
+                raise self._precondition_failed()
+            if IfMatch is not None and (Key not in self.objects or self._etag(self.objects[Key]) != IfMatch):
+                raise self._precondition_failed()
+            self.objects[Key] = bytes(Body)
+            self.metadata[Key] = dict(Metadata or {})
+        return {'ETag': self._etag(bytes(Body))}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._count('GetObject')
+        with self._lock:
+            if Key not in self.objects:
+                raise self._missing('GetObject')
+            data = self.objects[Key]
+            metadata = dict(self.metadata.get(Key, {}))
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': self._etag(data), 'Metadata': metadata}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._count('HeadObject')
+        with self._lock:
+            if Key not in self.objects:
+                raise self._missing('HeadObject')
+            return {'ContentLength': len(self.objects[Key]), 'ETag': self._etag(self.objects[Key]),
+                    'Metadata': dict(self.metadata.get(Key, {}))}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._count('DeleteObject')
+        with self._lock:
+            self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._count('DeleteObjects')
+        with self._lock:
+            for item in Delete.get('Objects', []):
+                self.objects.pop(item['Key'], None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        self._count('ListObjectsV2')
+        with self._lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        return {'Contents': [{'Key': key, 'Size': len(self.objects.get(key, b''))} for key in keys], 'KeyCount': len(keys)}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **kwargs):
+        return f"https://in-memory-s3.local/{Params['Key']}?method={ClientMethod}&expires={ExpiresIn}"
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.request_counts.values())
+
+class InlineLambdaClient:
+    def __init__(self):
+        self.handler = None
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        thread = threading.Thread(target=self.handler, args=(json.loads(Payload), None))
+        with self._lock:
+            self.threads.append(thread)
+        thread.start()
+        return {'StatusCode': 202}
+
+    def wait(self):
+        while True:
+            with self._lock:
+                pending = [thread for thread in self.threads if thread.is_alive()]
+            if not pending:
+                return
+            for thread in pending:
+                thread.join()
+
+def install_fake_clients(bedrock: FakeBedrockClient, s3: InMemoryS3, lambda_client: InlineLambdaClient = None):
+    # lambda_function等はimport時にboto3.clientを呼ぶため、importより前に差し替える
+    real_client = boto3.client
+    fakes = {'bedrock-runtime': bedrock, 's3': s3, 'lambda': lambda_client}
+
+    def client(service_name, *args, **kwargs):
+        if fakes.get(service_name) is not None:
+            return fakes[service_name]
+        return real_client(service_name, *args, **kwargs)
+
+    boto3.client = client
+    return real_client
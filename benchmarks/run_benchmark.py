@@ -0,0 +1,317 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_aws import FakeBedrockClient, InMemoryS3, InlineLambdaClient, LatencyModel, install_fake_clients
+from synthetic_workbook import generate_workbook
+
+DEFAULT_OUTPUT_DIR = os.path.join(BENCHMARK_DIR, 'results')
+UPLOAD_KEY = 'temp/benchmark.xlsx'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Bedrock・S3を使わずにコメント分析のスループットを計測します')
+    parser.add_argument('--mode', choices=('job', 'analyze'), default='job',
+                        help='job: start_jobから非同期ワーカーまで実行 / analyze: analyze_commentsのみ実行')
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--comment-columns', type=int, default=3)
+    parser.add_argument('--metadata-columns', type=int, default=2)
+    parser.add_argument('--danger-rate', type=float, default=0.01)
+    parser.add_argument('--empty-rate', type=float, default=0.1)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='Bedrock応答時間の中央値（対数正規分布）')
+    parser.add_argument('--latency-sigma', type=float, default=0.3)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    parser.add_argument('--cache-backend', default='none', choices=('none', 'memory', 's3'))
+    parser.add_argument('--job-store', default='s3', choices=('s3', 'memory', 'sqlite'), help='ジョブ情報の保存先')
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--prescreen', action='store_true')
+    parser.add_argument('--no-dedup', action='store_true')
+    parser.add_argument('--no-streaming', action='store_true')
+    parser.add_argument('--model-id', default=None, help='BedrockのモデルID（プロンプトキャッシュ対応モデルを指定すると偽Bedrockもキャッシュを再現する）')
+    parser.add_argument('--prompt-template', default=None, help='プロンプトテンプレートの版（既定はprompt_templates.DEFAULT_PROMPT_TEMPLATE）')
+    parser.add_argument('--rerun-changed-rate', type=float, default=None,
+                        help='基準ジョブを実行した後、この割合の行を書き換えたファイルをbase_job_id付きで再分析して計測する（jobモードのみ）')
+    parser.add_argument('--rerun-new-rows', type=int, default=0, help='再分析時に末尾へ追加する回答の行数')
+    parser.add_argument('--trace-memory', action='store_true', help='tracemallocでPythonのメモリ確保量のピークも計測（実行は遅くなる）')
+    parser.add_argument('--label', default=None, help='結果ファイル名に使うラベル（既定は日時）')
+    parser.add_argument('--output', default=None, help='結果JSONの保存先')
+    parser.add_argument('--compare', default=None, help='比較対象の結果JSON')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def deep_sizeof(obj, seen: set) -> int:
+    # 共有されているオブジェクト（キー文字列・参照しているコメント本文など）は1回だけ数える
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, (str, bytes, array, type)):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def measure_result_memory(rows) -> dict:
+    from result_store import ResultColumns
+
+    # analyzeモードは分析が返した列形式の結果をそのまま測り、辞書の配列は比較用にそこから作る
+    columns = rows if isinstance(rows, ResultColumns) else None
+    # S3から読み戻した行はキー文字列が行ごとに別になるため、分析中の辞書と同じく共有させる
+    rows = [{sys.intern(key): value for key, value in row.items()} for row in rows]
+    if not rows:
+        return None
+    if columns is None:
+        columns = ResultColumns(rows)
+    count = len(rows)
+    comment_bytes = deep_sizeof([row.get('comment') for row in rows], set()) - sys.getsizeof([None] * count)
+    per_result = lambda size: round(size / count, 1)
+    return {
+        'results': count,
+        'comment_bytes_per_result': per_result(comment_bytes),
+        'rows_bytes_per_result': per_result(deep_sizeof(rows, set())),
+        'columnar_bytes_per_result': per_result(deep_sizeof(columns, set())),
+        'rows_json_bytes_per_result': per_result(len(json.dumps(rows))),
+        'columnar_json_bytes_per_result': per_result(len(json.dumps(columns.to_wire())))
+    }
+
+def run_analyze(args, workbook: bytes, s3: InMemoryS3) -> dict:
+    from comment_analyzer import analyze_comments
+    from analysis_cache import create_analysis_cache
+    from prescreen import create_prescreener
+
+    cache = create_analysis_cache(args.cache_backend, bucket='benchmark', s3_client=s3)
+    result = analyze_comments(
+        workbook,
+        max_concurrency=args.max_concurrency,
+        cache=cache,
+        deduplicate=not args.no_dedup,
+        prescreener=create_prescreener(args.prescreen),
+        streaming=not args.no_streaming,
+        prompt_template=args.prompt_template
+    )
+    return {
+        'status': 'completed',
+        'comments': len(result['results']),
+        'call_stats': result.get('call_stats'),
+        'dedup_stats': result.get('dedup_stats'),
+        'source_stats': result.get('source_stats'),
+        'metrics': result.get('metrics'),
+        'rows': result['results']
+    }
+
+def run_job(args, workbook: bytes, s3: InMemoryS3, lambda_client: InlineLambdaClient, base_job_id=None) -> dict:
+    import lambda_function
+
+    lambda_function.s3_client = s3
+    lambda_client.handler = lambda_function.lambda_handler
+    s3.put_object(Bucket=lambda_function.JOB_BUCKET, Key=UPLOAD_KEY, Body=workbook)
+    s3.request_counts.clear()
+
+    def call(body):
+        response = lambda_function.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+        return json.loads(response['body'])
+
+    started = call({
+        'start_job': True,
+        'file_key': UPLOAD_KEY,
+        'max_concurrency': args.max_concurrency,
+        'cache_backend': args.cache_backend,
+        'shard_count': args.shard_count,
+        'prescreen': args.prescreen,
+        'deduplicate': not args.no_dedup,
+        'streaming': not args.no_streaming,
+        'prompt_template': args.prompt_template,
+        'base_job_id': base_job_id
+    })
+    if 'job_id' not in started:
+        raise RuntimeError(f"ジョブを開始できませんでした: {started}")
+
+    lambda_client.wait()
+    job_info = lambda_function.get_job_info(started['job_id']) or {}
+    return {
+        'job_id': started['job_id'],
+        'status': job_info.get('status'),
+        'comments': job_info.get('processed_comments', 0),
+        'call_stats': job_info.get('call_stats'),
+        'dedup_stats': job_info.get('dedup_stats'),
+        'source_stats': job_info.get('source_stats'),
+        'diff_stats': job_info.get('diff_stats'),
+        'metrics': job_info.get('metrics'),
+        'rows': (row for _, row in lambda_function.iter_result_rows(job_info)) if job_info.get('status') == 'completed' else []
+    }
+
+def rerun_enabled(args) -> bool:
+    return args.rerun_changed_rate is not None or args.rerun_new_rows > 0
+
+def run_base_job(args, s3: InMemoryS3, lambda_client: InlineLambdaClient, bedrock: FakeBedrockClient) -> dict:
+    # 差分分析の基準になるジョブを計測対象外で実行し、所要時間だけを記録する
+    workbook = generate_workbook(
+        args.rows, args.comment_columns, args.metadata_columns, seed=args.seed,
+        danger_rate=args.danger_rate, empty_rate=args.empty_rate, duplicate_rate=args.duplicate_rate
+    )
+    started = time.perf_counter()
+    outcome = run_job(args, workbook, s3, lambda_client)
+    if outcome['status'] != 'completed':
+        raise RuntimeError(f"基準ジョブが完了しませんでした: {outcome['status']}")
+    base = {
+        'job_id': outcome['job_id'],
+        'comments': outcome['comments'],
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+        'bedrock_calls': bedrock.calls
+    }
+    bedrock.reset_counters()
+    return base
+
+def run_benchmark(args) -> dict:
+    if rerun_enabled(args) and args.mode != 'job':
+        raise ValueError('--rerun-changed-rate・--rerun-new-rowsはjobモードでのみ指定できます')
+    workbook = generate_workbook(
+        args.rows + args.rerun_new_rows, args.comment_columns, args.metadata_columns, seed=args.seed,
+        danger_rate=args.danger_rate, empty_rate=args.empty_rate, duplicate_rate=args.duplicate_rate,
+        changed_rate=args.rerun_changed_rate or 0.0
+    )
+    bedrock = FakeBedrockClient(
+        LatencyModel(args.latency_ms, args.latency_sigma, seed=args.seed),
+        throttle_rate=args.throttle_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed
+    )
+    s3 = InMemoryS3()
+    lambda_client = InlineLambdaClient()
+    install_fake_clients(bedrock, s3, lambda_client)
+    # ジョブ情報ストアとモデルIDはimport時の環境変数で決まる
+    if args.model_id:
+        os.environ['BEDROCK_MODEL_ID'] = args.model_id
+    os.environ['JOB_STORE_BACKEND'] = args.job_store
+    if args.job_store == 'sqlite':
+        os.environ['JOB_STORE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='comment-analyzer-benchmark-'), 'jobs.sqlite3')
+    # import時にログレベルが設定されるため、先に読み込んでから上書きする
+    import lambda_function  # noqa: F401
+    import comment_analyzer  # noqa: F401
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    # 埋め込みメトリクス形式の出力（print）は--verbose指定時のみ表示する
+    emf_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    base = None
+    if rerun_enabled(args):
+        with emf_output:
+            base = run_base_job(args, s3, lambda_client, bedrock)
+        emf_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with emf_output:
+        if args.mode == 'job':
+            outcome = run_job(args, workbook, s3, lambda_client, base['job_id'] if base else None)
+        else:
+            outcome = run_analyze(args, workbook, s3)
+    elapsed = time.perf_counter() - started
+    traced_peak = None
+    if args.trace_memory:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+
+    # 結果1件あたりのメモリ・転送量は計測時間に含めずに見積もる
+    result_memory = measure_result_memory(outcome['rows'])
+    s3_requests = dict(sorted(s3.request_counts.items()))
+    s3_requests['total'] = sum(s3.request_counts.values())
+
+    return {
+        'label': args.label,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'mode': args.mode,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'label', 'verbose')},
+        'workbook_bytes': len(workbook),
+        'status': outcome['status'],
+        'comments': outcome['comments'],
+        'elapsed_seconds': round(elapsed, 3),
+        'comments_per_sec': round(outcome['comments'] / elapsed, 2) if elapsed > 0 else None,
+        'batch_latency': bedrock.latency_percentiles(),
+        'bedrock': {'calls': bedrock.calls, 'throttled': bedrock.throttled, 'malformed': bedrock.malformed},
+        's3_requests': s3_requests,
+        'memory': {'peak_rss_mb': peak_rss_mb(), 'peak_traced_mb': traced_peak},
+        'result_memory': result_memory,
+        'call_stats': outcome['call_stats'],
+        'dedup_stats': outcome['dedup_stats'],
+        'source_stats': outcome['source_stats'],
+        'diff_stats': outcome.get('diff_stats'),
+        'base_job': base,
+        'metrics': outcome['metrics']
+    }
+
+def compare_reports(current: dict, baseline: dict) -> list:
+    metrics = [
+        ('comments_per_sec', lambda r: r.get('comments_per_sec')),
+        ('batch_latency.p50_ms', lambda r: (r.get('batch_latency') or {}).get('p50_ms')),
+        ('batch_latency.p95_ms', lambda r: (r.get('batch_latency') or {}).get('p95_ms')),
+        ('bedrock.calls', lambda r: (r.get('bedrock') or {}).get('calls')),
+        ('s3_requests.total', lambda r: (r.get('s3_requests') or {}).get('total')),
+        ('memory.peak_rss_mb', lambda r: (r.get('memory') or {}).get('peak_rss_mb')),
+        ('result_memory.columnar_bytes_per_result', lambda r: (r.get('result_memory') or {}).get('columnar_bytes_per_result'))
+    ]
+    lines = []
+    for name, pick in metrics:
+        before, after = pick(baseline), pick(current)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+        lines.append(f"{name:24s} {before:>12} → {after:>12} ({change})")
+    return lines
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.label = args.label or datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    report = run_benchmark(args)
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"{args.label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"{report['comments']}件 / {report['elapsed_seconds']}秒 = {report['comments_per_sec']}件/秒 (状態: {report['status']})")
+    print(f"バッチ応答時間: p50={report['batch_latency']['p50_ms']}ms p95={report['batch_latency']['p95_ms']}ms")
+    print(f"Bedrock呼び出し: {report['bedrock']} / S3リクエスト: {report['s3_requests']}")
+    print(f"ピークメモリ: {report['memory']}")
+    print(f"結果1件あたりのメモリ・JSONサイズ（バイト）: {report['result_memory']}")
+    if report['base_job']:
+        print(f"基準ジョブ: {report['base_job']['comments']}件 / {report['base_job']['elapsed_seconds']}秒 / Bedrock呼び出し{report['base_job']['bedrock_calls']}回")
+        print(f"差分分析の内訳: {report['diff_stats']}")
+    print(f"結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"比較対象: {args.compare} ({baseline.get('label')})")
+        for line in compare_reports(report, baseline):
+            print(line)
+
+    return 0 if report['status'] == 'completed' else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
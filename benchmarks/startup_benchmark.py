@@ -0,0 +1,154 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from urllib.parse import unquote, urlparse
+
+PROCESS_STARTED = time.perf_counter()
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_OUTPUT_DIR = os.path.join(BENCHMARK_DIR, 'results')
+JOB_ID = 'startup-benchmark'
+HEAVY_MODULES = ('comment_analyzer', 'openpyxl')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='コールドスタート時の読み込み時間と状況確認（get_status）の応答時間を計測します')
+    parser.add_argument('--runs', type=int, default=10, help='新しいPythonプロセスで計測する回数')
+    parser.add_argument('--warm-polls', type=int, default=20, help='各プロセスで続けて行う状況確認の回数')
+    parser.add_argument('--label', default=None, help='結果ファイル名に使うラベル（既定は日時）')
+    parser.add_argument('--output', default=None, help='結果JSONの保存先')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--eager', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+class RawBody:
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def read(self, *args, **kwargs):
+        return self._data.read(*args)
+
+    def stream(self, **kwargs):
+        yield self._data.read()
+
+def install_in_memory_s3(client, bucket: str, objects: dict):
+    # 実物のbotocoreクライアントを使い、送信直前で応答を差し替える（クライアント生成・署名・応答解析の時間も計測に含める）
+    from botocore.awsrequest import AWSResponse
+
+    def before_send(request, **kwargs):
+        key = unquote(urlparse(request.url).path).lstrip('/')
+        if key.startswith(f"{bucket}/"):
+            key = key[len(bucket) + 1:]
+        if request.method == 'PUT':
+            body = request.body.read() if hasattr(request.body, 'read') else (request.body or b'')
+            objects[key] = body.encode('utf-8') if isinstance(body, str) else bytes(body)
+            return AWSResponse(request.url, 200, {'ETag': '"0"'}, RawBody(b''))
+        if key not in objects:
+            error = b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code><Message>Not found</Message></Error>'
+            return AWSResponse(request.url, 404, {'Content-Type': 'application/xml'}, RawBody(error))
+        data = objects[key]
+        return AWSResponse(request.url, 200, {'Content-Length': str(len(data))}, RawBody(b'' if request.method == 'HEAD' else data))
+
+    client.meta.events.register('before-send.s3', before_send)
+
+def run_child(args) -> dict:
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+    sys.path.insert(0, PACKAGE_DIR)
+
+    started = time.perf_counter()
+    if args.eager:
+        # 分析モジュールとopenpyxlを先頭で読み込んでいた従来の構成を再現する
+        import openpyxl  # noqa: F401
+        import comment_analyzer  # noqa: F401
+    import lambda_function
+    import_seconds = time.perf_counter() - started
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    objects = {f"jobs/{JOB_ID}.json": json.dumps({
+        'job_id': JOB_ID,
+        'status': 'processing',
+        'progress': 40,
+        'total_comments': 1000,
+        'processed_comments': 400,
+        'message': '分析中...',
+        'created_at': datetime.now().isoformat()
+    }).encode('utf-8')}
+    install_in_memory_s3(lambda_function.s3_client, lambda_function.JOB_BUCKET, objects)
+    event = {'httpMethod': 'POST', 'body': json.dumps({'get_status': True, 'job_id': JOB_ID})}
+
+    def poll():
+        poll_started = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"状況確認に失敗しました: {response}")
+        return time.perf_counter() - poll_started
+
+    first_poll = poll()
+    warm_polls = [poll() for _ in range(args.warm_polls)]
+    return {
+        'import_ms': round(import_seconds * 1000, 2),
+        'first_poll_ms': round(first_poll * 1000, 2),
+        'cold_total_ms': round((time.perf_counter() - PROCESS_STARTED - sum(warm_polls)) * 1000, 2),
+        'warm_poll_ms': round(statistics.median(warm_polls) * 1000, 3) if warm_polls else None,
+        'loaded_modules': [name for name in HEAVY_MODULES if name in sys.modules]
+    }
+
+def measure(args, eager: bool) -> dict:
+    runs = []
+    for _ in range(args.runs):
+        command = [sys.executable, os.path.abspath(__file__), '--child', '--warm-polls', str(args.warm_polls)]
+        if eager:
+            command.append('--eager')
+        started = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True, check=True)
+        run = json.loads(completed.stdout.strip().splitlines()[-1])
+        run['process_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        runs.append(run)
+
+    summary = {'loaded_modules': runs[-1]['loaded_modules'] if runs else []}
+    for key in ('import_ms', 'first_poll_ms', 'cold_total_ms', 'warm_poll_ms', 'process_ms'):
+        values = sorted(run[key] for run in runs if run[key] is not None)
+        if values:
+            summary[key] = {'median': round(statistics.median(values), 2), 'max': values[-1]}
+    return summary
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return 0
+
+    args.label = args.label or datetime.now().strftime('%Y%m%d-%H%M%S')
+    report = {
+        'label': args.label,
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'lazy': measure(args, eager=False),
+        'eager': measure(args, eager=True)
+    }
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"startup-{args.label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, title in (('lazy', '遅延読み込み'), ('eager', '一括読み込み（従来）')):
+        result = report[name]
+        print(f"{title}: import {result['import_ms']['median']}ms / 初回状況確認 {result['first_poll_ms']['median']}ms / "
+              f"起動から初回応答まで {result['cold_total_ms']['median']}ms / ウォーム時 {result['warm_poll_ms']['median']}ms "
+              f"(読み込み済み: {', '.join(result['loaded_modules']) or 'なし'})")
+    print(f"結果を保存しました: {output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import io
+import random
+from datetime import datetime, timedelta
+from openpyxl import Workbook
+
+MAX_COMMENT_COLUMNS = 7
+
+SUBJECTS = ['説明', 'スライド', '板書', '課題', '演習', '講義資料', '授業の進め方', '小テスト', '教室のマイク', '配布プリント']
+POSITIVE_PHRASES = ['がとても分かりやすかったです', 'が丁寧で理解しやすかったです', 'のおかげで興味が深まりました', 'が面白くて楽しかったです']
+NEGATIVE_PHRASES = ['が早すぎてついていけませんでした', 'の文字が小さくて読みにくかったです', 'の量が多すぎて大変でした', 'がもう少し具体的だと良かったです']
+NEUTRAL_PHRASES = ['について特に意見はありません', 'は前回と同じくらいでした', 'について次回も同じ形式でお願いします']
+DANGER_PHRASES = ['先生は本当に死ねばいいと思います', 'こんな授業をするやつはゴミです、消えろ', '講師がキモいので二度と来たくない']
+EMPTY_ANSWERS = ['特になし', 'なし', '']
+COMMON_ANSWERS = ['とても分かりやすい授業でした。ありがとうございました。', '特にありません。来週もよろしくお願いします。']
+CLOSINGS = ['', '来週もよろしくお願いします。', '次回の授業も楽しみにしています。', '改善をお願いします。']
+
+def generate_comment(rng: random.Random, danger_rate: float = 0.01, empty_rate: float = 0.1, duplicate_rate: float = 0.1):
+    roll = rng.random()
+    if roll < empty_rate:
+        return rng.choice(EMPTY_ANSWERS)
+    roll -= empty_rate
+    if roll < duplicate_rate:
+        return rng.choice(COMMON_ANSWERS)
+    roll -= duplicate_rate
+    if roll < danger_rate:
+        return rng.choice(DANGER_PHRASES) + '。'
+
+    subject = rng.choice(SUBJECTS)
+    phrases = rng.choice([POSITIVE_PHRASES, NEGATIVE_PHRASES, NEUTRAL_PHRASES])
+    sentences = [f'{subject}{rng.choice(phrases)}。' for _ in range(rng.randint(1, 3))]
+    return ''.join(sentences) + rng.choice(CLOSINGS)
+
+def generate_workbook(rows: int, comment_columns: int = 3, metadata_columns: int = 2, seed: int = 0,
+                      danger_rate: float = 0.01, empty_rate: float = 0.1, duplicate_rate: float = 0.1,
+                      changed_rate: float = 0.0) -> bytes:
+    # load_excel_dataは最後の7列をコメント列として読むため、コメント列は末尾に並べる
+    if not 1 <= comment_columns <= MAX_COMMENT_COLUMNS:
+        raise ValueError(f"コメント列数は1〜{MAX_COMMENT_COLUMNS}で指定してください: {comment_columns}")
+
+    rng = random.Random(seed)
+    # 回答を書き換える行は別の乱数列で選び、行数や書き換え率を変えても他の行の内容は同じにする
+    change_rng = random.Random(f'{seed}-changed')
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    metadata_headers = ['回答ID', '回答日時', '学年', '学部', '出席回数'][:metadata_columns]
+    metadata_headers += [f'属性{i}' for i in range(len(metadata_headers), metadata_columns)]
+    ws.append(metadata_headers + [f'質問{i + 1}: 授業の感想を自由に記入してください' for i in range(comment_columns)])
+
+    started = datetime(2024, 4, 1, 9, 0)
+    for row in range(rows):
+        metadata = [row + 1, started + timedelta(minutes=row), rng.randint(1, 4), rng.choice(['理', '工', '文', '経']), rng.randint(1, 15)]
+        metadata = (metadata + [rng.randint(0, 9) for _ in range(metadata_columns)])[:metadata_columns]
+        comments = [generate_comment(rng, danger_rate, empty_rate, duplicate_rate) for _ in range(comment_columns)]
+        if change_rng.random() < changed_rate:
+            comments = [generate_comment(change_rng, danger_rate, 0.0, 0.0) + '（追記あり）' for _ in range(comment_columns)]
+        ws.append(metadata + comments)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
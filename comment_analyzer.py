@@ -1,206 +1,779 @@
 import logging
 import boto3
 import json
-import re
 import io
-from openpyxl import load_workbook
-from typing import List, Dict, Tuple
+import itertools
+import os
+import time
+import threading
+import unicodedata
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.exceptions import ClientError
+from typing import Tuple
+from analysis_cache import make_cache_key
+from bedrock_resilience import ResilientInvoker, BedrockUnavailableError, error_code
+from live_statistics import StatisticsAggregator
+from prescreen import RiskEstimator
+from job_metrics import JobMetrics
+from prompt_templates import get_prompt_template
+from result_store import ResultColumns, SOURCE_FIELDS
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class CommentAnalyzer:
-    def __init__(self):
-        self.bedrock_client = boto3.client('bedrock-runtime', region_name='ap-northeast-1')
-        self.model_id = "anthropic.claude-instant-v1"
+DEFAULT_MAX_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+MAX_REQUEUE_ROUNDS = 2
+
+INPUT_TOKEN_BUDGET = 2000
+OUTPUT_TOKEN_BUDGET = 4000
+OUTPUT_TOKENS_PER_COMMENT = 80
+MAX_BATCH_SIZE = 20
+MAX_REPAIR_REQUESTS = 2
+STREAM_CHUNK_SIZE = 50
+# 実行待ちのバッチを溜めすぎると中断時に止められないため、投入数は同時実行数の2倍までにする
+MAX_IN_FLIGHT_PER_WORKER = 2
+# 完了待ちでも中断の判定を止めないよう、一定時間ごとに待機から戻る
+COLLECT_WAIT_SECONDS = 2
+TEST_MODE_LIMIT = 100
+DANGER_FIRST_WINDOW = 1000
+
+CACHEABLE_FIELDS = (
+    'sentiment', 'sentiment_score', 'category', 'category_confidence',
+    'is_dangerous', 'danger_score', 'importance_score'
+)
+
+BEDROCK_REGION = 'ap-northeast-1'
+BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-instant-v1')
+
+_bedrock_client = None
+_bedrock_client_lock = threading.Lock()
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm')
+MAX_ARCHIVE_WORKBOOKS = 200
+# 展開後のサイズはZIPのヘッダーから読み込む前に判定し、圧縮率の極端なファイルでメモリを使い切らないようにする
+MAX_ARCHIVE_MEMBER_BYTES = int(os.environ.get('MAX_ARCHIVE_MEMBER_BYTES', str(50 * 1024 * 1024)))
+MAX_ARCHIVE_TOTAL_BYTES = int(os.environ.get('MAX_ARCHIVE_TOTAL_BYTES', str(500 * 1024 * 1024)))
+
+SENTIMENT_LABELS = ('positive', 'negative', 'neutral')
+CATEGORY_LABELS = ('講義内容', '講義資料', '運営', 'その他')
+SCORE_FIELDS = ('sentiment_score', 'category_confidence', 'danger_score', 'importance_score')
+
+class AnalysisSuspended(Exception):
+    def __init__(self, processed_count: int, call_stats: dict = None):
+        super().__init__(f"分析を中断しました（{processed_count}件完了）")
+        self.processed_count = processed_count
+        self.call_stats = call_stats
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, max_limit: int, min_limit: int = 1, increase_after: int = 5):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.increase_after = increase_after
+        self._successes = 0
+        self._cond = threading.Condition()
+    
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+    
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self._successes = 0
+                logger.warning(f'スロットリング検知: 同時実行数を{self.limit}に縮小')
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+def estimate_tokens(text: str) -> int:
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4 + 1
+
+class BatchPacker:
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE):
+        self.max_items = max(1, min(max_batch_size, OUTPUT_TOKEN_BUDGET // OUTPUT_TOKENS_PER_COMMENT))
+        self._indices = []
+        self._batch = []
+        self._tokens = 0
+    
+    def add(self, index: int, comment_data: dict):
+        tokens = estimate_tokens(str(comment_data['comment']).strip())
+        full_batch = None
+        if self._batch and (self._tokens + tokens > INPUT_TOKEN_BUDGET or len(self._batch) >= self.max_items):
+            full_batch = self.flush()
+        self._indices.append(index)
+        self._batch.append(comment_data)
+        self._tokens += tokens
+        return full_batch
+    
+    def flush(self):
+        if not self._batch:
+            return None
+        full_batch = (self._indices, self._batch)
+        self._indices = []
+        self._batch = []
+        self._tokens = 0
+        return full_batch
+
+def pack_batches(comments: list, max_batch_size: int = MAX_BATCH_SIZE) -> list:
+    packer = BatchPacker(max_batch_size)
+    batches = []
+    for i, comment_data in enumerate(comments):
+        full_batch = packer.add(i, comment_data)
+        if full_batch:
+            batches.append(full_batch)
+    last_batch = packer.flush()
+    if last_batch:
+        batches.append(last_batch)
+    return [(indices[0], batch) for indices, batch in batches]
+
+def pack_requeued_batches(requeued: list, max_batch_size: int = MAX_BATCH_SIZE) -> list:
+    packer = BatchPacker(max_batch_size)
+    batches = []
+    for index, comment_data in sorted(requeued, key=lambda item: item[0]):
+        full_batch = packer.add(index, comment_data)
+        if full_batch:
+            batches.append(full_batch)
+    last_batch = packer.flush()
+    if last_batch:
+        batches.append(last_batch)
+    return batches
+
+def _iter_chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def normalize_for_dedup(text) -> str:
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    return ''.join(ch for ch in text if not (ch.isspace() or unicodedata.category(ch).startswith('P')))
+
+class DuplicateCollapser:
+    def __init__(self, on_duplicate=None):
+        self.comments = []
+        self.representatives = []
+        self.assignments = []
+        self.on_duplicate = on_duplicate
+        self._group_index = {}
+    
+    def iter_representatives(self, comments):
+        for comment_data in comments:
+            self.comments.append(comment_data)
+            key = normalize_for_dedup(comment_data['comment'])
+            if key not in self._group_index:
+                self._group_index[key] = len(self.representatives)
+                self.representatives.append(comment_data)
+                self.assignments.append(self._group_index[key])
+                yield comment_data
+            else:
+                self.assignments.append(self._group_index[key])
+                if self.on_duplicate:
+                    self.on_duplicate(comment_data, self._group_index[key])
+
+def collapse_duplicates(comments: list) -> Tuple[list, list]:
+    collapser = DuplicateCollapser()
+    for _ in collapser.iter_representatives(comments):
+        pass
+    return collapser.representatives, collapser.assignments
+
+def expand_duplicate_results(representative_results: ResultColumns, comments: list, assignments: list) -> ResultColumns:
+    # 代表コメントの結果を列ごとに複製し、行ごとに異なる項目だけを書き換える
+    results = representative_results.take(assignments)
+    for index, comment_data in enumerate(comments):
+        fields = {'comment': str(comment_data['comment']).strip()}
+        for field in ('row_id', 'column_name'):
+            if field in comment_data:
+                fields[field] = comment_data[field]
+        results.update(index, copy_source_fields(fields, comment_data))
+    return results
+
+def copy_source_fields(result: dict, comment_data: dict) -> dict:
+    for field in SOURCE_FIELDS:
+        if field in comment_data:
+            result[field] = comment_data[field]
+    return result
+
+def validate_result_item(raw: dict):
+    try:
+        sentiment = str(raw.get('sentiment', '')).strip().lower()
+        if sentiment not in SENTIMENT_LABELS or 'danger_score' not in raw:
+            return None
         
-    def analyze_comments_lambda(self, comments: list, progress_callback=None) -> list:
-        results = []
-        total_comments = len(comments)
+        item = {'sentiment': sentiment}
+        for field in SCORE_FIELDS:
+            if field in raw:
+                item[field] = min(1.0, max(0.0, float(raw[field])))
+        
+        category = str(raw.get('category', 'その他')).strip()
+        item['category'] = category if category in CATEGORY_LABELS else 'その他'
+        
+        is_dangerous = raw.get('is_dangerous', item['danger_score'] >= 0.7)
+        if isinstance(is_dangerous, str):
+            is_dangerous = is_dangerous.strip().lower() == 'true'
+        item['is_dangerous'] = bool(is_dangerous)
+        return item
+    except (TypeError, ValueError):
+        return None
+
+def _parse_item_id(value, expected_count: int):
+    try:
+        item_id = int(str(value).strip().strip('[]'))
+    except (TypeError, ValueError):
+        return None
+    return item_id if 1 <= item_id <= expected_count else None
+
+class StreamingResultParser:
+    def __init__(self, expected_count: int):
+        self.expected_count = expected_count
+        self.items = [None] * expected_count
+        self.unnumbered = []
+        self.invalid_count = 0
+        self.received_text = False
+        self._text = ''
+        self._scan_pos = 0
+        self._starts = []
+        self._in_string = False
+        self._escaped = False
+    
+    def feed(self, text: str) -> list:
+        if not text:
+            return []
+        self.received_text = self.received_text or bool(text.strip())
+        self._text += text
+        placed = []
+        
+        for pos in range(self._scan_pos, len(self._text)):
+            ch = self._text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._starts:
+                self._in_string = True
+            elif ch == '{':
+                self._starts.append(pos)
+            elif ch == '}' and self._starts:
+                start = self._starts.pop()
+                placed.extend(self._accept(self._text[start:pos + 1]))
+        
+        if self._starts:
+            self._scan_pos = len(self._text)
+        else:
+            self._text = ''
+            self._scan_pos = 0
+        return placed
+    
+    def _accept(self, fragment: str) -> list:
+        try:
+            raw = json.loads(fragment)
+        except ValueError:
+            if '"sentiment"' in fragment:
+                self.invalid_count += 1
+            return []
+        if not isinstance(raw, dict) or 'sentiment' not in raw:
+            return []
+        
+        item = validate_result_item(raw)
+        if item is None:
+            self.invalid_count += 1
+            return []
+        
+        if 'id' not in raw:
+            self.unnumbered.append(item)
+            return []
         
-        logger.info(f'AWS Bedrock分析開始: {total_comments}件')
+        item_id = _parse_item_id(raw['id'], self.expected_count)
+        if item_id is None or self.items[item_id - 1] is not None:
+            self.invalid_count += 1
+            return []
+        self.items[item_id - 1] = item
+        return [(item_id - 1, item)]
+    
+    def finish(self) -> list:
+        if self.unnumbered and all(item is None for item in self.items) and len(self.unnumbered) in (self.expected_count, 1):
+            for offset, item in enumerate(self.unnumbered[:self.expected_count]):
+                self.items[offset] = item
         
-        batch_size = 2
+        missing_count = sum(1 for item in self.items if item is None)
+        if missing_count or self.invalid_count:
+            logger.warning(f"結果パース: {self.expected_count - missing_count}/{self.expected_count}件取得 (不正{self.invalid_count}件)")
+        return self.items
+
+class BatchResponse:
+    # 1回の呼び出し（ヘッジ・リトライの試行ごと）の受信状態
+    def __init__(self, expected_count: int, on_item=None):
+        self.parser = StreamingResultParser(expected_count)
+        self.on_item = on_item
+        self.usage = {}
+        self.completion_parts = []
+        self.parse_seconds = 0.0
+        self.stop_reason = None
+    
+    def feed(self, text):
+        self.completion_parts.append(text)
+        started = time.perf_counter()
+        placed = self.parser.feed(text)
+        self.parse_seconds += time.perf_counter() - started
+        if self.on_item:
+            for position, item in placed:
+                self.on_item(position, item)
+
+def get_bedrock_client():
+    # boto3のクライアントはスレッドセーフなため、ウォーム起動時はジョブをまたいで使い回す
+    global _bedrock_client
+    with _bedrock_client_lock:
+        if _bedrock_client is None:
+            _bedrock_client = boto3.client('bedrock-runtime', region_name=BEDROCK_REGION)
+        return _bedrock_client
+
+class CommentAnalyzer:
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, cache=None, prescreener=None, streaming: bool = True, metrics=None,
+                 prompt_template=None, base_results=None):
+        self.bedrock_client = get_bedrock_client()
+        self.model_id = BEDROCK_MODEL_ID
+        self.template = get_prompt_template(prompt_template)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.cache = cache
+        self.prescreener = prescreener
+        self.base_results = base_results
+        self.streaming = streaming
+        self.metrics = metrics if metrics is not None else JobMetrics()
+        self.results = None
+        self._streamed = {}
+        self._streamed_lock = threading.Lock()
+        self._result_callback = None
+        self.on_result = None
+        self._batch_item_cap = MAX_BATCH_SIZE
+        self._batch_cap_lock = threading.Lock()
+        self.invoker = ResilientInvoker(self._invoke_model, self.max_concurrency)
+        self.call_stats = {'rerequested_items': 0, 'repair_requests': 0, 'requeued_items': 0, 'default_items': 0, 'stream_fallbacks': 0}
+        self._call_stats_lock = threading.Lock()
+        
+    def analyze_comments_lambda(self, comments, progress_callback=None, completed_results=None, checkpoint_callback=None, should_stop=None) -> ResultColumns:
+        logger.info(f'AWS Bedrock分析開始 (最大同時実行数: {self.max_concurrency})')
+        
+        completed_results = completed_results or {}
+        # 確定した結果は1件ずつの辞書で溜めず、読み込み時に確保した列へ番号を指定して書き込む
+        results = self.results = ResultColumns()
+        cache_keys = []
+        futures = {}
+        queued = deque()
+        max_in_flight = self.max_concurrency * MAX_IN_FLIGHT_PER_WORKER
+        requeue = []
+        requeue_rounds = 0
         processed_count = 0
+        batch_count = 0
+        suspended = False
+        
+        packer = BatchPacker(self._batch_item_cap)
+        limiter = AdaptiveConcurrencyLimiter(self.max_concurrency)
+        self._result_callback = checkpoint_callback
         
-        for i in range(0, total_comments, batch_size):
-            batch = comments[i:i + batch_size]
-            batch_results = self._analyze_batch_with_bedrock(batch, i)
-            results.extend(batch_results)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            def submit(full_batch):
+                indices, batch = full_batch
+                futures[executor.submit(self._dispatch_batch, limiter, batch, indices)] = full_batch
             
-            processed_count += len(batch)
-            actual_processed = min(processed_count, total_comments)
+            def stop_requested():
+                if should_stop is None or not should_stop():
+                    return False
+                # 実行中のバッチもリトライ・回復待ちを打ち切り、チェックポイントを保存して継続できるようにする
+                self.invoker.stop()
+                return True
             
-            if progress_callback:
-                progress_callback(actual_processed, total_comments, f"分析進捗: {actual_processed}/{total_comments}件完了")
+            try:
+                for chunk in _iter_chunks(comments, STREAM_CHUNK_SIZE):
+                    if stop_requested():
+                        suspended = True
+                        break
+                    
+                    base_index = len(results)
+                    results.grow(len(chunk))
+                    
+                    # 差分分析では基準ジョブと同じ行・列・内容のコメントは結果をそのまま引き継ぐ
+                    base_values = [None] * len(chunk)
+                    if self.base_results is not None:
+                        with self.metrics.stage('base_lookup'):
+                            base_values = [self.base_results.lookup(c) for c in chunk]
+                    
+                    local_values = [None] * len(chunk)
+                    if self.prescreener is not None:
+                        with self.metrics.stage('prescreen'):
+                            local_values = [self.prescreener.classify(c['comment']) if base is None else None
+                                            for c, base in zip(chunk, base_values)]
+                    
+                    cached_values = [None] * len(chunk)
+                    if self.cache is not None:
+                        with self.metrics.stage('cache_lookup'):
+                            chunk_keys = [make_cache_key(c['comment'], self.template.version, self.model_id) for c in chunk]
+                            cache_keys.extend(chunk_keys)
+                            lookups = [offset for offset, (local, base) in enumerate(zip(local_values, base_values))
+                                       if local is None and base is None and base_index + offset not in completed_results]
+                            for offset, cached in zip(lookups, self.cache.get_many([chunk_keys[offset] for offset in lookups])):
+                                cached_values[offset] = cached
+                    
+                    resolved = {}
+                    for offset, (comment_data, base, local, cached) in enumerate(zip(chunk, base_values, local_values, cached_values)):
+                        index = base_index + offset
+                        if index in completed_results:
+                            result = results[index] = completed_results[index]
+                            self._record_result(index, result)
+                            processed_count += 1
+                            continue
+                        if base is not None:
+                            result = results[index] = resolved[index] = self._build_base_result(base, comment_data)
+                            self._record_result(index, result)
+                            processed_count += 1
+                            continue
+                        if local is not None:
+                            result = results[index] = resolved[index] = self._build_local_result(local, comment_data, index)
+                            self._record_result(index, result)
+                            processed_count += 1
+                            continue
+                        if cached is not None:
+                            result = results[index] = resolved[index] = self._build_result(cached, comment_data, index, source='cache')
+                            self._record_result(index, result)
+                            processed_count += 1
+                            continue
+                        full_batch = packer.add(index, comment_data)
+                        if full_batch:
+                            queued.append(full_batch)
+                            batch_count += 1
+                    
+                    if checkpoint_callback and resolved:
+                        checkpoint_callback(resolved)
+                    
+                    processed_count += self._collect_batches(futures, results, cache_keys, requeue, checkpoint_callback, block=False)
+                    # 投入枠が空くまで読み込みを止め、待っている間も中断を判定する
+                    while queued:
+                        while queued and len(futures) < max_in_flight:
+                            submit(queued.popleft())
+                        if not queued:
+                            break
+                        if stop_requested():
+                            suspended = True
+                            break
+                        processed_count += self._collect_batches(futures, results, cache_keys, requeue, checkpoint_callback, block=True)
+                    if progress_callback:
+                        progress_callback(processed_count, len(results), f"分析進捗: {processed_count}/{len(results)}件完了（読み込み中）")
+                    if suspended:
+                        break
+                
+                if not suspended:
+                    last_batch = packer.flush()
+                    if last_batch:
+                        queued.append(last_batch)
+                        batch_count += 1
+                    logger.info(f'読み込み完了: {len(results)}件 / バッチ数: {batch_count}')
+                
+                total_comments = len(results)
+                
+                while futures or queued or (requeue and not suspended and requeue_rounds < MAX_REQUEUE_ROUNDS):
+                    if not futures and not queued:
+                        requeue_rounds += 1
+                        self._record_call_stats(requeued_items=len(requeue))
+                        logger.warning(f'失敗した{len(requeue)}件を再キューします ({requeue_rounds}/{MAX_REQUEUE_ROUNDS}回目)')
+                        queued.extend(pack_requeued_batches(requeue, self._batch_item_cap))
+                        requeue.clear()
+                    
+                    if not suspended and stop_requested():
+                        suspended = True
+                    if suspended:
+                        queued.clear()
+                        for future in [f for f in futures if f.cancel()]:
+                            futures.pop(future)
+                    while queued and len(futures) < max_in_flight:
+                        submit(queued.popleft())
+                    
+                    processed_count += self._collect_batches(futures, results, cache_keys, requeue, checkpoint_callback, block=True)
+                    
+                    if progress_callback:
+                        progress_callback(processed_count, total_comments, f"分析進捗: {processed_count}/{total_comments}件完了")
+                    
+                    logger.info(f'分析進捗: {processed_count}/{total_comments}件完了')
             
-            logger.info(f'分析進捗: {actual_processed}/{total_comments}件完了')
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                self.invoker.close()
+        
+        if suspended:
+            logger.info(f'実行時間の上限が近いため分析を中断します: {processed_count}件完了')
+            raise AnalysisSuspended(processed_count, self.get_call_stats())
+        
+        if requeue:
+            self._record_call_stats(default_items=len(requeue))
+            logger.error(f'再キュー後も分析できなかった{len(requeue)}件に既定値を使用します')
+            for index, comment_data in requeue:
+                result = results[index] = self._create_default_results([comment_data], index)[0]
+                self._record_result(index, result)
         
         logger.info(f'分析完了: {len(results)}件')
         return results
     
-    def _analyze_batch_with_bedrock(self, batch_comments: list, start_index: int) -> list:
-        try:
-            prompt = self._build_analysis_prompt(batch_comments)
-            
-            response = self.bedrock_client.invoke_model(
-                modelId=self.model_id,
-                body=json.dumps({
-                    "prompt": f"Human: {prompt}\n\nAssistant:",
-                    "max_tokens_to_sample": 4000,
-                    "temperature": 0.1,
-                    "top_p": 0.9,
-                    "stop_sequences": ["Human:", "Assistant:"]
-                })
-            )
+    def _collect_batches(self, futures: dict, results: ResultColumns, cache_keys: list, requeue: list, checkpoint_callback=None, block: bool = False) -> int:
+        if not futures:
+            return 0
+        
+        done, _ = wait(list(futures), timeout=COLLECT_WAIT_SECONDS if block else 0, return_when=FIRST_COMPLETED)
+        collected = 0
+        completed = {}
+        
+        for future in done:
+            indices, batch = futures.pop(future)
+            for index, comment_data, result in zip(indices, batch, future.result()):
+                if result is None:
+                    requeue.append((index, comment_data))
+                    continue
+                results[index] = result
+                self._record_result(index, result)
+                collected += 1
+                if not self._take_streamed(index, result):
+                    completed[index] = result
+                if cache_keys and result['danger_reasons'] != "分析エラー":
+                    with self.metrics.stage('cache_write'):
+                        self.cache.set(cache_keys[index], {field: result[field] for field in CACHEABLE_FIELDS})
+        
+        if checkpoint_callback and completed:
+            checkpoint_callback(completed)
+        
+        return collected
+    
+    def _dispatch_batch(self, limiter: AdaptiveConcurrencyLimiter, batch_comments: list, indices: list) -> list:
+        cap = self._batch_item_cap
+        if len(batch_comments) > cap:
+            results = []
+            for offset in range(0, len(batch_comments), cap):
+                results.extend(self._dispatch_batch(limiter, batch_comments[offset:offset + cap], indices[offset:offset + cap]))
+            return results
+        
+        parsed = [None] * len(batch_comments)
+        pending = list(range(len(batch_comments)))
+        
+        for request_round in range(MAX_REPAIR_REQUESTS + 1):
+            if request_round:
+                self._record_call_stats(rerequested_items=len(pending), repair_requests=1)
+                logger.warning(f"欠落・不正な{len(pending)}件を再リクエストします: index={indices[0]}")
             
-            response_body = json.loads(response['body'].read())
-            analysis_text = response_body.get('completion', '')
+            request_offsets = list(pending)
             
-            if not analysis_text or analysis_text.strip() == "":
-                logger.error("Bedrockからの応答が空です")
-                return self._create_default_results(batch_comments, start_index)
+            def on_item(position, item):
+                offset = request_offsets[position]
+                self._emit_streamed(indices[offset], self._build_result(item, batch_comments[offset], indices[offset]))
             
-            return self._parse_batch_results(analysis_text, batch_comments, start_index)
+            try:
+                items = self._analyze_batch_with_bedrock(limiter, [batch_comments[offset] for offset in pending], on_item)
+            except BedrockUnavailableError as e:
+                logger.error(f"Bedrockが応答しないため{len(pending)}件を後で再試行します: {e}")
+                return [self._build_result(item, comment_data, index) if item is not None else None
+                        for comment_data, item, index in zip(batch_comments, parsed, indices)]
+            if items is None:
+                break
             
-        except Exception as e:
-            logger.error(f"Bedrock分析エラー: {e}")
-            return self._create_default_results(batch_comments, start_index)
-    
-    def _build_analysis_prompt(self, batch_comments: list) -> str:
-        comments_text = ""
-        for i, comment_data in enumerate(batch_comments):
-            comment = str(comment_data['comment']).strip()
-            comments_text += f"{i+1}. {comment}\n"
-        
-        prompt = f"""以下の講義コメントを大学運営の観点から分析してください。
-
-{comments_text}
-
-各コメントについて、以下の形式のJSON配列で回答してください:
-[
-  {{
-    "sentiment": "positive",
-    "sentiment_score": 0.8,
-    "category": "講義内容",
-    "category_confidence": 0.9,
-    "is_dangerous": false,
-    "danger_score": 0.1,
-    "importance_score": 0.7
-  }}
-]
-
-分析基準:
-1. sentiment: "positive"(肯定的), "negative"(否定的), "neutral"(中立)
-2. category: 必ず「講義内容」「講義資料」「運営」「その他」のいずれかを選択
-
-3. 危険コメント判定基準（講義運営の観点）:
-   以下に該当する場合はis_dangerous: true、danger_score: 0.7以上に設定:
-
-   【誹謗中傷・人格攻撃】
-   - 講師・教員への人格否定、侮辱、悪口
-   - 他の学生への攻撃的言及
-   - 個人の外見・能力・人格への中傷
-
-   【運営への攻撃・悪口】
-   - 大学・学部・学科・授業運営への不当な攻撃
-   - 運営方針への建設的でない批判
-   - システムや制度への破壊的批判
-
-   【運営妨害行為】
-   - 授業妨害を示唆する内容
-   - 他学生の学習を妨げる行為の示唆
-   - 破壊的・反社会的行為の提案
-
-   【不適切な言葉遣い】
-   - 汚い言葉、罵詈雑言
-   - 差別的表現、ヘイトスピーチ
-   - 暴力的・脅迫的表現
-   - 性的・わいせつな表現
-   - 「死ね」「殺す」「バカ」「クソ」「ムカつく」「最悪」「ひどい」「うざい」など
-
-4. danger_score設定:
-   - 0.9-1.0: 緊急対応必要（脅迫・暴力的表現）
-   - 0.8-0.9: 即座に対応必要（人格攻撃・誹謗中傷）
-   - 0.7-0.8: 要注意（運営攻撃・不適切言葉）
-   - 0.5-0.7: 注意（建設的でない強い批判）
-   - 0.0-0.5: 安全（建設的意見・要望）
-
-5. importance_score: コメントの重要度（0.0-1.0）
-
-注意：「つまらない」「わからない」「嫌い」「やめたい」程度でも、文脈や表現によっては危険度0.5-0.7として判定してください。攻撃的な表現や感情的な否定は積極的に危険と判定してください。"""
-        
-        return prompt
-    
-    def _parse_batch_results(self, analysis_text: str, batch_comments: list, start_index: int) -> list:
+            for offset, item in zip(pending, items):
+                parsed[offset] = item
+            pending = [offset for offset in pending if parsed[offset] is None]
+            if not pending:
+                break
+        
+        if pending:
+            self._record_call_stats(default_items=len(pending))
+            logger.error(f"{len(pending)}件の分析結果を取得できなかったため既定値を使用します: index={indices[0]}")
+            # 再リクエストしても件数が揃わないバッチは、出力途切れ以外でも詰め込みすぎとみなして上限を下げる
+            if items is not None and len(batch_comments) > 1:
+                self._shrink_batch_cap(len(batch_comments))
+        
         results = []
+        for comment_data, item, index in zip(batch_comments, parsed, indices):
+            if item is None:
+                results.extend(self._create_default_results([comment_data], index))
+            else:
+                results.append(self._build_result(item, comment_data, index))
+        return results
+    
+    def _record_result(self, index: int, result: dict):
+        if self.on_result is not None:
+            self.on_result(index, result)
+    
+    def _emit_streamed(self, index: int, result: dict):
+        if self._result_callback is None:
+            return
+        with self._streamed_lock:
+            self._streamed[index] = result
+        self._result_callback({index: result})
+    
+    def _take_streamed(self, index: int, result: dict) -> bool:
+        # ヘッジ・リトライで別の試行の結果が採用された場合は、途中で書き込んだ結果を上書きさせる
+        with self._streamed_lock:
+            return self._streamed.pop(index, None) == result
+    
+    def _invoke_model(self, stream: bool = False, **kwargs):
+        if stream:
+            return self.bedrock_client.invoke_model_with_response_stream(**kwargs)
+        return self.bedrock_client.invoke_model(**kwargs)
+    
+    def _record_call_stats(self, **counts):
+        with self._call_stats_lock:
+            for key, value in counts.items():
+                self.call_stats[key] += value
+    
+    def get_call_stats(self) -> dict:
+        with self._call_stats_lock:
+            stats = dict(self.call_stats)
+        stats.update(self.invoker.stats())
+        return stats
+    
+    def _shrink_batch_cap(self, failed_size: int):
+        with self._batch_cap_lock:
+            self._batch_item_cap = max(1, min(self._batch_item_cap, failed_size // 2))
+            logger.info(f'バッチ上限を{self._batch_item_cap}件に縮小')
+    
+    def _analyze_batch_with_bedrock(self, limiter: AdaptiveConcurrencyLimiter, batch_comments: list, on_item=None):
+        streaming = self.streaming
+        attempts = []
+        
+        def read(response):
+            # 生成の読み込みまでを呼び出しの中で行い、同時実行枠とリトライ・ヘッジの対象に含める
+            batch_response = BatchResponse(len(batch_comments), on_item)
+            attempts.append(batch_response)
+            if streaming:
+                batch_response.stop_reason = self._read_completion_stream(response['body'], batch_response.feed, batch_response.usage)
+            else:
+                response_body = json.loads(response['body'].read())
+                headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+                completion, batch_response.stop_reason, response_usage = self.template.parse_response(response_body, headers)
+                batch_response.usage.update(response_usage)
+                batch_response.feed(completion)
+            return batch_response
         
         try:
-            json_patterns = [
-                r'\[[\s\S]*?\]',
-                r'\{[\s\S]*?\}',
-                r'```json\s*([\s\S]*?)\s*```',
-                r'```\s*([\s\S]*?)\s*```'
-            ]
+            with self.metrics.stage('prompt_build'):
+                request, prompt = self.template.build_request(batch_comments, self.model_id, OUTPUT_TOKEN_BUDGET)
             
-            json_str = None
-            for pattern in json_patterns:
-                match = re.search(pattern, analysis_text, re.DOTALL)
-                if match:
-                    if 'json' in pattern:
-                        json_str = match.group(1).strip()
-                    else:
-                        json_str = match.group(0).strip()
-                    break
+            call_started = time.perf_counter()
+            batch_response = self.invoker.invoke(
+                limiter,
+                read=read,
+                stream=streaming,
+                modelId=self.model_id,
+                body=json.dumps(request)
+            )
             
-            if not json_str:
-                logger.warning("JSON形式が見つかりません")
-                return self._create_default_results(batch_comments, start_index)
+            self._record_call_metrics(time.perf_counter() - call_started, batch_response.parse_seconds, prompt,
+                                      ''.join(batch_response.completion_parts), batch_response.usage, len(batch_comments))
             
-            if json_str.startswith('{') and json_str.endswith('}'):
-                json_str = f"[{json_str}]"
+            if batch_response.stop_reason == 'max_tokens' and len(batch_comments) > 1:
+                logger.warning(f"出力がトークン上限で途切れました ({len(batch_comments)}件)")
+                self._shrink_batch_cap(len(batch_comments))
             
-            parsed_results = json.loads(json_str)
+            if not batch_response.parser.received_text:
+                logger.error("Bedrockからの応答が空です")
             
-            if len(parsed_results) != len(batch_comments):
-                while len(parsed_results) < len(batch_comments):
-                    parsed_results.append({
-                        'sentiment': 'neutral',
-                        'sentiment_score': 0.5,
-                        'category': 'その他',
-                        'category_confidence': 0.5,
-                        'is_dangerous': False,
-                        'danger_score': 0.1,
-                        'importance_score': 0.5
-                    })
+            return batch_response.parser.finish()
             
-            for i, (result, comment_data) in enumerate(zip(parsed_results, batch_comments)):
-                structured_result = {
-                    'comment': str(comment_data['comment']).strip(),
-                    'row_id': comment_data.get('row_id', start_index + i),
-                    'column_name': comment_data.get('column_name', 'comment'),
-                    'sentiment': result.get('sentiment', 'neutral'),
-                    'sentiment_score': float(result.get('sentiment_score', 0.5)),
-                    'category': result.get('category', 'その他'),
-                    'category_confidence': float(result.get('category_confidence', 0.5)),
-                    'is_dangerous': bool(result.get('is_dangerous', False)),
-                    'danger_score': float(result.get('danger_score', 0.1)),
-                    'danger_reasons': f"危険度: {result.get('danger_score', 0.1)}",
-                    'importance_score': float(result.get('importance_score', 0.5)),
-                    'specificity_score': 0.8,
-                    'urgency_score': 0.7,
-                    'commonality_score': 0.6
-                }
-                results.append(structured_result)
-                
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析エラー: {e}")
-            results = self._create_default_results(batch_comments, start_index)
+        except BedrockUnavailableError as e:
+            # ストリーム途中のエラーでリトライが尽きた場合も、受信できた結果は採用して残りを再リクエストする
+            received = [attempt for attempt in attempts if attempt.parser.received_text]
+            if not received:
+                raise
+            best = max(received, key=lambda attempt: sum(item is not None for item in attempt.parser.items))
+            logger.error(f"Bedrock応答の受信が完了しませんでした（受信済みの結果は採用）: {e}")
+            return best.parser.finish()
         except Exception as e:
-            logger.error(f"結果パースエラー: {e}")
-            results = self._create_default_results(batch_comments, start_index)
-            
-        return results
+            if streaming and error_code(e) == 'AccessDeniedException':
+                logger.warning("ストリーミング呼び出しが許可されていないため通常の呼び出しに切り替えます")
+                self._record_call_stats(stream_fallbacks=1)
+                self.streaming = False
+                return self._analyze_batch_with_bedrock(limiter, batch_comments, on_item)
+            if attempts and attempts[-1].parser.received_text:
+                logger.error(f"Bedrock応答の受信中にエラーが発生しました（受信済みの結果は採用）: {e}")
+                return attempts[-1].parser.finish()
+            logger.error(f"Bedrock分析エラー: {e}")
+            return None
+    
+    def _read_completion_stream(self, event_stream, feed, usage: dict):
+        stop_reason = None
+        for event in event_stream:
+            if 'chunk' not in event:
+                # ストリーム途中のエラーイベントはコードを付けて投げ、スロットリング等はリトライさせる
+                name = next(iter(event), 'unknownStreamError')
+                raise ClientError({'Error': {'Code': name, 'Message': str(event.get(name))}}, 'InvokeModelWithResponseStream')
+            text, event_stop_reason, event_usage = self.template.parse_stream_event(json.loads(event['chunk']['bytes']))
+            feed(text)
+            stop_reason = event_stop_reason or stop_reason
+            usage.update(event_usage)
+        return stop_reason
+    
+    def _record_call_metrics(self, elapsed: float, parse_seconds: float, prompt: str, completion: str, usage: dict, batch_size: int = 0):
+        self.metrics.observe_latency('bedrock', elapsed)
+        self.metrics.add_time('bedrock', elapsed - parse_seconds)
+        self.metrics.add_time('parse', parse_seconds)
+        if 'inputTokenCount' in usage:
+            self.metrics.record_tokens(usage['inputTokenCount'], usage.get('outputTokenCount', 0), template=self.template.version,
+                                       comments=batch_size, cache_read=usage.get('cacheReadInputTokenCount', 0),
+                                       cache_write=usage.get('cacheWriteInputTokenCount', 0))
+        else:
+            self.metrics.record_tokens(estimate_tokens(prompt), estimate_tokens(completion), estimated=True,
+                                       template=self.template.version, comments=batch_size)
+    
+    def _parse_batch_results(self, analysis_text: str, expected_count: int) -> list:
+        parser = StreamingResultParser(expected_count)
+        parser.feed(analysis_text)
+        return parser.finish()
+    
+    def _build_local_result(self, local: dict, comment_data: dict, index: int) -> dict:
+        result = self._build_result(local, comment_data, index, source='local')
+        if local.get('matched_keywords'):
+            result['danger_reasons'] = f"キーワード検出: {', '.join(local['matched_keywords'])}"
+        return result
+    
+    def _build_base_result(self, base: dict, comment_data: dict) -> dict:
+        base['comment'] = str(comment_data['comment']).strip()
+        base['row_id'] = comment_data.get('row_id', base.get('row_id'))
+        base['column_name'] = comment_data.get('column_name', base.get('column_name'))
+        base['source'] = 'base'
+        return copy_source_fields(base, comment_data)
+    
+    def _build_result(self, result: dict, comment_data: dict, index: int, source: str = 'llm') -> dict:
+        return copy_source_fields({
+            'comment': str(comment_data['comment']).strip(),
+            'row_id': comment_data.get('row_id', index),
+            'column_name': comment_data.get('column_name', 'comment'),
+            'sentiment': result.get('sentiment', 'neutral'),
+            'sentiment_score': float(result.get('sentiment_score', 0.5)),
+            'category': result.get('category', 'その他'),
+            'category_confidence': float(result.get('category_confidence', 0.5)),
+            'is_dangerous': bool(result.get('is_dangerous', False)),
+            'danger_score': float(result.get('danger_score', 0.1)),
+            'danger_reasons': f"危険度: {result.get('danger_score', 0.1)}",
+            'importance_score': float(result.get('importance_score', 0.5)),
+            'specificity_score': 0.8,
+            'urgency_score': 0.7,
+            'commonality_score': 0.6,
+            'source': source
+        }, comment_data)
     
     def _create_default_results(self, batch_comments: list, start_index: int) -> list:
         results = []
@@ -219,93 +792,279 @@ class CommentAnalyzer:
                 'importance_score': 0.3,
                 'specificity_score': 0.5,
                 'urgency_score': 0.5,
-                'commonality_score': 0.5
+                'commonality_score': 0.5,
+                'source': 'llm'
             }
-            results.append(result)
+            results.append(copy_source_fields(result, comment_data))
         return results
 
-def analyze_comments(file_data, test_mode=False, progress_callback=None):
+def analyze_comments(file_data, test_mode=False, progress_callback=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, deduplicate=True,
+                     completed_results=None, checkpoint_callback=None, should_stop=None, prescreener=None, streaming=True, statistics=None,
+                     alerts=None, prioritize=False, metrics=None, prompt_template=None, all_sheets=None, base_results=None):
+    comment_stream = iter_file_comments(file_data, all_sheets=all_sheets)
+    statistics = statistics if statistics is not None else StatisticsAggregator()
+    metrics = metrics if metrics is not None else JobMetrics()
     try:
-        comments = load_excel_data(file_data)
-        logger.info(f"読み込み完了: {len(comments)}件のコメント")
-        
-        if not comments:
-            raise ValueError("コメントが見つかりませんでした。Excelファイルの内容を確認してください。")
-        
+        comments = metrics.timed_iter(comment_stream, 'load_excel')
         if test_mode:
-            comments = comments[:100]
-            logger.info("テストモード: 100件のみ処理")
-        
-        total_comments = len(comments)
+            comments = itertools.islice(comments, TEST_MODE_LIMIT)
+            logger.info(f"テストモード: {TEST_MODE_LIMIT}件のみ処理")
         
         if progress_callback:
-            progress_callback(0, total_comments, "分析を開始しています...")
+            progress_callback(0, 0, "分析を開始しています...")
         
-        analyzer = CommentAnalyzer()
-        logger.info(f"分析開始: {total_comments}件のコメントを処理します")
+        logger.info("分析開始: コメントを読み込みながら処理します")
+        results, dedup_stats, call_stats = analyze_comment_stream(
+            comments, progress_callback, max_concurrency, cache, deduplicate,
+            completed_results=completed_results,
+            checkpoint_callback=checkpoint_callback,
+            should_stop=should_stop,
+            prescreener=prescreener,
+            streaming=streaming,
+            statistics=statistics,
+            alerts=alerts,
+            prioritize=prioritize,
+            metrics=metrics,
+            prompt_template=prompt_template,
+            base_results=base_results
+        )
         
-        results = analyzer.analyze_comments_lambda(comments, progress_callback)
+        if not results:
+            raise ValueError("コメントが見つかりませんでした。Excelファイルの内容を確認してください。")
         
         logger.info(f"分析処理完了: {len(results)}件の結果を生成")
         
         if progress_callback:
-            progress_callback(total_comments, total_comments, "統計情報を計算中...")
-        
-        stats = calculate_statistics(results)
-        logger.info(f"統計計算完了: total={stats['total']}, positive={stats['positive']}, negative={stats['negative']}")
-        
-        response_data = {
-            'success': True,
-            'message': f'分析が完了しました（{len(results)}件処理）',
-            'statistics': stats,
-            'results': results
-        }
+            progress_callback(len(results), len(results), "統計情報を計算中...")
         
-        return response_data
+        with metrics.stage('statistics'):
+            response = build_analysis_response(results, dedup_stats, call_stats, statistics)
+        response['metrics'] = metrics.summary()
+        return response
                 
+    except AnalysisSuspended:
+        raise
     except Exception as e:
         logger.error(f"分析エラー: {str(e)}")
         raise e
+    finally:
+        comment_stream.close()
 
-def load_excel_data(file_content):
-    try:
-        if len(file_content) < 100:
-            raise ValueError("ファイルサイズが小さすぎます。有効なExcelファイルを選択してください。")
-        
-        wb = load_workbook(io.BytesIO(file_content))
-        ws = wb.active
+def analyze_comment_stream(comments, progress_callback=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, deduplicate=True,
+                           completed_results=None, checkpoint_callback=None, should_stop=None, prescreener=None, streaming=True,
+                           statistics=None, alerts=None, prioritize=False, metrics=None, prompt_template=None, base_results=None):
+    analyzer = CommentAnalyzer(max_concurrency=max_concurrency, cache=cache, prescreener=prescreener, streaming=streaming, metrics=metrics,
+                               prompt_template=prompt_template, base_results=base_results)
+    resume_options = {
+        'completed_results': completed_results,
+        'checkpoint_callback': checkpoint_callback,
+        'should_stop': should_stop
+    }
+    sinks = [sink for sink in (statistics, alerts) if sink is not None]
+    
+    def record(result, row=None):
+        for sink in sinks:
+            sink.add(result, row)
+    
+    order = None
+    if prioritize:
+        order = []
+        comments = prioritize_comments(comments, order)
+        logger.info(f"危険度の推定が高い順に分析します（{DANGER_FIRST_WINDOW}件ごとに並べ替え）")
+    
+    if not deduplicate:
+        if sinks:
+            analyzer.on_result = lambda index, result: record(result)
+        results = analyzer.analyze_comments_lambda(comments, progress_callback, **resume_options)
+        return restore_row_order(results, order), None, analyzer.get_call_stats()
+    
+    collapser = DuplicateCollapser()
+    
+    if sinks:
+        # 重複行は代表コメントの結果が確定した時点で行ごとに集計する
+        done_groups = set()
+        waiting_rows = {}
         
-        if ws.max_row < 2:
-            raise ValueError("Excelファイルにデータが見つかりません。最低2行（ヘッダー行+データ行）が必要です。")
+        def on_result(group, result):
+            done_groups.add(group)
+            record(result)
+            for comment_data in waiting_rows.pop(group, ()):
+                record(result, comment_data)
         
-        max_col = ws.max_column
-        if max_col < 1:
-            raise ValueError("Excelファイルに列が見つかりません。")
+        def on_duplicate(comment_data, group):
+            if group in done_groups:
+                # 確定した代表コメントの結果は辞書のまま持ち続けず、分析中の列から取り出す
+                record(analyzer.results[group], comment_data)
+            else:
+                waiting_rows.setdefault(group, []).append(comment_data)
         
-        comment_cols = max(1, max_col - 6) if max_col >= 7 else 1
+        analyzer.on_result = on_result
+        collapser.on_duplicate = on_duplicate
+    
+    unique_callback = None
+    if progress_callback:
+        def unique_callback(processed, total, message=""):
+            seen = len(collapser.comments)
+            scaled = round(processed * seen / total) if total else 0
+            progress_callback(scaled, seen, message)
+    
+    representative_results = analyzer.analyze_comments_lambda(collapser.iter_representatives(comments), unique_callback, **resume_options)
+    results = expand_duplicate_results(representative_results, collapser.comments, collapser.assignments)
+    
+    dedup_stats = {
+        'total_comments': len(collapser.comments),
+        'unique_comments': len(collapser.representatives),
+        'duplicates_collapsed': len(collapser.comments) - len(collapser.representatives),
+        'model_calls_saved': len(pack_batches(collapser.comments)) - len(pack_batches(collapser.representatives))
+    }
+    logger.info(f"重複統合: {dedup_stats['total_comments']}件 → {dedup_stats['unique_comments']}件 (推定{dedup_stats['model_calls_saved']}回の呼び出しを削減)")
+    
+    return restore_row_order(results, order), dedup_stats, analyzer.get_call_stats()
+
+def prioritize_comments(comments, order: list, window: int = DANGER_FIRST_WINDOW):
+    # 全件を読み込んでから並べ替えると先行送信できないため、先読みした範囲内で推定危険度の高い順に送る
+    estimator = RiskEstimator()
+    comments = iter(comments)
+    offset = 0
+    while True:
+        chunk = list(itertools.islice(comments, window))
+        if not chunk:
+            return
+        for index in estimator.order(chunk):
+            order.append(offset + index)
+            yield chunk[index]
+        offset += len(chunk)
+
+def restore_row_order(results: ResultColumns, order) -> ResultColumns:
+    if order is None:
+        return results
+    positions = [0] * len(results)
+    for position, index in enumerate(order):
+        positions[index] = position
+    return results.take(positions)
+
+def build_analysis_response(results, dedup_stats=None, call_stats=None, statistics=None):
+    if statistics is None or statistics.total != len(results):
+        statistics = StatisticsAggregator().add_many(results)
+    stats = statistics.snapshot()
+    logger.info(f"統計計算完了: total={stats['total']}, positive={stats['positive']}, negative={stats['negative']}")
+    
+    response_data = {
+        'success': True,
+        'message': f'分析が完了しました（{len(results)}件処理）',
+        'statistics': stats,
+        'source_stats': statistics.source_stats(),
+        'results': results
+    }
+    
+    if dedup_stats:
+        response_data['dedup_stats'] = dedup_stats
+    if call_stats:
+        response_data['call_stats'] = call_stats
+    
+    return response_data
+
+def load_excel_data(file_content, all_sheets=None):
+    return list(iter_file_comments(file_content, all_sheets=all_sheets))
+
+def iter_file_comments(files, all_sheets=None):
+    # 単一のExcel（バイト列・ファイル）か、(ファイル名, 内容)の並びを受け取り、ZIP内のExcelも展開して順に読む
+    # all_sheetsを指定しない場合、ZIP内のブックはすべてのシート、それ以外はアクティブシートのみを読む
+    if isinstance(files, (bytes, bytearray)) or hasattr(files, 'read'):
+        files = [(None, files)]
+    try:
+        for file_name, file_content in files:
+            for workbook_name, workbook, archived in iter_workbooks(file_name, file_content):
+                sheets = all_sheets if all_sheets is not None else archived
+                try:
+                    yield from iter_excel_comments(workbook, file_name=workbook_name, all_sheets=sheets)
+                except ValueError as e:
+                    if workbook_name is None:
+                        raise
+                    raise ValueError(f"{workbook_name}: {e}")
+    finally:
+        if hasattr(files, 'close'):
+            files.close()
+
+def iter_workbooks(file_name, file_content):
+    if isinstance(file_content, (bytes, bytearray)):
+        file_content = io.BytesIO(file_content)
+    
+    archive = None
+    try:
+        if zipfile.is_zipfile(file_content):
+            archive = zipfile.ZipFile(file_content)
+            # xlsx自体もZIP形式のため、[Content_Types].xmlを含むものはExcelファイルとして扱う
+            if '[Content_Types].xml' in archive.namelist():
+                archive.close()
+                archive = None
+    except (OSError, zipfile.BadZipFile):
+        archive = None
+    finally:
+        file_content.seek(0)
+    
+    if archive is None:
+        yield file_name, file_content, False
+        return
+    
+    with archive:
+        members = sorted(
+            (
+                info for info in archive.infolist()
+                if not info.is_dir()
+                and info.filename.lower().endswith(WORKBOOK_EXTENSIONS)
+                and not info.filename.startswith('__MACOSX/')
+                and not info.filename.rsplit('/', 1)[-1].startswith(('~$', '.'))
+            ),
+            key=lambda info: info.filename
+        )
+        if not members:
+            raise ValueError(f"{file_name or 'ZIPファイル'}: Excelファイル（.xlsx）が含まれていません")
+        if len(members) > MAX_ARCHIVE_WORKBOOKS:
+            raise ValueError(f"{file_name or 'ZIPファイル'}: Excelファイルが多すぎます（最大{MAX_ARCHIVE_WORKBOOKS}件）")
+        total_size = 0
+        for info in members:
+            if info.file_size > MAX_ARCHIVE_MEMBER_BYTES:
+                raise ValueError(f"{file_name or 'ZIPファイル'}: {info.filename}の展開後のサイズが大きすぎます（最大{MAX_ARCHIVE_MEMBER_BYTES // (1024 * 1024)}MB）")
+            total_size += info.file_size
+            if total_size > MAX_ARCHIVE_TOTAL_BYTES:
+                raise ValueError(f"{file_name or 'ZIPファイル'}: 展開後の合計サイズが大きすぎます（最大{MAX_ARCHIVE_TOTAL_BYTES // (1024 * 1024)}MB）")
+        logger.info(f"ZIPファイルを展開: {file_name or ''} ({len(members)}件のExcelファイル)")
+        for info in members:
+            yield info.filename, io.BytesIO(archive.read(info)), True
+
+def iter_excel_comments(file_content, file_name=None, all_sheets=False):
+    from openpyxl import load_workbook
+    
+    wb = None
+    try:
+        if hasattr(file_content, 'read'):
+            file_content.seek(0, io.SEEK_END)
+            file_size = file_content.tell()
+            file_content.seek(0)
+        else:
+            file_size = len(file_content)
+            file_content = io.BytesIO(file_content)
         
-        headers = {}
-        for col in range(comment_cols, max_col + 1):
-            header_cell = ws.cell(row=1, column=col)
-            if header_cell.value:
-                headers[col] = str(header_cell.value).strip()
-            else:
-                headers[col] = f'質問{col}'
+        if file_size < 100:
+            raise ValueError("ファイルサイズが小さすぎます。有効なExcelファイルを選択してください。")
         
-        comments = []
+        wb = load_workbook(file_content, read_only=True)
+        worksheets = wb.worksheets if all_sheets else [wb.active]
         
-        for row in ws.iter_rows(min_row=2, min_col=comment_cols, max_col=max_col):
-            for cell in row:
-                if cell.value and isinstance(cell.value, str) and len(cell.value.strip()) >= 10:
-                    question_title = headers.get(cell.column, f'質問{cell.column}')
-                    
-                    comments.append({
-                        'row_id': cell.row,
-                        'column_name': question_title,
-                        'comment': cell.value.strip()
-                    })
+        data_sheets = 0
+        for ws in worksheets:
+            source = {'sheet_name': ws.title}
+            if file_name:
+                source['file_name'] = file_name
+            data_rows = yield from iter_sheet_comments(ws, source)
+            if data_rows:
+                data_sheets += 1
+            elif len(worksheets) > 1:
+                logger.info(f"データのないシートをスキップ: {ws.title}")
         
-        return comments
+        if data_sheets == 0:
+            raise ValueError("Excelファイルにデータが見つかりません。最低2行（ヘッダー行+データ行）が必要です。")
         
     except Exception as e:
         error_msg = str(e)
@@ -317,24 +1076,45 @@ def load_excel_data(file_content):
             raise ValueError("ファイルが見つかりません。ファイルを再選択してください。")
         else:
             raise ValueError(f"Excelファイルの読み込みに失敗しました: {error_msg}")
+    finally:
+        if wb is not None:
+            wb.close()
+
+def iter_sheet_comments(ws, source: dict):
+    if ws.max_row is not None and ws.max_row < 2:
+        return 0
+    
+    rows = ws.iter_rows(values_only=True)
+    header_row = next(rows, None) or ()
+    
+    max_col = ws.max_column or len(header_row)
+    if max_col < 1:
+        return 0
+    
+    comment_cols = max(1, max_col - 6) if max_col >= 7 else 1
+    
+    headers = {}
+    for col in range(comment_cols, max_col + 1):
+        header_value = header_row[col - 1] if col <= len(header_row) else None
+        if header_value:
+            headers[col] = str(header_value).strip()
+        else:
+            headers[col] = f'質問{col}'
+    
+    data_rows = 0
+    for row_id, row in enumerate(rows, start=2):
+        data_rows += 1
+        for col in range(comment_cols, min(max_col, len(row)) + 1):
+            value = row[col - 1]
+            if value and isinstance(value, str) and len(value.strip()) >= 10:
+                comment_data = {
+                    'row_id': row_id,
+                    'column_name': headers.get(col, f'質問{col}'),
+                    'comment': value.strip()
+                }
+                comment_data.update(source)
+                yield comment_data
+    return data_rows
 
 def calculate_statistics(results):
-    total = len(results)
-    positive_count = sum(1 for r in results if r['sentiment'] == 'positive')
-    negative_count = sum(1 for r in results if r['sentiment'] == 'negative')
-    neutral_count = sum(1 for r in results if r['sentiment'] == 'neutral')
-    danger_count = sum(1 for r in results if r['is_dangerous'])
-    
-    categories = {}
-    for r in results:
-        cat = r['category']
-        categories[cat] = categories.get(cat, 0) + 1
-    
-    return {
-        'total': total,
-        'positive': positive_count,
-        'negative': negative_count,
-        'neutral': neutral_count,
-        'dangerous': danger_count,
-        'categories': categories
-    }
+    return StatisticsAggregator().add_many(results).snapshot()
@@ -143,7 +143,7 @@ deploy_lambda() {
     log_success "Lambda Layer作成完了: $LAYER_VERSION_ARN"
     
     log_info "Lambda関数パッケージを作成中..."
-    zip -r function.zip comment_analyzer.py lambda_function.py
+    zip -r function.zip comment_analyzer.py lambda_function.py analysis_cache.py prescreen.py bedrock_resilience.py live_statistics.py job_metrics.py job_store.py prompt_templates.py incremental.py result_store.py
     
     if aws lambda get-function --function-name $FUNCTION_NAME --region $REGION >/dev/null 2>&1; then
         log_info "既存のLambda関数の更新完了を確認中..."
@@ -297,6 +297,52 @@ create_job_bucket() {
         
         log_success "ジョブ管理バケット作成完了: $JOB_BUCKET"
     fi
+    
+    log_info "一時データ・分析キャッシュの有効期限ルールを設定中..."
+    aws s3api put-bucket-lifecycle-configuration \
+        --bucket $JOB_BUCKET \
+        --lifecycle-configuration '{
+            "Rules": [
+                {
+                    "ID": "expire-analysis-cache",
+                    "Filter": {"Prefix": "cache/"},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": 90}
+                },
+                {
+                    "ID": "expire-job-uploads",
+                    "Filter": {"Prefix": "temp/"},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": 7}
+                },
+                {
+                    "ID": "expire-checkpoints",
+                    "Filter": {"Prefix": "checkpoints/"},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": 7}
+                },
+                {
+                    "ID": "expire-shards",
+                    "Filter": {"Prefix": "shards/"},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": 7}
+                }
+            ]
+        }'
+    
+    log_info "ファイルアップロード・結果ダウンロード用のCORS設定を適用中..."
+    aws s3api put-bucket-cors \
+        --bucket $JOB_BUCKET \
+        --cors-configuration '{
+            "CORSRules": [
+                {
+                    "AllowedOrigins": ["*"],
+                    "AllowedMethods": ["GET", "PUT"],
+                    "AllowedHeaders": ["*"],
+                    "MaxAgeSeconds": 3000
+                }
+            ]
+        }'
 }
 
 cleanup_temp_files() {
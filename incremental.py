@@ -0,0 +1,67 @@
+import hashlib
+import logging
+from analysis_cache import normalize_cache_text
+from result_store import SOURCE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+def comment_hash(comment) -> str:
+    return hashlib.sha256(normalize_cache_text(comment).encode('utf-8')).hexdigest()
+
+def row_fingerprint(row: dict, source_fields=SOURCE_FIELDS) -> tuple:
+    return row_position(row, source_fields) + (comment_hash(row.get('comment', '')),)
+
+def row_position(row: dict, source_fields=SOURCE_FIELDS) -> tuple:
+    source = tuple(row.get(field) for field in source_fields)
+    return source + (row.get('row_id'), row.get('column_name'))
+
+class BaseResultIndex:
+    def __init__(self, base_job_id: str, rows, multiple_files: bool = False):
+        self.base_job_id = base_job_id
+        self._rows = {}
+        self._positions = set()
+        self.failed = 0
+        rows = list(rows)
+        # 再エクスポートしたファイルは名前が変わることが多いため、ファイル名は基準ジョブか今回のジョブが複数ファイルのときだけ照合に使う
+        match_file_name = multiple_files or len({row.get('file_name') for row in rows}) > 1
+        # 複数ファイル対応前のジョブの結果にはファイル名・シート名がないため、基準ジョブにある項目だけで照合する
+        first = rows[0] if rows else {}
+        self.source_fields = tuple(
+            field for field in SOURCE_FIELDS if field in first and (match_file_name or field != 'file_name')
+        )
+        for row in rows:
+            self._positions.add(row_position(row, self.source_fields))
+            # 分析エラーの既定値はキャッシュと同様に引き継がず、再分析する
+            if row.get('danger_reasons') == "分析エラー":
+                self.failed += 1
+                continue
+            self._rows.setdefault(row_fingerprint(row, self.source_fields), row)
+        logger.info(f"基準ジョブの結果を読み込み: {base_job_id} ({len(self._rows)}件, 分析エラー{self.failed}件は再分析)")
+
+    def __len__(self):
+        return len(self._rows)
+
+    def lookup(self, comment_data: dict):
+        row = self._rows.get(row_fingerprint(comment_data, self.source_fields))
+        return dict(row) if row is not None else None
+
+    def summarize(self, results) -> dict:
+        reused = changed = added = 0
+        positions = set()
+        for result in results:
+            position = row_position(result, self.source_fields)
+            positions.add(position)
+            if position + (comment_hash(result.get('comment', '')),) in self._rows:
+                reused += 1
+            elif position in self._positions:
+                changed += 1
+            else:
+                added += 1
+        return {
+            'base_job_id': self.base_job_id,
+            'base_comments': len(self._positions),
+            'reused': reused,
+            'changed': changed,
+            'added': added,
+            'removed': len(self._positions - positions)
+        }
@@ -0,0 +1,240 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRIC_NAMESPACE = 'CommentAnalyzer'
+SERVICE_NAME = 'comment-analyzer'
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000, 30000)
+MAX_EMF_VALUES = 100
+TEMPLATE_TOKEN_FIELDS = ('calls', 'comments', 'input', 'output', 'cache_read', 'cache_write', 'estimated_calls')
+
+class JobMetrics:
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.tokens = {'input': 0, 'output': 0, 'cache_read': 0, 'cache_write': 0, 'estimated_calls': 0}
+        self.templates = {}
+        self.latency = {}
+        self.elapsed_seconds = 0.0
+        self._samples = {}
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._s3_client = None
+
+    def add_time(self, stage: str, seconds: float, count: int = 1):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += seconds
+            entry['count'] += count
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def timed_iter(self, iterable, stage: str):
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - started, count=0)
+                return
+            self.add_time(stage, time.perf_counter() - started)
+            yield item
+
+    def increment(self, name: str, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_tokens(self, input_tokens: int, output_tokens: int, estimated: bool = False, template: str = None, comments: int = 0,
+                      cache_read: int = 0, cache_write: int = 0):
+        counts = {
+            'input': int(input_tokens),
+            'output': int(output_tokens),
+            'cache_read': int(cache_read),
+            'cache_write': int(cache_write),
+            'estimated_calls': 1 if estimated else 0
+        }
+        with self._lock:
+            for key, value in counts.items():
+                self.tokens[key] += value
+            if template:
+                # テンプレートの版ごとに集計し、1件あたりの入力トークンを比較できるようにする
+                entry = self.templates.setdefault(template, dict.fromkeys(TEMPLATE_TOKEN_FIELDS, 0))
+                for key, value in counts.items():
+                    entry[key] += value
+                entry['calls'] += 1
+                entry['comments'] += int(comments)
+
+    def observe_latency(self, name: str, seconds: float):
+        milliseconds = seconds * 1000
+        with self._lock:
+            histogram = self.latency.setdefault(name, {
+                'bounds_ms': list(LATENCY_BUCKETS_MS),
+                'counts': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                'count': 0,
+                'sum_ms': 0.0,
+                'max_ms': 0.0
+            })
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound), len(LATENCY_BUCKETS_MS))
+            histogram['counts'][bucket] += 1
+            histogram['count'] += 1
+            histogram['sum_ms'] += milliseconds
+            histogram['max_ms'] = max(histogram['max_ms'], milliseconds)
+            self._samples.setdefault(name, deque(maxlen=MAX_EMF_VALUES)).append(round(milliseconds, 1))
+
+    def attach_s3(self, client):
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None:
+            return
+        unique = f"job-metrics-{id(self)}"
+        events.register('before-call.s3', self._before_s3_call, unique_id=f"{unique}-before")
+        events.register('after-call.s3', self._after_s3_call, unique_id=f"{unique}-after")
+        events.register('after-call-error.s3', self._after_s3_call, unique_id=f"{unique}-error")
+        self._s3_client = client
+
+    def detach_s3(self):
+        if self._s3_client is None:
+            return
+        events = self._s3_client.meta.events
+        unique = f"job-metrics-{id(self)}"
+        events.unregister('before-call.s3', unique_id=f"{unique}-before")
+        events.unregister('after-call.s3', unique_id=f"{unique}-after")
+        events.unregister('after-call-error.s3', unique_id=f"{unique}-error")
+        self._s3_client = None
+
+    def _before_s3_call(self, model=None, context=None, **kwargs):
+        if context is not None:
+            context['job_metrics_started'] = time.perf_counter()
+            context['job_metrics_operation'] = getattr(model, 'name', None)
+
+    def _after_s3_call(self, model=None, context=None, **kwargs):
+        # after-call-errorにはmodelが渡されないため、before-callで控えた操作名を使う
+        context = context or {}
+        operation = getattr(model, 'name', None) or context.get('job_metrics_operation') or 'Unknown'
+        self.increment(f"s3.{operation}")
+        started = context.get('job_metrics_started')
+        if started is not None:
+            self.add_time(f"s3.{operation}", time.perf_counter() - started)
+
+    def merge(self, summary: dict):
+        if not summary:
+            return self
+        with self._lock:
+            self.elapsed_seconds += summary.get('elapsed_seconds', 0.0)
+            for stage, entry in summary.get('stages', {}).items():
+                target = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0})
+                target['seconds'] += entry.get('seconds', 0.0)
+                target['count'] += entry.get('count', 0)
+            for name, value in summary.get('counters', {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for key in self.tokens:
+                self.tokens[key] += summary.get('tokens', {}).get(key, 0)
+            for template, counts in summary.get('templates', {}).items():
+                entry = self.templates.setdefault(template, dict.fromkeys(TEMPLATE_TOKEN_FIELDS, 0))
+                for key in TEMPLATE_TOKEN_FIELDS:
+                    entry[key] += counts.get(key, 0)
+            for name, histogram in summary.get('latency', {}).items():
+                target = self.latency.setdefault(name, {
+                    'bounds_ms': list(LATENCY_BUCKETS_MS),
+                    'counts': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    'count': 0,
+                    'sum_ms': 0.0,
+                    'max_ms': 0.0
+                })
+                for index, count in enumerate(histogram.get('counts', [])[:len(target['counts'])]):
+                    target['counts'][index] += count
+                target['count'] += histogram.get('count', 0)
+                target['sum_ms'] += histogram.get('sum_ms', 0.0)
+                target['max_ms'] = max(target['max_ms'], histogram.get('max_ms', 0.0))
+        return self
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'elapsed_seconds': round(self.elapsed_seconds + time.monotonic() - self._started, 3),
+                'stages': {stage: {'seconds': round(entry['seconds'], 3), 'count': entry['count']}
+                           for stage, entry in sorted(self.stages.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'tokens': dict(self.tokens),
+                'templates': {template: dict(entry, input_per_comment=round(entry['input'] / entry['comments'], 1) if entry['comments'] else None)
+                              for template, entry in sorted(self.templates.items())},
+                'latency': {name: dict(histogram, counts=list(histogram['counts']), sum_ms=round(histogram['sum_ms'], 1),
+                                       max_ms=round(histogram['max_ms'], 1))
+                            for name, histogram in self.latency.items()}
+            }
+
+    def emit(self, job_id: str, status: str, extra_metrics: dict = None):
+        # Lambdaのloggingは行頭に接頭辞を付けるため、埋め込みメトリクス形式はprintでJSONのみを出力する
+        summary = self.summary()
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+
+        metrics = {
+            'ElapsedSeconds': (summary['elapsed_seconds'], 'Seconds'),
+            'InputTokens': (summary['tokens']['input'], 'Count'),
+            'OutputTokens': (summary['tokens']['output'], 'Count'),
+            'CacheReadInputTokens': (summary['tokens']['cache_read'], 'Count'),
+            'S3Requests': (sum(v for k, v in summary['counters'].items() if k.startswith('s3.')), 'Count')
+        }
+        for name, value in (extra_metrics or {}).items():
+            metrics[name] = (value, 'Count')
+        for name, values in samples.items():
+            if values:
+                metrics[f"{name.capitalize()}Latency"] = (values, 'Milliseconds')
+
+        records = [self._emf_record(timestamp, {'Service': SERVICE_NAME}, metrics, job_id, status)]
+        for stage, entry in summary['stages'].items():
+            records.append(self._emf_record(
+                timestamp, {'Service': SERVICE_NAME, 'Stage': stage},
+                {'StageSeconds': (entry['seconds'], 'Seconds'), 'StageCalls': (entry['count'], 'Count')},
+                job_id, status
+            ))
+
+        for template, entry in summary['templates'].items():
+            records.append(self._emf_record(
+                timestamp, {'Service': SERVICE_NAME, 'PromptTemplate': template},
+                {'InputTokens': (entry['input'], 'Count'), 'OutputTokens': (entry['output'], 'Count'),
+                 'CacheReadInputTokens': (entry['cache_read'], 'Count'), 'AnalyzedComments': (entry['comments'], 'Count')},
+                job_id, status
+            ))
+
+        for record in records:
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+
+    def _emf_record(self, timestamp: int, dimensions: dict, metrics: dict, job_id: str, status: str) -> dict:
+        record = {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': METRIC_NAMESPACE,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+                }]
+            },
+            'job_id': job_id,
+            'status': status
+        }
+        record.update(dimensions)
+        record.update({name: value for name, (value, _) in metrics.items()})
+        return record
+
+def merge_metric_summaries(summaries) -> dict:
+    summaries = [summary for summary in summaries if summary]
+    merged = JobMetrics()
+    for summary in summaries:
+        merged.merge(summary)
+    result = merged.summary()
+    result['elapsed_seconds'] = round(sum(summary.get('elapsed_seconds', 0.0) for summary in summaries), 3)
+    return result
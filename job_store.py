@@ -0,0 +1,407 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_PREFIX = 'jobs/'
+DEFAULT_SQLITE_PATH = '/tmp/comment-analyzer-jobs.sqlite3'
+DEFAULT_TABLE_NAME = 'comment-analyzer-jobs'
+MAX_CAS_RETRIES = 5
+MAX_KNOWN_DOCUMENTS = 256
+VERSION_FIELD = 'version'
+STATUS_FIELD = 'status'
+KEY_FIELD = 'job_id'
+VERSION_METADATA = 'job-version'
+STATUS_METADATA = 'job-status'
+
+class JobVersionConflict(Exception):
+    def __init__(self, job_id: str, expected_version=None, current_version=None):
+        super().__init__(f"ジョブ情報が他の処理で更新されています: {job_id}（想定バージョン: {expected_version} / 現在: {current_version}）")
+        self.job_id = job_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+class JobNotFound(Exception):
+    def __init__(self, job_id: str):
+        super().__init__(f"ジョブが見つかりません: {job_id}")
+        self.job_id = job_id
+
+def _body(document: dict) -> dict:
+    return {key: value for key, value in document.items() if key != VERSION_FIELD}
+
+def _project(document: dict, fields) -> dict:
+    if fields is None:
+        return document
+    wanted = set(fields) | {VERSION_FIELD}
+    return {key: value for key, value in document.items() if key in wanted}
+
+def _error_code(error) -> str:
+    return (getattr(error, 'response', None) or {}).get('Error', {}).get('Code', '')
+
+class BaseJobStore:
+    def get_head(self, job_id: str):
+        # 変化の確認用に、バージョンと状態だけを読み出す
+        document = self.get(job_id, fields=(STATUS_FIELD,))
+        return None if document is None else {VERSION_FIELD: document[VERSION_FIELD], STATUS_FIELD: document.get(STATUS_FIELD)}
+
+    def modify(self, job_id: str, mutate, retries: int = MAX_CAS_RETRIES):
+        # mutateがFalseを返した場合は書き込まない。競合した場合は読み直してやり直す
+        for _ in range(retries):
+            document = self.get(job_id)
+            if document is None:
+                return None
+            if mutate(document) is False:
+                return document
+            try:
+                document[VERSION_FIELD] = self.put(job_id, document, expected_version=document.get(VERSION_FIELD, 0))
+                return document
+            except JobVersionConflict:
+                continue
+        raise JobVersionConflict(job_id)
+
+class S3JobStore(BaseJobStore):
+    def __init__(self, bucket: str, prefix: str = DEFAULT_JOB_PREFIX, s3_client=None):
+        if s3_client is None:
+            import boto3
+            s3_client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_client = s3_client
+        # 直近に読み書きしたETagと内容を覚えておき、単一の書き手なら読み直さずにIf-Matchで条件付き書き込みする
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, job_id):
+        return f"{self.prefix}{job_id}.json"
+
+    def _remember(self, job_id, etag, document):
+        with self._lock:
+            self._known[job_id] = (etag, document)
+            self._known.move_to_end(job_id)
+            while len(self._known) > MAX_KNOWN_DOCUMENTS:
+                self._known.popitem(last=False)
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._known.pop(job_id, None)
+
+    def _cached(self, job_id):
+        with self._lock:
+            return self._known.get(job_id)
+
+    def _read(self, job_id):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(job_id))
+        except Exception as e:
+            if _error_code(e) in ('NoSuchKey', '404'):
+                self._forget(job_id)
+                return None, None
+            raise
+        document = json.loads(response['Body'].read().decode('utf-8'))
+        document.setdefault(VERSION_FIELD, 0)
+        etag = response.get('ETag')
+        self._remember(job_id, etag, document)
+        return document, etag
+
+    def _write(self, job_id, document, version, etag, create):
+        stored = dict(_body(document), **{VERSION_FIELD: version})
+        conditions = {}
+        if create:
+            conditions['IfNoneMatch'] = '*'
+        elif etag:
+            conditions['IfMatch'] = etag
+        try:
+            response = self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self._key(job_id),
+                Body=json.dumps(stored, ensure_ascii=False),
+                ContentType='application/json',
+                Metadata={VERSION_METADATA: str(version), STATUS_METADATA: str(stored.get(STATUS_FIELD, ''))},
+                **conditions
+            )
+        except Exception as e:
+            if _error_code(e) in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                self._forget(job_id)
+                raise JobVersionConflict(job_id, current_version=None) from e
+            raise
+        self._remember(job_id, response.get('ETag'), stored)
+        return version
+
+    def get(self, job_id: str, fields=None):
+        # S3は一部の項目だけを読み出せないため、全体を取得して絞り込む
+        document, _ = self._read(job_id)
+        return None if document is None else _project(document, fields)
+
+    def get_head(self, job_id: str):
+        # バージョンと状態はメタデータにも書いておき、HEADだけで変化を確認する
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=self._key(job_id))
+        except Exception as e:
+            if _error_code(e) in ('NoSuchKey', '404', 'NotFound'):
+                return None
+            raise
+        metadata = response.get('Metadata') or {}
+        if VERSION_METADATA not in metadata:
+            return super().get_head(job_id)
+        return {VERSION_FIELD: int(metadata[VERSION_METADATA]), STATUS_FIELD: metadata.get(STATUS_METADATA) or None}
+
+    def _current(self, job_id, fresh):
+        cached = None if fresh else self._cached(job_id)
+        if cached is not None:
+            etag, document = cached
+            return document, etag, False
+        document, etag = self._read(job_id)
+        return document, etag, True
+
+    def put(self, job_id: str, document: dict, expected_version=None) -> int:
+        if expected_version == 0:
+            return self._write(job_id, document, 1, None, create=True)
+
+        fresh = False
+        for _ in range(MAX_CAS_RETRIES):
+            current, etag, fresh = self._current(job_id, fresh)
+            current_version = current.get(VERSION_FIELD, 0) if current is not None else 0
+            if expected_version is not None and expected_version != current_version:
+                if fresh:
+                    raise JobVersionConflict(job_id, expected_version, current_version)
+                fresh = True
+                continue
+            try:
+                return self._write(job_id, document, current_version + 1, etag, create=current is None)
+            except JobVersionConflict:
+                fresh = True
+        raise JobVersionConflict(job_id, expected_version)
+
+    def update(self, job_id: str, changes: dict, remove=(), expected_version=None) -> int:
+        fresh = False
+        for _ in range(MAX_CAS_RETRIES):
+            current, etag, fresh = self._current(job_id, fresh)
+            if current is None:
+                raise JobNotFound(job_id)
+            current_version = current.get(VERSION_FIELD, 0)
+            if expected_version is not None and expected_version != current_version:
+                if fresh:
+                    raise JobVersionConflict(job_id, expected_version, current_version)
+                fresh = True
+                continue
+            document = dict(current)
+            document.update(changes)
+            for field in remove:
+                document.pop(field, None)
+            try:
+                return self._write(job_id, document, current_version + 1, etag, create=False)
+            except JobVersionConflict:
+                fresh = True
+        raise JobVersionConflict(job_id, expected_version)
+
+class DynamoJobStore(BaseJobStore):
+    # 各項目をJSON文字列の属性として保存し、部分更新・射影読み出し・バージョン条件を1回の呼び出しで行う
+    def __init__(self, table_name: str = DEFAULT_TABLE_NAME, client=None, endpoint_url: str = None):
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb', endpoint_url=endpoint_url) if endpoint_url else boto3.client('dynamodb')
+        self.table_name = table_name
+        self.client = client
+
+    def _key(self, job_id):
+        return {KEY_FIELD: {'S': job_id}}
+
+    def _item(self, job_id, document, version):
+        item = {field: {'S': json.dumps(value, ensure_ascii=False)} for field, value in _body(document).items() if field != KEY_FIELD}
+        item.update(self._key(job_id))
+        item[VERSION_FIELD] = {'N': str(version)}
+        return item
+
+    def _document(self, item):
+        document = {}
+        for field, value in item.items():
+            if field == VERSION_FIELD:
+                document[field] = int(value['N'])
+            elif field == KEY_FIELD:
+                document[field] = value['S']
+            else:
+                document[field] = json.loads(value['S'])
+        return document
+
+    def _current_version(self, job_id):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key=self._key(job_id),
+            ProjectionExpression='#v',
+            ExpressionAttributeNames={'#v': VERSION_FIELD},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        return None if item is None else int(item[VERSION_FIELD]['N'])
+
+    def get(self, job_id: str, fields=None):
+        request = {'TableName': self.table_name, 'Key': self._key(job_id), 'ConsistentRead': True}
+        if fields is not None:
+            names = {f"#f{i}": field for i, field in enumerate(set(fields) | {VERSION_FIELD})}
+            request['ProjectionExpression'] = ', '.join(names)
+            request['ExpressionAttributeNames'] = names
+        item = self.client.get_item(**request).get('Item')
+        return None if item is None else self._document(item)
+
+    def put(self, job_id: str, document: dict, expected_version=None) -> int:
+        for _ in range(MAX_CAS_RETRIES):
+            current_version = expected_version if expected_version is not None else (self._current_version(job_id) or 0)
+            request = {'TableName': self.table_name, 'Item': self._item(job_id, document, current_version + 1)}
+            if current_version == 0:
+                request['ConditionExpression'] = 'attribute_not_exists(#k)'
+                request['ExpressionAttributeNames'] = {'#k': KEY_FIELD}
+            else:
+                request['ConditionExpression'] = '#v = :expected'
+                request['ExpressionAttributeNames'] = {'#v': VERSION_FIELD}
+                request['ExpressionAttributeValues'] = {':expected': {'N': str(current_version)}}
+            try:
+                self.client.put_item(**request)
+                return current_version + 1
+            except Exception as e:
+                if _error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+                if expected_version is not None:
+                    raise JobVersionConflict(job_id, expected_version) from e
+        raise JobVersionConflict(job_id, expected_version)
+
+    def update(self, job_id: str, changes: dict, remove=(), expected_version=None) -> int:
+        names = {'#k': KEY_FIELD, '#v': VERSION_FIELD}
+        values = {':one': {'N': '1'}}
+        assignments = []
+        for i, (field, value) in enumerate(_body(changes).items()):
+            if field == KEY_FIELD:
+                continue
+            names[f"#s{i}"] = field
+            values[f":s{i}"] = {'S': json.dumps(value, ensure_ascii=False)}
+            assignments.append(f"#s{i} = :s{i}")
+        removals = []
+        for i, field in enumerate(remove):
+            names[f"#r{i}"] = field
+            removals.append(f"#r{i}")
+
+        expression = 'ADD #v :one'
+        if assignments:
+            expression = f"SET {', '.join(assignments)} {expression}"
+        if removals:
+            expression = f"{expression} REMOVE {', '.join(removals)}"
+        condition = 'attribute_exists(#k)'
+        if expected_version is not None:
+            condition += ' AND #v = :expected'
+            values[':expected'] = {'N': str(expected_version)}
+
+        try:
+            response = self.client.update_item(
+                TableName=self.table_name,
+                Key=self._key(job_id),
+                UpdateExpression=expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_NEW'
+            )
+        except Exception as e:
+            if _error_code(e) != 'ConditionalCheckFailedException':
+                raise
+            current_version = self._current_version(job_id)
+            if current_version is None:
+                raise JobNotFound(job_id) from e
+            raise JobVersionConflict(job_id, expected_version, current_version) from e
+        return int(response['Attributes'][VERSION_FIELD]['N'])
+
+class SqliteJobStore(BaseJobStore):
+    # 項目ごとに1行で保存するため、部分更新は変更した項目だけを書き換える
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL' if path != ':memory:' else 'PRAGMA journal_mode=MEMORY')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS job_fields ('
+                'job_id TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (job_id, field))'
+            )
+
+    def _transaction(self, job_id, expected_version, write, allow_missing):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                row = cursor.execute('SELECT version FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+                current_version = row[0] if row else 0
+                if row is None and not allow_missing:
+                    raise JobNotFound(job_id)
+                if expected_version is not None and expected_version != current_version:
+                    raise JobVersionConflict(job_id, expected_version, current_version)
+                write(cursor)
+                cursor.execute(
+                    'INSERT INTO jobs (job_id, version) VALUES (?, ?) ON CONFLICT(job_id) DO UPDATE SET version = excluded.version',
+                    (job_id, current_version + 1)
+                )
+                cursor.execute('COMMIT')
+                return current_version + 1
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def _set_fields(self, cursor, job_id, fields: dict):
+        cursor.executemany(
+            'INSERT INTO job_fields (job_id, field, value) VALUES (?, ?, ?) '
+            'ON CONFLICT(job_id, field) DO UPDATE SET value = excluded.value',
+            [(job_id, field, json.dumps(value, ensure_ascii=False)) for field, value in _body(fields).items()]
+        )
+
+    def get(self, job_id: str, fields=None):
+        with self._lock:
+            row = self._connection.execute('SELECT version FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if fields is None:
+                rows = self._connection.execute('SELECT field, value FROM job_fields WHERE job_id = ?', (job_id,)).fetchall()
+            else:
+                fields = list(fields)
+                placeholders = ', '.join('?' * len(fields))
+                rows = self._connection.execute(
+                    f'SELECT field, value FROM job_fields WHERE job_id = ? AND field IN ({placeholders})',
+                    [job_id] + fields
+                ).fetchall() if fields else []
+        document = {field: json.loads(value) for field, value in rows}
+        document[VERSION_FIELD] = row[0]
+        return document
+
+    def put(self, job_id: str, document: dict, expected_version=None) -> int:
+        def write(cursor):
+            cursor.execute('DELETE FROM job_fields WHERE job_id = ?', (job_id,))
+            self._set_fields(cursor, job_id, document)
+        return self._transaction(job_id, expected_version, write, allow_missing=True)
+
+    def update(self, job_id: str, changes: dict, remove=(), expected_version=None) -> int:
+        def write(cursor):
+            self._set_fields(cursor, job_id, changes)
+            cursor.executemany('DELETE FROM job_fields WHERE job_id = ? AND field = ?', [(job_id, field) for field in remove])
+        return self._transaction(job_id, expected_version, write, allow_missing=False)
+
+_shared_memory_store = None
+_shared_memory_lock = threading.Lock()
+
+def create_job_store(backend_name: str, bucket: str = None, s3_client=None, table_name: str = None,
+                     path: str = None, endpoint_url: str = None):
+    global _shared_memory_store
+
+    if not backend_name or backend_name == 's3':
+        if not bucket:
+            raise ValueError("S3のジョブ情報ストアにはバケット名が必要です")
+        return S3JobStore(bucket, s3_client=s3_client)
+    if backend_name == 'dynamodb':
+        return DynamoJobStore(table_name or DEFAULT_TABLE_NAME, endpoint_url=endpoint_url)
+    if backend_name == 'sqlite':
+        return SqliteJobStore(path or DEFAULT_SQLITE_PATH)
+    if backend_name == 'memory':
+        with _shared_memory_lock:
+            if _shared_memory_store is None:
+                _shared_memory_store = SqliteJobStore(':memory:')
+            return _shared_memory_store
+    raise ValueError(f"不明なジョブ情報ストア: {backend_name}")
@@ -1,18 +1,88 @@
 import json
 import base64
+import contextlib
+import gzip
 import io
-from openpyxl import load_workbook
+import itertools
 import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 import uuid
 import boto3
 from datetime import datetime
-from comment_analyzer import analyze_comments
+from analysis_cache import create_analysis_cache
+from prescreen import create_prescreener
+from prompt_templates import get_prompt_template, LEGACY_PROMPT_TEMPLATE
+from live_statistics import StatisticsAggregator, AlertCollector, merge_statistics, MAX_ALERTS
+from job_metrics import JobMetrics, merge_metric_summaries
+from job_store import create_job_store, JobVersionConflict, JobNotFound
+from incremental import BaseResultIndex
+from result_store import ResultColumns, RESULT_WIRE_FORMAT
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# comment_analyzer（openpyxl・Bedrockクライアント）は分析処理でのみ読み込み、状況確認のコールドスタートを軽くする
 s3_client = boto3.client('s3')
+_lambda_client = None
+_lambda_client_lock = threading.Lock()
+_job_store = None
+_job_store_lock = threading.Lock()
 JOB_BUCKET = 'comment-analyzer-jobs'
+JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND', 's3')
+JOB_STORE_TABLE = os.environ.get('JOB_STORE_TABLE', 'comment-analyzer-jobs')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH')
+JOB_STORE_ENDPOINT_URL = os.environ.get('JOB_STORE_ENDPOINT_URL')
+STATUS_STAT_FIELDS = ('cache_stats', 'dedup_stats', 'source_stats', 'call_stats', 'live_statistics', 'alert_stats', 'diff_stats', 'metrics')
+STATUS_FIELDS = (
+    'status', 'progress', 'total_comments', 'processed_comments', 'message', 'created_at', 'updated_at',
+    'shard_count', 'alerts_key', 'checkpoint_segments', 'checkpoint_counts'
+) + STATUS_STAT_FIELDS
+# 待機中もLambdaの実行時間として課金され同時実行枠を占有するため、上限は短くして環境変数で調整できるようにする
+MAX_STATUS_WAIT_SECONDS = float(os.environ.get('STATUS_WAIT_MAX_SECONDS', '5'))
+STATUS_WAIT_INITIAL_INTERVAL_SECONDS = 0.25
+STATUS_WAIT_MAX_INTERVAL_SECONDS = 2
+SHARDED_STATUS_WAIT_SECONDS = 2
+TERMINAL_STATUSES = ('completed', 'error')
+PROGRESS_FIELDS = (
+    'progress', 'total_comments', 'processed_comments', 'message', 'updated_at', 'live_statistics', 'alert_stats',
+    'alerts_key', 'checkpoint_segments', 'checkpoint_counts'
+)
+DEFAULT_CACHE_BACKEND = 's3'
+MAX_SHARD_COUNT = 20
+CONTINUATION_MARGIN_MS = 120000
+MAX_CONTINUATIONS = 20
+PROGRESS_FLUSH_INTERVAL_SECONDS = 5
+PROGRESS_FLUSH_STEP = 5
+CHECKPOINT_FLUSH_INTERVAL_SECONDS = 10
+MAX_PARTIAL_RESULTS_PER_STATUS = 500
+ALERT_FLUSH_INTERVAL_SECONDS = 1
+CALL_STAT_METRICS = {
+    'retries': 'Retries',
+    'hedged_requests': 'HedgedRequests',
+    'circuit_opens': 'CircuitOpens',
+    'repair_requests': 'RepairRequests',
+    'requeued_items': 'RequeuedItems',
+    'default_items': 'DefaultItems',
+    'stream_fallbacks': 'StreamFallbacks'
+}
+DEFAULT_RESULT_PAGE_SIZE = 1000
+MAX_RESULT_PAGE_SIZE = 5000
+RESULT_DOWNLOAD_URL_EXPIRES = 3600
+RESULT_FILTER_FIELDS = ('is_dangerous', 'sentiment', 'category', 'column_name', 'file_name', 'sheet_name')
+# rows: 従来どおり1件ずつの辞書の配列 / columnar: 列ごとにまとめた形式（result_store.py）
+RESULT_FORMATS = ('rows', RESULT_WIRE_FORMAT)
+UPLOAD_URL_EXPIRES = 900
+UPLOAD_KEY_PREFIX = 'temp/'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+ZIP_CONTENT_TYPE = 'application/zip'
+MAX_JOB_FILES = 50
+MAX_FILE_NAME_LENGTH = 200
+FILE_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+FILE_READ_CHUNK_BYTES = 1024 * 1024
 
 def lambda_handler(event, context):
     headers = {
@@ -22,14 +92,20 @@ def lambda_handler(event, context):
     try:
         if 'action' in event and event['action'] == 'process_async':
             job_id = event['job_id']
-            logger.info(f"非同期処理開始: {job_id}")
+            shard_id = event.get('shard_id')
+            logger.info(f"非同期処理開始: {job_id}" + (f" (シャード{shard_id})" if shard_id is not None else ""))
             
             job_info = get_job_info(job_id)
             if not job_info:
                 logger.error(f"ジョブ情報が見つかりません: {job_id}")
                 return {'statusCode': 404, 'body': 'Job not found'}
             
-            process_analysis_async(job_id, job_info)
+            if shard_id is not None:
+                process_shard_async(job_id, shard_id, job_info, context)
+            elif job_info.get('shard_count', 1) > 1 and not job_info.get('shards_created'):
+                split_job_into_shards(job_id, job_info)
+            else:
+                process_analysis_async(job_id, job_info, context)
             return {'statusCode': 200, 'body': 'OK'}
         
         if 'httpMethod' in event:
@@ -54,12 +130,16 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Invalid JSON format'})
             }
         
-        if body.get('start_job'):
+        if body.get('get_upload_url'):
+            return create_upload_url(body, headers)
+        elif body.get('start_job'):
             return start_analysis_job(body, headers)
         elif body.get('get_status'):
             return get_job_status(body, headers)
         elif body.get('get_result'):
             return get_job_result(body, headers)
+        elif body.get('resume_job'):
+            return resume_analysis_job(body, headers)
         else:
             return process_sync_analysis(body, headers)
             
@@ -71,26 +151,205 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': 'Internal server error'})
         }
 
+def create_upload_url(body, headers):
+    try:
+        extension, content_type = upload_file_type(body.get('file_name'))
+        file_key = f"{UPLOAD_KEY_PREFIX}{uuid.uuid4()}_file{extension}"
+        upload_url = s3_client.generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': JOB_BUCKET,
+                'Key': file_key,
+                'ContentType': content_type
+            },
+            ExpiresIn=UPLOAD_URL_EXPIRES
+        )
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'upload_url': upload_url,
+                'file_key': file_key,
+                'content_type': content_type,
+                'expires_in': UPLOAD_URL_EXPIRES
+            })
+        }
+        
+    except Exception as e:
+        logger.error(f"アップロードURL発行エラー: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': 'アップロードURLの発行に失敗しました'})
+        }
+
+def upload_file_type(file_name):
+    if file_name and str(file_name).lower().endswith('.zip'):
+        return '.zip', ZIP_CONTENT_TYPE
+    return '.xlsx', XLSX_CONTENT_TYPE
+
+def upload_file_name(entry):
+    file_name = entry.get('file_name')
+    if not file_name:
+        return None
+    return str(file_name).replace('\\', '/').rsplit('/', 1)[-1][:MAX_FILE_NAME_LENGTH] or None
+
+def resolve_upload_files(body, job_id):
+    if 'files' not in body:
+        return [{'file_key': resolve_upload_key(body, job_id), 'file_name': upload_file_name(body)}]
+    
+    entries = body['files']
+    if not isinstance(entries, list) or not entries or not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError("filesにはfile_keyまたはfile_dataを持つオブジェクトの配列を指定してください")
+    if len(entries) > MAX_JOB_FILES:
+        raise ValueError(f"1つのジョブで分析できるファイルは最大{MAX_JOB_FILES}件です")
+    
+    files = []
+    seen = {}
+    for index, entry in enumerate(entries):
+        if 'file_key' not in entry and 'file_data' not in entry:
+            raise ValueError(f"files[{index}]にfile_keyが見つかりません")
+        file_name = upload_file_name(entry) or f"ファイル{index + 1}"
+        # 同名ファイルはファイル別の統計が混ざらないよう番号を付けて区別する
+        seen[file_name] = seen.get(file_name, 0) + 1
+        if seen[file_name] > 1:
+            file_name = f"{file_name} ({seen[file_name]})"
+        files.append({'file_key': resolve_upload_key(entry, job_id, index), 'file_name': file_name})
+    return files
+
+def resolve_upload_key(body, job_id, index=0):
+    file_key = body.get('file_key')
+    if file_key:
+        if not file_key.startswith(UPLOAD_KEY_PREFIX):
+            raise ValueError("不正なfile_keyです")
+        try:
+            s3_client.head_object(
+                Bucket=JOB_BUCKET,
+                Key=file_key
+            )
+        except Exception as e:
+            logger.warning(f"アップロードファイル確認エラー: {str(e)}")
+            raise ValueError("アップロードされたファイルが見つかりません")
+        return file_key
+    
+    extension, content_type = upload_file_type(body.get('file_name'))
+    file_key = f"{UPLOAD_KEY_PREFIX}{job_id}_file{extension}" if index == 0 else f"{UPLOAD_KEY_PREFIX}{job_id}_file{index}{extension}"
+    s3_client.put_object(
+        Bucket=JOB_BUCKET,
+        Key=file_key,
+        Body=base64.b64decode(body['file_data']),
+        ContentType=content_type
+    )
+    return file_key
+
+def parse_int_param(body, key, default, minimum, maximum=None):
+    value = body.get(key, default)
+    try:
+        if isinstance(value, (bool, float)):
+            raise ValueError(value)
+        number = int(value)
+    except (TypeError, ValueError):
+        if maximum is None:
+            raise ValueError(f"{key}には{minimum}以上の整数を指定してください")
+        raise ValueError(f"{key}には{minimum}〜{maximum}の整数を指定してください")
+    number = max(minimum, number)
+    return number if maximum is None else min(number, maximum)
+
+def parse_seconds_param(body, key, maximum):
+    value = body.get(key) or 0
+    try:
+        if isinstance(value, bool):
+            raise ValueError(value)
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key}には0〜{maximum:g}の秒数を指定してください")
+    return min(max(0.0, seconds), maximum)
+
+def parse_max_concurrency(body):
+    from comment_analyzer import DEFAULT_MAX_CONCURRENCY, MAX_CONCURRENCY
+    
+    # スレッド数とBedrockの同時呼び出し数が際限なく増えないよう、shard_countと同様に上限で丸める
+    return parse_int_param(body, 'max_concurrency', DEFAULT_MAX_CONCURRENCY, 1, MAX_CONCURRENCY)
+
 def start_analysis_job(body, headers):
+    
     try:
-        if 'file_data' not in body:
+        if 'file_key' not in body and 'file_data' not in body and 'files' not in body:
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'file_dataが見つかりません'})
+                'body': json.dumps({'error': 'file_keyが見つかりません'})
             }
         
         test_mode = body.get('test_mode', False)
+        try:
+            max_concurrency = parse_max_concurrency(body)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        cache_backend = body.get('cache_backend', DEFAULT_CACHE_BACKEND)
+        try:
+            shard_count = parse_int_param(body, 'shard_count', 1, 1, MAX_SHARD_COUNT)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        prescreen = body.get('prescreen', False)
         job_id = str(uuid.uuid4())
         
-        file_key = f"temp/{job_id}_file.xlsx"
         try:
-            s3_client.put_object(
-                Bucket=JOB_BUCKET,
-                Key=file_key,
-                Body=base64.b64decode(body['file_data']),
-                ContentType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+            create_prescreener(prescreen)
+        except (TypeError, ValueError) as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f'事前判定の設定が不正です: {str(e)}'})
+            }
+        
+        base_job_id = body.get('base_job_id')
+        requested_template = body.get('prompt_template')
+        if base_job_id:
+            base_info = get_job_info(base_job_id, fields=['status', 'prompt_template'])
+            if not base_info or base_info.get('status') != 'completed':
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': f'差分の基準にできる完了済みジョブが見つかりません: {base_job_id}'})
+                }
+            # テンプレートが異なると結果の傾向が変わるため、基準ジョブと同じ版で差分だけを分析する
+            base_template = base_info.get('prompt_template') or LEGACY_PROMPT_TEMPLATE
+            if requested_template and requested_template != base_template:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': f'基準ジョブと異なるプロンプトテンプレートは指定できません（基準ジョブ: {base_template}）'})
+                }
+            requested_template = base_template
+        
+        # 途中で既定の版が変わっても継続・シャード処理で同じテンプレートを使うよう、解決した版を保存する
+        try:
+            prompt_template = get_prompt_template(requested_template).version
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        try:
+            files = resolve_upload_files(body, job_id)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
         except Exception as e:
             logger.error(f"ファイル一時保存エラー: {str(e)}")
             return {
@@ -108,23 +367,29 @@ def start_analysis_job(body, headers):
             'message': '分析を開始しています...',
             'created_at': datetime.now().isoformat(),
             'updated_at': datetime.now().isoformat(),
-            'file_key': file_key,
-            'test_mode': test_mode
+            'files': files,
+            # 複数ファイルのジョブは既定ですべてのシートを読む（単一ファイルはZIPでなければアクティブシートのみ）
+            'all_sheets': body.get('all_sheets', True if len(files) > 1 else None),
+            'test_mode': test_mode,
+            'max_concurrency': max_concurrency,
+            'cache_backend': cache_backend,
+            'deduplicate': body.get('deduplicate', True),
+            'shard_count': shard_count,
+            'prescreen': prescreen,
+            'streaming': body.get('streaming', True),
+            'danger_first': body.get('danger_first', False),
+            'prompt_template': prompt_template
         }
+        if base_job_id:
+            job_info['base_job_id'] = base_job_id
         
-        save_job_info(job_id, job_info)
+        save_job_info(job_id, job_info, expected_version=0)
         logger.info(f"ジョブ開始: {job_id}")
         
-        lambda_client = boto3.client('lambda', region_name='ap-northeast-1')
-        
-        lambda_client.invoke(
-            FunctionName='comment-analyzer',
-            InvocationType='Event',
-            Payload=json.dumps({
-                'action': 'process_async',
-                'job_id': job_id
-            })
-        )
+        invoke_async_worker({
+            'action': 'process_async',
+            'job_id': job_id
+        })
         
         return {
             'statusCode': 200,
@@ -154,7 +419,7 @@ def get_job_status(body, headers):
                 'body': json.dumps({'error': 'job_idが必要です'})
             }
         
-        job_info = get_job_info(job_id)
+        job_info = get_job_info(job_id, fields=STATUS_FIELDS)
         if not job_info:
             return {
                 'statusCode': 404,
@@ -162,18 +427,94 @@ def get_job_status(body, headers):
                 'body': json.dumps({'error': 'ジョブが見つかりません'})
             }
         
+        since_version = body.get('since_version')
+        try:
+            if since_version is not None:
+                since_version = parse_int_param(body, 'since_version', 0, 0)
+            wait_seconds = parse_seconds_param(body, 'wait_seconds', MAX_STATUS_WAIT_SECONDS)
+            min_wait_seconds = min(parse_seconds_param(body, 'min_wait_seconds', MAX_STATUS_WAIT_SECONDS), wait_seconds)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        if since_version is not None and job_info.get('version') == since_version:
+            if job_info.get('shard_count', 1) > 1 and job_info['status'] == 'processing':
+                # シャードの進捗はジョブ情報のバージョンに反映されないため、短く待ってから現在の状況を返す
+                time.sleep(min(wait_seconds, max(SHARDED_STATUS_WAIT_SECONDS, min_wait_seconds)))
+                modified = True
+            else:
+                modified = wait_for_job_change(job_id, job_info, wait_seconds, min_wait_seconds)
+            
+            if not modified:
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'job_id': job_id,
+                        'version': job_info.get('version'),
+                        'status': job_info['status'],
+                        'modified': False
+                    })
+                }
+            job_info = get_job_info(job_id, fields=STATUS_FIELDS)
+            if not job_info:
+                return {
+                    'statusCode': 404,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'ジョブが見つかりません'})
+                }
+        
+        status = {
+            'job_id': job_id,
+            'version': job_info.get('version'),
+            'status': job_info['status'],
+            'progress': job_info.get('progress', 0),
+            'total_comments': job_info.get('total_comments', 0),
+            'processed_comments': job_info.get('processed_comments', 0),
+            'message': job_info.get('message', ''),
+            'updated_at': job_info.get('updated_at', job_info.get('created_at'))
+        }
+        for key in STATUS_STAT_FIELDS:
+            if key in job_info:
+                status[key] = job_info[key]
+        
+        if job_info.get('shard_count', 1) > 1 and job_info['status'] == 'processing':
+            status['alerts'] = merge_alerts(get_shard_object(job_id, shard_id, 'alerts')
+                                            for shard_id in range(job_info['shard_count']))
+        elif job_info.get('alerts_key'):
+            status['alerts'] = get_job_object(job_info['alerts_key']) or merge_alerts([])
+        
+        if 'results_since' in body and job_info['status'] == 'processing' and job_info.get('shard_count', 1) == 1:
+            try:
+                # 初回の問い合わせではカーソルを持たないため、nullは先頭からとして扱う
+                cursor = parse_int_param(body, 'results_since', 0, 0) if body['results_since'] is not None else 0
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': str(e)})
+                }
+            partial_results, next_cursor = JobCheckpoint(job_id, job_info).read_since(cursor)
+            status['partial_results'] = partial_results
+            status['results_cursor'] = next_cursor
+        
+        if job_info.get('shard_count', 1) > 1 and job_info['status'] == 'processing':
+            shards = get_shard_statuses(job_id, job_info['shard_count'])
+            status['live_statistics'] = merge_statistics(shard.pop('live_statistics', None) for shard in shards).snapshot()
+            processed = sum(shard.get('processed_comments', 0) for shard in shards)
+            total = job_info.get('total_comments', 0)
+            status['shards'] = shards
+            status['processed_comments'] = processed
+            status['progress'] = int((processed / total) * 100) if total > 0 else 0
+            status['message'] = f"分析進捗: {processed}/{total}件完了（{sum(1 for shard in shards if shard.get('status') == 'completed')}/{len(shards)}シャード完了）"
+        
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps({
-                'job_id': job_id,
-                'status': job_info['status'],
-                'progress': job_info.get('progress', 0),
-                'total_comments': job_info.get('total_comments', 0),
-                'processed_comments': job_info.get('processed_comments', 0),
-                'message': job_info.get('message', ''),
-                'updated_at': job_info.get('updated_at', job_info.get('created_at'))
-            })
+            'body': json.dumps(status)
         }
         
     except Exception as e:
@@ -184,6 +525,26 @@ def get_job_status(body, headers):
             'body': json.dumps({'error': 'ジョブ状況の取得に失敗しました'})
         }
 
+def wait_for_job_change(job_id, job_info, wait_seconds, min_wait_seconds=0):
+    # バージョンと状態だけを読み直し、変化するか待ち時間を過ぎるまで待つ
+    if job_info['status'] in TERMINAL_STATUSES:
+        return False
+    
+    started = time.monotonic()
+    interval = STATUS_WAIT_INITIAL_INTERVAL_SECONDS
+    while True:
+        elapsed = time.monotonic() - started
+        if elapsed >= wait_seconds:
+            return False
+        time.sleep(min(interval, wait_seconds - elapsed))
+        interval = min(interval * 2, STATUS_WAIT_MAX_INTERVAL_SECONDS)
+        
+        head = get_job_store().get_head(job_id)
+        if head is None or head.get('status') != job_info['status']:
+            return True
+        if head.get('version') != job_info.get('version') and time.monotonic() - started >= min_wait_seconds:
+            return True
+
 def get_job_result(body, headers):
     try:
         job_id = body.get('job_id')
@@ -209,10 +570,71 @@ def get_job_result(body, headers):
                 'body': json.dumps({'error': 'ジョブがまだ完了していません'})
             }
         
+        result_format = body.get('result_format', 'rows')
+        if result_format not in RESULT_FORMATS:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f"result_formatは{'・'.join(RESULT_FORMATS)}のいずれかを指定してください"})
+            }
+        
+        filters = {key: value for key, value in (body.get('filters') or {}).items() if key in RESULT_FILTER_FIELDS}
+        try:
+            cursor = parse_int_param(body, 'cursor', 0, 0)
+            limit = parse_int_param(body, 'limit', DEFAULT_RESULT_PAGE_SIZE, 1, MAX_RESULT_PAGE_SIZE)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        summary = load_result_summary(job_info)
+        if summary is None:
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'error': '結果が見つかりません'})
+            }
+        
+        if body.get('download_url'):
+            if not job_info.get('result_rows_key'):
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'このジョブは一括ダウンロードに対応していません'})
+                }
+            summary['download_url'] = s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': JOB_BUCKET, 'Key': job_info['result_rows_key']},
+                ExpiresIn=RESULT_DOWNLOAD_URL_EXPIRES
+            )
+            summary['download_format'] = 'jsonl.gz'
+            summary['expires_in'] = RESULT_DOWNLOAD_URL_EXPIRES
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(summary)
+            }
+        
+        page = []
+        next_cursor = None
+        for position, row in iter_result_rows(job_info, cursor):
+            if len(page) >= limit:
+                next_cursor = position
+                break
+            if all(row.get(key) == value for key, value in filters.items()):
+                page.append(row)
+        
+        summary['results'] = encode_results(page, result_format)
+        summary['cursor'] = cursor
+        summary['next_cursor'] = next_cursor
+        summary['returned'] = len(page)
+        
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps(job_info.get('result', {}))
+            'body': json.dumps(summary)
         }
         
     except Exception as e:
@@ -223,18 +645,156 @@ def get_job_result(body, headers):
             'body': json.dumps({'error': '結果の取得に失敗しました'})
         }
 
+def resume_analysis_job(body, headers):
+    try:
+        job_id = body.get('job_id')
+        if not job_id:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'job_idが必要です'})
+            }
+        
+        job_info = get_job_info(job_id)
+        if not job_info:
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'error': 'ジョブが見つかりません'})
+            }
+        
+        if job_info['status'] != 'error':
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'エラー状態のジョブのみ再開できます'})
+            }
+        
+        if not get_job_files(job_info):
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': '入力ファイルが残っていないため再開できません'})
+            }
+        
+        job_info['status'] = 'processing'
+        job_info['message'] = 'チェックポイントから再開しています...'
+        job_info['continuations'] = 0
+        job_info['updated_at'] = datetime.now().isoformat()
+        job_info.pop('error', None)
+        try:
+            save_job_info(job_id, job_info, expected_version=job_info.get('version'))
+        except JobVersionConflict:
+            return {
+                'statusCode': 409,
+                'headers': headers,
+                'body': json.dumps({'error': 'ジョブは他の処理で更新されました。状況を確認してから再度お試しください'})
+            }
+        
+        if job_info.get('shard_count', 1) > 1 and job_info.get('shards_created'):
+            for shard in get_shard_statuses(job_id, job_info['shard_count']):
+                if shard.get('status') != 'completed':
+                    invoke_async_worker({
+                        'action': 'process_async',
+                        'job_id': job_id,
+                        'shard_id': shard['shard_id']
+                    })
+        else:
+            invoke_async_worker({
+                'action': 'process_async',
+                'job_id': job_id
+            })
+        
+        logger.info(f"ジョブ再開: {job_id}")
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'job_id': job_id,
+                'status': 'processing',
+                'message': '分析を再開しました。'
+            })
+        }
+        
+    except Exception as e:
+        logger.error(f"ジョブ再開エラー: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': 'ジョブの再開に失敗しました'})
+        }
+
 def process_sync_analysis(body, headers):
+    from comment_analyzer import analyze_comments
+    
     try:
-        if 'file_data' not in body:
+        if 'file_key' not in body and 'file_data' not in body:
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'file_dataが見つかりません'})
+                'body': json.dumps({'error': 'file_keyが見つかりません'})
+            }
+        
+        try:
+            get_prompt_template(body.get('prompt_template'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        result_format = body.get('result_format', 'rows')
+        if result_format not in RESULT_FORMATS:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f"result_formatは{'・'.join(RESULT_FORMATS)}のいずれかを指定してください"})
             }
         
         test_mode = body.get('test_mode', False)
-        file_data = base64.b64decode(body['file_data'])
-        result = analyze_comments(file_data, test_mode)
+        try:
+            max_concurrency = parse_max_concurrency(body)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        cache = create_analysis_cache(body.get('cache_backend', DEFAULT_CACHE_BACKEND), bucket=JOB_BUCKET, s3_client=s3_client)
+        if body.get('file_key'):
+            if not body['file_key'].startswith(UPLOAD_KEY_PREFIX):
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': '不正なfile_keyです'})
+                }
+            file_data = read_job_file(body['file_key'])
+        else:
+            file_data = base64.b64decode(body['file_data'])
+        
+        file_name = upload_file_name(body)
+        metrics = JobMetrics()
+        metrics.attach_s3(s3_client)
+        try:
+            result = analyze_comments(
+                [(file_name, file_data)] if file_name else file_data,
+                test_mode,
+                max_concurrency=max_concurrency,
+                cache=cache,
+                deduplicate=body.get('deduplicate', True),
+                prescreener=create_prescreener(body.get('prescreen', False)),
+                streaming=False,
+                metrics=metrics,
+                prompt_template=body.get('prompt_template'),
+                all_sheets=body.get('all_sheets')
+            )
+        finally:
+            metrics.detach_s3()
+            if hasattr(file_data, 'close'):
+                file_data.close()
+        emit_job_metrics('sync', 'completed', metrics, result.get('call_stats'), len(result['results']))
+        result['results'] = encode_results(result['results'], result_format)
         
         return {
             'statusCode': 200,
@@ -250,168 +810,870 @@ def process_sync_analysis(body, headers):
             'body': json.dumps({'error': '分析に失敗しました'})
         }
 
-def process_analysis_async(job_id, job_info):
+def process_analysis_async(job_id, job_info, context=None):
+    from comment_analyzer import analyze_comments, AnalysisSuspended, DEFAULT_MAX_CONCURRENCY
+    
+    checkpoint = JobCheckpoint(job_id, job_info)
+    metrics = JobMetrics()
+    metrics.attach_s3(s3_client)
+    previous_metrics = job_info.get('metrics')
+    call_stats = None
+    
     try:
         job_info['status'] = 'processing'
         job_info['updated_at'] = datetime.now().isoformat()
         save_job_info(job_id, job_info)
         
-        file_key = job_info.get('file_key')
-        if not file_key:
-            raise ValueError("ファイルキーが見つかりません")
+        completed_results = checkpoint.load()
+        if completed_results:
+            logger.info(f"チェックポイントから再開: {len(completed_results)}件分析済み")
         
-        try:
-            response = s3_client.get_object(
-                Bucket=JOB_BUCKET,
-                Key=file_key
-            )
-            file_data = response['Body'].read()
-        except Exception as e:
-            raise ValueError(f"ファイルデータの取得に失敗しました: {str(e)}")
+        progress_writer = ProgressWriter(lambda snapshot: update_job_info(job_id, snapshot, PROGRESS_FIELDS))
+        statistics = StatisticsAggregator()
+        alert_writer, alerts = create_alert_collector(
+            job_info['created_at'],
+            job_info.get('alert_stats'),
+            lambda snapshot: save_job_alerts(job_id, snapshot, job_info)
+        )
         
         def progress_callback(processed, total, message=""):
             job_info['processed_comments'] = processed
             job_info['total_comments'] = total
             job_info['progress'] = int((processed / total) * 100) if total > 0 else 0
             job_info['message'] = message
+            job_info['live_statistics'] = statistics.snapshot()
+            job_info['alert_stats'] = alert_stats(alerts)
             job_info['updated_at'] = datetime.now().isoformat()
-            save_job_info(job_id, job_info)
+            progress_writer.update(dict(job_info), job_info['progress'])
         
-        result = analyze_comments(file_data, job_info['test_mode'], progress_callback)
+        cache = create_analysis_cache(
+            job_info.get('cache_backend', DEFAULT_CACHE_BACKEND),
+            bucket=JOB_BUCKET,
+            s3_client=s3_client
+        )
+        base_results = load_base_result_index(job_info, metrics)
+        
+        job_files = iter_job_files(get_job_files(job_info), metrics)
+        try:
+            result = analyze_comments(
+                job_files,
+                job_info['test_mode'],
+                progress_callback,
+                max_concurrency=job_info.get('max_concurrency', DEFAULT_MAX_CONCURRENCY),
+                cache=cache,
+                deduplicate=job_info.get('deduplicate', True),
+                completed_results=completed_results,
+                checkpoint_callback=checkpoint.save,
+                should_stop=make_deadline_checker(context),
+                prescreener=create_prescreener(job_info.get('prescreen', False)),
+                streaming=job_info.get('streaming', True),
+                statistics=statistics,
+                alerts=alerts,
+                prioritize=job_info.get('danger_first', False),
+                metrics=metrics,
+                prompt_template=job_info.get('prompt_template'),
+                all_sheets=job_info.get('all_sheets'),
+                base_results=base_results
+            )
+        finally:
+            progress_writer.close()
+            alert_writer.close()
+            job_files.close()
+            metrics.increment('job_info_writes', progress_writer.writes)
+        
+        call_stats = result.get('call_stats')
+        result.pop('metrics', None)
+        if cache is not None:
+            job_info['cache_stats'] = cache.stats()
+            logger.info(f"キャッシュ統計: {job_info['cache_stats']}")
+        if result.get('dedup_stats'):
+            job_info['dedup_stats'] = result['dedup_stats']
+        if base_results is not None:
+            result['diff_stats'] = job_info['diff_stats'] = base_results.summarize(result['results'])
+            logger.info(f"差分分析の内訳: {job_info['diff_stats']}")
+        job_info['source_stats'] = result['source_stats']
+        job_info['live_statistics'] = result['statistics']
+        job_info['alert_stats'] = alert_stats(alerts)
+        logger.info(f"判定元の内訳: {job_info['source_stats']}")
+        logger.info(f"危険コメント通知: {job_info['alert_stats']}")
+        job_info['call_stats'] = merge_stats([job_info.get('call_stats'), result.get('call_stats')])
+        logger.info(f"呼び出し統計: {job_info['call_stats']}")
         
         job_info['status'] = 'completed'
-        job_info['result'] = result
+        with metrics.stage('save_result'):
+            save_job_result(job_id, result, job_info)
         job_info['progress'] = 100
         job_info['message'] = '分析が完了しました'
         job_info['updated_at'] = datetime.now().isoformat()
         
-        try:
-            s3_client.delete_object(
-                Bucket=JOB_BUCKET,
-                Key=file_key
-            )
-            job_info.pop('file_key', None)
-        except Exception as e:
-            logger.warning(f"一時ファイル削除エラー: {str(e)}")
+        delete_job_files(job_info)
         
+        job_info['metrics'] = merge_metric_summaries([previous_metrics, metrics.summary()])
         save_job_info(job_id, job_info)
+        checkpoint.delete()
         
+    except AnalysisSuspended as e:
+        call_stats = e.call_stats
+        checkpoint.flush()
+        job_info['metrics'] = merge_metric_summaries([previous_metrics, metrics.summary()])
+        schedule_continuation(job_id, job_info, e)
     except Exception as e:
         logger.error(f"非同期分析エラー: {str(e)}")
-        job_info['status'] = 'error'
-        job_info['error'] = str(e)
-        job_info['message'] = '分析中にエラーが発生しました'
-        job_info['updated_at'] = datetime.now().isoformat()
+        checkpoint.flush()
+        job_info['metrics'] = merge_metric_summaries([previous_metrics, metrics.summary()])
+        fail_job(job_id, job_info, e)
+    finally:
+        metrics.detach_s3()
+        emit_job_metrics(job_id, job_info.get('status'), metrics, call_stats, job_info.get('processed_comments', 0))
+
+def emit_job_metrics(job_id, status, metrics, call_stats, processed_comments):
+    try:
+        extra = {'Comments': processed_comments}
+        for key, name in CALL_STAT_METRICS.items():
+            extra[name] = (call_stats or {}).get(key, 0)
+        metrics.emit(job_id, status, extra)
+        summary = metrics.summary()
+        logger.info(f"処理時間の内訳: {summary['stages']} / トークン: {summary['tokens']}")
+    except Exception as e:
+        logger.warning(f"メトリクス出力エラー: {str(e)}")
+
+def make_deadline_checker(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return lambda: context.get_remaining_time_in_millis() < CONTINUATION_MARGIN_MS
+
+def schedule_continuation(job_id, job_info, suspended, shard_status=None):
+    state = shard_status if shard_status is not None else job_info
+    state['continuations'] = state.get('continuations', 0) + 1
+    state['call_stats'] = merge_stats([state.get('call_stats'), suspended.call_stats])
+    
+    if state['continuations'] > MAX_CONTINUATIONS:
+        mark_job_failed(job_id, f"継続実行の上限（{MAX_CONTINUATIONS}回）に達しました")
+        return
+    
+    state['message'] = f"処理を継続しています（{state['continuations']}回目、{suspended.processed_count}件完了）"
+    state['updated_at'] = datetime.now().isoformat()
+    
+    payload = {
+        'action': 'process_async',
+        'job_id': job_id,
+        'continuation': state['continuations']
+    }
+    if shard_status is not None:
+        payload['shard_id'] = shard_status['shard_id']
+        save_shard_object(job_id, shard_status['shard_id'], 'status', shard_status)
+    else:
+        save_job_info(job_id, job_info)
+    
+    invoke_async_worker(payload)
+    logger.info(f"継続実行を登録しました: {payload}")
+
+class ProgressWriter:
+    def __init__(self, save, min_interval=PROGRESS_FLUSH_INTERVAL_SECONDS, min_progress_step=PROGRESS_FLUSH_STEP):
+        self._save = save
+        self.min_interval = min_interval
+        self.min_progress_step = min_progress_step
+        self.writes = 0
+        self._pending = None
+        self._pending_progress = 0
+        self._last_progress = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def update(self, snapshot, progress):
+        with self._lock:
+            self._pending = snapshot
+            self._pending_progress = progress
+            urgent = self._last_progress is None or progress - self._last_progress >= self.min_progress_step
+        if urgent:
+            self._wake.set()
+    
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.min_interval)
+            self._wake.clear()
+            
+            with self._lock:
+                snapshot = self._pending
+                progress = self._pending_progress
+                closed = self._closed
+                self._pending = None
+            
+            if snapshot is not None:
+                self._save(snapshot)
+                self.writes += 1
+                with self._lock:
+                    self._last_progress = progress
+            
+            if closed:
+                return
+    
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+
+class JobCheckpoint:
+    def __init__(self, job_id, state, shard_id=None):
+        self.state = state
+        self._buffer = {}
+        self._last_flush = 0 if not state.get('checkpoint_segments') else time.time()
+        self._lock = threading.Lock()
+        if shard_id is None:
+            self.prefix = f"checkpoints/{job_id}/"
+        else:
+            self.prefix = f"checkpoints/{job_id}/shard-{shard_id:03d}/"
+    
+    def _key(self, seq):
+        return f"{self.prefix}{seq:05d}.json"
+    
+    def load(self):
+        completed = {}
+        for seq in range(self.state.get('checkpoint_segments', 0)):
+            try:
+                response = s3_client.get_object(Bucket=JOB_BUCKET, Key=self._key(seq))
+                segment = json.loads(response['Body'].read().decode('utf-8'))
+            except Exception as e:
+                logger.warning(f"チェックポイント読み込みエラー（該当分は再分析）: {str(e)}")
+                continue
+            completed.update((int(index), result) for index, result in segment.items())
+        return completed
+    
+    def save(self, completed):
+        with self._lock:
+            self._buffer.update(completed)
+            if time.time() - self._last_flush >= CHECKPOINT_FLUSH_INTERVAL_SECONDS:
+                self._flush_locked()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
         
-        file_key = job_info.get('file_key')
-        if file_key:
+        seq = self.state.get('checkpoint_segments', 0)
+        try:
+            s3_client.put_object(
+                Bucket=JOB_BUCKET,
+                Key=self._key(seq),
+                Body=json.dumps(self._buffer, ensure_ascii=False),
+                ContentType='application/json'
+            )
+            self.state['checkpoint_counts'] = self.state.get('checkpoint_counts', []) + [len(self._buffer)]
+            self.state['checkpoint_segments'] = seq + 1
+            self._buffer = {}
+        except Exception as e:
+            logger.warning(f"チェックポイント保存エラー: {str(e)}")
+    
+    def read_since(self, cursor, limit=MAX_PARTIAL_RESULTS_PER_STATUS):
+        results = []
+        position = 0
+        for seq, count in enumerate(self.state.get('checkpoint_counts', [])):
+            if position + count <= cursor:
+                position += count
+                continue
             try:
-                s3_client.delete_object(
+                response = s3_client.get_object(Bucket=JOB_BUCKET, Key=self._key(seq))
+                segment = json.loads(response['Body'].read().decode('utf-8'))
+            except Exception as e:
+                logger.warning(f"途中結果の読み込みエラー: {str(e)}")
+                break
+            for result in list(segment.values())[max(0, cursor - position):]:
+                if len(results) >= limit:
+                    return results, cursor + len(results)
+                results.append(result)
+            position += count
+        return results, cursor + len(results)
+    
+    def delete(self):
+        keys = [self._key(seq) for seq in range(self.state.get('checkpoint_segments', 0))]
+        try:
+            for i in range(0, len(keys), 1000):
+                s3_client.delete_objects(
                     Bucket=JOB_BUCKET,
-                    Key=file_key
+                    Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True}
                 )
-                job_info.pop('file_key', None)
-            except Exception as cleanup_e:
-                logger.warning(f"エラー時一時ファイル削除エラー: {str(cleanup_e)}")
-        
-        save_job_info(job_id, job_info)
+        except Exception as e:
+            logger.warning(f"チェックポイント削除エラー: {str(e)}")
 
-def save_job_info(job_id, job_info):
+def fail_job(job_id, job_info, error):
+    job_info['status'] = 'error'
+    job_info['error'] = str(error)
+    job_info['message'] = '分析中にエラーが発生しました'
+    job_info['updated_at'] = datetime.now().isoformat()
+    save_job_info(job_id, job_info)
+
+def mark_job_failed(job_id, error):
+    # シャードなど複数の書き手がいる場合は、最新のジョブ情報を読み直してから条件付きで書き込む
+    def mutate(job_info):
+        if job_info.get('status') in ('completed', 'error'):
+            return False
+        job_info['status'] = 'error'
+        job_info['error'] = str(error)
+        job_info['message'] = '分析中にエラーが発生しました'
+        job_info['updated_at'] = datetime.now().isoformat()
+    
     try:
-        if job_info['status'] in ['completed', 'error']:
-            job_info_copy = job_info.copy()
-            job_info_copy.pop('file_data', None)
-            job_info_copy.pop('file_key', None)
-            job_info = job_info_copy
-        
-        s3_client.put_object(
-            Bucket=JOB_BUCKET,
-            Key=f"jobs/{job_id}.json",
-            Body=json.dumps(job_info, ensure_ascii=False),
-            ContentType='application/json'
-        )
+        get_job_store().modify(job_id, mutate)
     except Exception as e:
         logger.error(f"ジョブ情報保存エラー: {str(e)}")
 
-def get_job_info(job_id):
+def read_job_file(file_key):
+    if not file_key:
+        raise ValueError("ファイルキーが見つかりません")
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_MAX_BYTES)
     try:
         response = s3_client.get_object(
             Bucket=JOB_BUCKET,
-            Key=f"jobs/{job_id}.json"
+            Key=file_key
         )
-        return json.loads(response['Body'].read().decode('utf-8'))
+        shutil.copyfileobj(response['Body'], spool, FILE_READ_CHUNK_BYTES)
+        spool.seek(0)
+        return spool
     except Exception as e:
-        logger.error(f"ジョブ情報取得エラー: {str(e)}")
+        spool.close()
+        raise ValueError(f"ファイルデータの取得に失敗しました: {str(e)}")
+
+def get_job_files(job_info):
+    if job_info.get('files'):
+        return job_info['files']
+    if job_info.get('file_key'):
+        return [{'file_key': job_info['file_key'], 'file_name': None}]
+    return []
+
+def iter_job_files(files, metrics=None):
+    # 複数ファイルのジョブでも、読み込むのは分析中のファイル1つずつにする
+    for entry in files:
+        if metrics is not None:
+            with metrics.stage('read_file'):
+                file_data = read_job_file(entry['file_key'])
+        else:
+            file_data = read_job_file(entry['file_key'])
+        with file_data:
+            yield entry.get('file_name'), file_data
+
+def delete_job_files(job_info):
+    keys = [entry['file_key'] for entry in get_job_files(job_info)]
+    if not keys:
+        return
+    try:
+        s3_client.delete_objects(
+            Bucket=JOB_BUCKET,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+        job_info.pop('files', None)
+        job_info.pop('file_key', None)
+    except Exception as e:
+        logger.warning(f"一時ファイル削除エラー: {str(e)}")
+
+def load_base_result_index(job_info, metrics=None):
+    base_job_id = job_info.get('base_job_id')
+    if not base_job_id:
         return None
+    
+    with metrics.stage('base_load') if metrics is not None else contextlib.nullcontext():
+        base_info = get_job_info(base_job_id, fields=['status', 'result_rows_key', 'result_key', 'result'])
+        if not base_info or base_info.get('status') != 'completed':
+            raise ValueError(f"差分の基準ジョブの結果が見つかりません: {base_job_id}")
+        rows = (row for _, row in iter_result_rows(base_info))
+        return BaseResultIndex(base_job_id, rows, multiple_files=len(get_job_files(job_info)) > 1)
 
-def load_excel_data(file_content):
+def get_lambda_client():
+    global _lambda_client
+    with _lambda_client_lock:
+        if _lambda_client is None:
+            _lambda_client = boto3.client('lambda', region_name='ap-northeast-1')
+        return _lambda_client
+
+def invoke_async_worker(payload):
+    get_lambda_client().invoke(
+        FunctionName='comment-analyzer',
+        InvocationType='Event',
+        Payload=json.dumps(payload)
+    )
+
+def split_job_into_shards(job_id, job_info):
+    from comment_analyzer import iter_file_comments, TEST_MODE_LIMIT
+    
     try:
-        if len(file_content) < 100:
-            raise ValueError("ファイルサイズが小さすぎます。有効なExcelファイルを選択してください。")
+        job_info['status'] = 'processing'
+        job_info['message'] = 'コメントをシャードに分割しています...'
+        job_info['updated_at'] = datetime.now().isoformat()
+        save_job_info(job_id, job_info)
         
-        wb = load_workbook(io.BytesIO(file_content))
-        ws = wb.active
+        comment_stream = iter_file_comments(iter_job_files(get_job_files(job_info)), all_sheets=job_info.get('all_sheets'))
+        try:
+            # テストモードは上限件数を読んだ時点で読み込みを終え、残りの行・ファイルは開かない
+            comments = list(itertools.islice(comment_stream, TEST_MODE_LIMIT) if job_info.get('test_mode') else comment_stream)
+        finally:
+            comment_stream.close()
+        if not comments:
+            raise ValueError("コメントが見つかりませんでした。Excelファイルの内容を確認してください。")
         
-        if ws.max_row < 2:
-            raise ValueError("Excelファイルにデータが見つかりません。最低2行（ヘッダー行+データ行）が必要です。")
+        shard_size = -(-len(comments) // min(job_info['shard_count'], len(comments)))
+        shard_count = 0
+        for shard_id, start in enumerate(range(0, len(comments), shard_size)):
+            shard_comments = comments[start:start + shard_size]
+            save_shard_object(job_id, shard_id, 'input', {'comments': shard_comments})
+            save_shard_object(job_id, shard_id, 'status', {
+                'shard_id': shard_id,
+                'status': 'pending',
+                'processed_comments': 0,
+                'total_comments': len(shard_comments),
+                'updated_at': datetime.now().isoformat()
+            })
+            shard_count += 1
         
-        max_col = ws.max_column
-        if max_col < 1:
-            raise ValueError("Excelファイルに列が見つかりません。")
+        job_info['shard_count'] = shard_count
+        job_info['shards_created'] = True
+        job_info['total_comments'] = len(comments)
+        job_info['message'] = f'{shard_count}個のシャードで分析中...'
+        job_info['updated_at'] = datetime.now().isoformat()
+        save_job_info(job_id, job_info)
+        logger.info(f"シャード分割完了: {len(comments)}件 → {shard_count}シャード")
         
-        comment_cols = max(1, max_col - 6) if max_col >= 7 else 1
+        for shard_id in range(shard_count):
+            invoke_async_worker({
+                'action': 'process_async',
+                'job_id': job_id,
+                'shard_id': shard_id
+            })
         
-        headers = {}
-        for col in range(comment_cols, max_col + 1):
-            header_cell = ws.cell(row=1, column=col)
-            if header_cell.value:
-                headers[col] = str(header_cell.value).strip()
-            else:
-                headers[col] = f'質問{col}'
-        
-        comments = []
-        
-        for row in ws.iter_rows(min_row=2, min_col=comment_cols, max_col=max_col):
-            for cell in row:
-                if cell.value and isinstance(cell.value, str) and len(cell.value.strip()) >= 10:
-                    question_title = headers.get(cell.column, f'質問{cell.column}')
-                    
-                    comments.append({
-                        'row_id': cell.row,
-                        'column_name': question_title,
-                        'comment': cell.value.strip()
-                    })
+    except Exception as e:
+        logger.error(f"シャード分割エラー: {str(e)}")
+        fail_job(job_id, job_info, e)
+
+def process_shard_async(job_id, shard_id, job_info, context=None):
+    from comment_analyzer import analyze_comment_stream, AnalysisSuspended, DEFAULT_MAX_CONCURRENCY
+    
+    shard_status = get_shard_object(job_id, shard_id, 'status') or {'shard_id': shard_id, 'processed_comments': 0}
+    shard_status['status'] = 'processing'
+    shard_status['updated_at'] = datetime.now().isoformat()
+    shard_status.pop('error', None)
+    checkpoint = JobCheckpoint(job_id, shard_status, shard_id)
+    metrics = JobMetrics()
+    metrics.attach_s3(s3_client)
+    previous_metrics = shard_status.get('metrics')
+    call_stats = None
+    
+    try:
+        shard_input = get_shard_object(job_id, shard_id, 'input')
+        if not shard_input:
+            raise ValueError(f"シャード{shard_id}の入力が見つかりません")
+        
+        comments = shard_input['comments']
+        shard_status['total_comments'] = len(comments)
+        save_shard_object(job_id, shard_id, 'status', shard_status)
+        
+        progress_writer = ProgressWriter(lambda snapshot: save_shard_object(job_id, shard_id, 'status', snapshot))
+        statistics = StatisticsAggregator()
+        alert_writer, alerts = create_alert_collector(
+            job_info['created_at'],
+            shard_status.get('alert_stats'),
+            lambda snapshot: save_shard_object(job_id, shard_id, 'alerts', snapshot)
+        )
+        
+        def progress_callback(processed, total, message=""):
+            shard_status['processed_comments'] = min(processed, len(comments))
+            shard_status['live_statistics'] = statistics.snapshot()
+            shard_status['alert_stats'] = alert_stats(alerts)
+            shard_status['updated_at'] = datetime.now().isoformat()
+            progress_writer.update(dict(shard_status), int(shard_status['processed_comments'] * 100 / max(1, len(comments))))
         
-        return comments
+        cache = create_analysis_cache(
+            job_info.get('cache_backend', DEFAULT_CACHE_BACKEND),
+            bucket=JOB_BUCKET,
+            s3_client=s3_client
+        )
+        base_results = load_base_result_index(job_info, metrics)
         
+        try:
+            results, dedup_stats, call_stats = analyze_comment_stream(
+                comments,
+                progress_callback,
+                max_concurrency=job_info.get('max_concurrency', DEFAULT_MAX_CONCURRENCY),
+                cache=cache,
+                deduplicate=job_info.get('deduplicate', True),
+                completed_results=checkpoint.load(),
+                checkpoint_callback=checkpoint.save,
+                should_stop=make_deadline_checker(context),
+                prescreener=create_prescreener(job_info.get('prescreen', False)),
+                streaming=job_info.get('streaming', True),
+                statistics=statistics,
+                alerts=alerts,
+                prioritize=job_info.get('danger_first', False),
+                metrics=metrics,
+                prompt_template=job_info.get('prompt_template'),
+                base_results=base_results
+            )
+        finally:
+            progress_writer.close()
+            alert_writer.close()
+            metrics.increment('job_info_writes', progress_writer.writes)
+        
+        shard_status['metrics'] = merge_metric_summaries([previous_metrics, metrics.summary()])
+        save_shard_object(job_id, shard_id, 'result', {
+            'results': results.to_wire(),
+            'statistics': statistics.snapshot(),
+            'alert_stats': alert_stats(alerts),
+            'dedup_stats': dedup_stats,
+            'cache_stats': cache.stats() if cache is not None else None,
+            'call_stats': merge_stats([shard_status.get('call_stats'), call_stats]),
+            'metrics': shard_status['metrics']
+        })
+        
+        shard_status['status'] = 'completed'
+        shard_status['processed_comments'] = len(comments)
+        shard_status['live_statistics'] = statistics.snapshot()
+        shard_status['updated_at'] = datetime.now().isoformat()
+        save_shard_object(job_id, shard_id, 'status', shard_status)
+        checkpoint.delete()
+        
+    except AnalysisSuspended as e:
+        call_stats = e.call_stats
+        checkpoint.flush()
+        shard_status['metrics'] = merge_metric_summaries([previous_metrics, metrics.summary()])
+        schedule_continuation(job_id, job_info, e, shard_status)
+        return
     except Exception as e:
-        error_msg = str(e)
-        if "not a zip file" in error_msg.lower():
-            raise ValueError("無効なExcelファイル形式です。.xlsx または .xls ファイルを選択してください。")
-        elif "bad zip file" in error_msg.lower():
-            raise ValueError("Excelファイルが破損している可能性があります。別のファイルを試してください。")
-        elif "no such file" in error_msg.lower():
-            raise ValueError("ファイルが見つかりません。ファイルを再選択してください。")
-        else:
-            raise ValueError(f"Excelファイルの読み込みに失敗しました: {error_msg}")
+        logger.error(f"シャード分析エラー (シャード{shard_id}): {str(e)}")
+        checkpoint.flush()
+        shard_status['metrics'] = merge_metric_summaries([previous_metrics, metrics.summary()])
+        shard_status['status'] = 'error'
+        shard_status['error'] = str(e)
+        shard_status['updated_at'] = datetime.now().isoformat()
+        save_shard_object(job_id, shard_id, 'status', shard_status)
+        mark_job_failed(job_id, f"シャード{shard_id}: {e}")
+        return
+    finally:
+        metrics.detach_s3()
+        emit_job_metrics(f"{job_id}#{shard_id}", shard_status.get('status'), metrics, call_stats,
+                         shard_status.get('processed_comments', 0))
+    
+    shards = get_shard_statuses(job_id, job_info['shard_count'])
+    if all(shard.get('status') == 'completed' for shard in shards) and acquire_reduce_lock(job_id):
+        reduce_shard_results(job_id)
 
-def calculate_statistics(results):
-    total = len(results)
-    positive_count = sum(1 for r in results if r['sentiment'] == 'positive')
-    negative_count = sum(1 for r in results if r['sentiment'] == 'negative')
-    neutral_count = sum(1 for r in results if r['sentiment'] == 'neutral')
-    danger_count = sum(1 for r in results if r['is_dangerous'])
+def reduce_shard_results(job_id):
+    from comment_analyzer import build_analysis_response
     
-    categories = {}
-    for r in results:
-        cat = r['category']
-        categories[cat] = categories.get(cat, 0) + 1
+    job_info = get_job_info(job_id)
+    if not job_info:
+        logger.error(f"集約対象のジョブ情報が見つかりません: {job_id}")
+        return
     
+    try:
+        shard_count = job_info['shard_count']
+        results = ResultColumns()
+        dedup_stats_list = []
+        cache_stats_list = []
+        call_stats_list = []
+        statistics_list = []
+        alert_stats_list = []
+        metrics_list = []
+        
+        for shard_id in range(shard_count):
+            shard_result = get_shard_object(job_id, shard_id, 'result')
+            if shard_result is None:
+                raise ValueError(f"シャード{shard_id}の結果が見つかりません")
+            results.extend(ResultColumns.from_wire(shard_result['results']))
+            dedup_stats_list.append(shard_result.get('dedup_stats'))
+            cache_stats_list.append(shard_result.get('cache_stats'))
+            call_stats_list.append(shard_result.get('call_stats'))
+            statistics_list.append(shard_result.get('statistics'))
+            alert_stats_list.append(shard_result.get('alert_stats'))
+            metrics_list.append(shard_result.get('metrics'))
+        
+        dedup_stats = merge_stats(dedup_stats_list)
+        result = build_analysis_response(results, dedup_stats, merge_stats(call_stats_list), merge_statistics(statistics_list))
+        
+        cache_stats = merge_stats(cache_stats_list)
+        if cache_stats:
+            lookups = cache_stats.get('hits', 0) + cache_stats.get('misses', 0)
+            cache_stats['hit_rate'] = round(cache_stats.get('hits', 0) / lookups, 4) if lookups else 0.0
+            job_info['cache_stats'] = cache_stats
+        if dedup_stats:
+            job_info['dedup_stats'] = dedup_stats
+        base_results = load_base_result_index(job_info)
+        if base_results is not None:
+            result['diff_stats'] = job_info['diff_stats'] = base_results.summarize(results)
+            logger.info(f"差分分析の内訳: {job_info['diff_stats']}")
+        job_info['source_stats'] = result['source_stats']
+        job_info['live_statistics'] = result['statistics']
+        job_info['alert_stats'] = merge_alert_stats(alert_stats_list)
+        save_job_alerts(job_id, merge_alerts(get_shard_object(job_id, shard_id, 'alerts') for shard_id in range(shard_count)), job_info)
+        if result.get('call_stats'):
+            job_info['call_stats'] = result['call_stats']
+        job_info['metrics'] = merge_metric_summaries(metrics_list)
+        
+        job_info['status'] = 'completed'
+        save_job_result(job_id, result, job_info)
+        job_info['processed_comments'] = len(results)
+        job_info['total_comments'] = len(results)
+        job_info['progress'] = 100
+        job_info['message'] = '分析が完了しました'
+        job_info['updated_at'] = datetime.now().isoformat()
+        
+        delete_job_files(job_info)
+        
+        save_job_info(job_id, job_info)
+        delete_shard_objects(job_id, shard_count)
+        logger.info(f"シャード集約完了: {job_id} ({len(results)}件)")
+        
+    except Exception as e:
+        logger.error(f"シャード集約エラー: {str(e)}")
+        fail_job(job_id, job_info, e)
+
+def merge_stats(stats_list):
+    merged = {}
+    for stats in stats_list:
+        if not stats:
+            continue
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+            else:
+                merged.setdefault(key, value)
+    return merged or None
+
+def create_alert_collector(created_at, previous_stats, save):
+    started_at = datetime.fromisoformat(created_at).timestamp()
+    collector = AlertCollector(started_at, (previous_stats or {}).get('first_alert_seconds'))
+    if previous_stats is None:
+        # 継続実行時は前回の通知を残し、復元した結果から再集計されるのを待つ
+        save(collector.snapshot())
+    writer = ProgressWriter(save, min_interval=ALERT_FLUSH_INTERVAL_SECONDS, min_progress_step=1)
+    collector.on_alert = lambda snapshot: writer.update(snapshot, snapshot['count'])
+    return writer, collector
+
+def alert_stats(alerts):
+    return {'alerts': alerts.count, 'first_alert_seconds': alerts.first_alert_seconds}
+
+def merge_alert_stats(stats_list):
+    stats_list = [stats for stats in stats_list if stats]
+    first_alerts = [stats['first_alert_seconds'] for stats in stats_list if stats.get('first_alert_seconds') is not None]
     return {
-        'total': total,
-        'positive': positive_count,
-        'negative': negative_count,
-        'neutral': neutral_count,
-        'dangerous': danger_count,
-        'categories': categories
-    } 
\ No newline at end of file
+        'alerts': sum(stats.get('alerts', 0) for stats in stats_list),
+        'first_alert_seconds': min(first_alerts) if first_alerts else None
+    }
+
+def merge_alerts(snapshots):
+    snapshots = [snapshot for snapshot in snapshots if snapshot]
+    first_alerts = [snapshot['first_alert_seconds'] for snapshot in snapshots if snapshot.get('first_alert_seconds') is not None]
+    alerts = sorted((alert for snapshot in snapshots for alert in snapshot.get('alerts', [])), key=lambda alert: alert.get('detected_seconds', 0))
+    return {
+        'count': sum(snapshot.get('count', 0) for snapshot in snapshots),
+        'first_alert_seconds': min(first_alerts) if first_alerts else None,
+        'alerts': alerts[:MAX_ALERTS]
+    }
+
+def shard_object_key(job_id, shard_id, name):
+    return f"shards/{job_id}/{shard_id:03d}/{name}.json"
+
+def save_shard_object(job_id, shard_id, name, data):
+    try:
+        s3_client.put_object(
+            Bucket=JOB_BUCKET,
+            Key=shard_object_key(job_id, shard_id, name),
+            Body=json.dumps(data, ensure_ascii=False),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        logger.error(f"シャード情報保存エラー: {str(e)}")
+        if name != 'status':
+            raise
+
+def get_shard_object(job_id, shard_id, name):
+    try:
+        response = s3_client.get_object(
+            Bucket=JOB_BUCKET,
+            Key=shard_object_key(job_id, shard_id, name)
+        )
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except Exception as e:
+        logger.error(f"シャード情報取得エラー: {str(e)}")
+        return None
+
+def get_shard_statuses(job_id, shard_count):
+    return [
+        get_shard_object(job_id, shard_id, 'status') or {'shard_id': shard_id, 'status': 'pending', 'processed_comments': 0}
+        for shard_id in range(shard_count)
+    ]
+
+def acquire_reduce_lock(job_id):
+    try:
+        s3_client.put_object(
+            Bucket=JOB_BUCKET,
+            Key=f"shards/{job_id}/reduce.lock",
+            Body=b'',
+            IfNoneMatch='*'
+        )
+        return True
+    except Exception as e:
+        code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code', '')
+        if code in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            logger.info(f"集約は他のシャードが実行中です: {job_id}")
+            return False
+        logger.warning(f"集約ロック取得エラー（集約を続行）: {str(e)}")
+        return True
+
+def delete_shard_objects(job_id, shard_count):
+    keys = [f"shards/{job_id}/reduce.lock"]
+    for shard_id in range(shard_count):
+        keys.extend(shard_object_key(job_id, shard_id, name) for name in ('input', 'status', 'result', 'alerts'))
+    
+    try:
+        for i in range(0, len(keys), 1000):
+            s3_client.delete_objects(
+                Bucket=JOB_BUCKET,
+                Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True}
+            )
+    except Exception as e:
+        logger.warning(f"シャード一時ファイル削除エラー: {str(e)}")
+
+def get_job_store():
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = create_job_store(
+                JOB_STORE_BACKEND,
+                bucket=JOB_BUCKET,
+                s3_client=s3_client,
+                table_name=JOB_STORE_TABLE,
+                path=JOB_STORE_PATH,
+                endpoint_url=JOB_STORE_ENDPOINT_URL
+            )
+        return _job_store
+
+def save_job_info(job_id, job_info, expected_version=None):
+    try:
+        document = job_info
+        if job_info['status'] == 'completed':
+            document = job_info.copy()
+            document.pop('file_data', None)
+            document.pop('file_key', None)
+            document.pop('files', None)
+        
+        job_info['version'] = get_job_store().put(job_id, document, expected_version=expected_version)
+        return job_info['version']
+    except JobVersionConflict:
+        if expected_version is not None:
+            raise
+        logger.error(f"ジョブ情報保存エラー: 競合が解消しませんでした ({job_id})")
+    except Exception as e:
+        logger.error(f"ジョブ情報保存エラー: {str(e)}")
+
+def update_job_info(job_id, job_info, fields):
+    try:
+        changes = {field: job_info[field] for field in fields if field in job_info}
+        return get_job_store().update(job_id, changes)
+    except JobNotFound:
+        logger.warning(f"更新対象のジョブ情報が見つかりません: {job_id}")
+    except Exception as e:
+        logger.error(f"ジョブ情報保存エラー: {str(e)}")
+
+def save_job_alerts(job_id, alerts, job_info):
+    try:
+        key = f"alerts/{job_id}.json"
+        s3_client.put_object(
+            Bucket=JOB_BUCKET,
+            Key=key,
+            Body=json.dumps(alerts, ensure_ascii=False),
+            ContentType='application/json'
+        )
+        job_info['alerts_key'] = key
+    except Exception as e:
+        logger.error(f"危険コメント通知の保存エラー: {str(e)}")
+
+def save_job_result(job_id, result, job_info):
+    rows_key = f"results/{job_id}/results.jsonl.gz"
+    summary_key = f"results/{job_id}/summary.json"
+    
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as gz:
+        for row in result.get('results', []):
+            gz.write(json.dumps(row, ensure_ascii=False).encode('utf-8'))
+            gz.write(b'\n')
+    
+    s3_client.put_object(
+        Bucket=JOB_BUCKET,
+        Key=rows_key,
+        Body=buffer.getvalue(),
+        ContentType='application/x-ndjson',
+        ContentEncoding='gzip'
+    )
+    
+    summary = {key: value for key, value in result.items() if key != 'results'}
+    summary['total_results'] = len(result.get('results', []))
+    s3_client.put_object(
+        Bucket=JOB_BUCKET,
+        Key=summary_key,
+        Body=json.dumps(summary, ensure_ascii=False),
+        ContentType='application/json'
+    )
+    
+    job_info['result_rows_key'] = rows_key
+    job_info['result_summary_key'] = summary_key
+
+def encode_results(results, result_format):
+    if result_format == RESULT_WIRE_FORMAT:
+        return results.to_wire() if isinstance(results, ResultColumns) else ResultColumns(results).to_wire()
+    return list(results)
+
+def get_job_object(key):
+    try:
+        response = s3_client.get_object(
+            Bucket=JOB_BUCKET,
+            Key=key
+        )
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except Exception as e:
+        logger.error(f"結果取得エラー: {str(e)}")
+        return None
+
+def load_legacy_result(job_info):
+    if job_info.get('result_key'):
+        return get_job_object(job_info['result_key'])
+    return job_info.get('result', {})
+
+def load_result_summary(job_info):
+    if job_info.get('result_summary_key'):
+        return get_job_object(job_info['result_summary_key'])
+    
+    result = load_legacy_result(job_info)
+    if result is None:
+        return None
+    summary = {key: value for key, value in result.items() if key != 'results'}
+    summary['total_results'] = len(result.get('results', []))
+    return summary
+
+def iter_result_rows(job_info, start=0):
+    if not job_info.get('result_rows_key'):
+        rows = (load_legacy_result(job_info) or {}).get('results', [])
+        for position in range(start, len(rows)):
+            yield position, rows[position]
+        return
+    
+    response = s3_client.get_object(
+        Bucket=JOB_BUCKET,
+        Key=job_info['result_rows_key']
+    )
+    with gzip.GzipFile(fileobj=response['Body'], mode='rb') as gz:
+        for position, line in enumerate(gz):
+            if position >= start and line.strip():
+                yield position, json.loads(line)
+
+def get_job_info(job_id, fields=None):
+    try:
+        return get_job_store().get(job_id, fields=fields)
+    except Exception as e:
+        logger.error(f"ジョブ情報取得エラー: {str(e)}")
+        return None
@@ -0,0 +1,202 @@
+import heapq
+import threading
+import time
+from result_store import SOURCE_FIELDS
+
+HISTOGRAM_BINS = 10
+TOP_K = 10
+TOP_COMMENT_PREVIEW_LENGTH = 120
+MAX_ALERTS = 50
+
+def histogram_bin(score) -> int:
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        score = 0.0
+    return min(HISTOGRAM_BINS - 1, max(0, int(score * HISTOGRAM_BINS)))
+
+def source_tags(result: dict, row: dict) -> dict:
+    tags = {}
+    for field in SOURCE_FIELDS:
+        value = row.get(field, result.get(field))
+        if value is not None:
+            tags[field] = value
+    return tags
+
+def empty_file_stats() -> dict:
+    return {'total': 0, 'positive': 0, 'negative': 0, 'neutral': 0, 'dangerous': 0, 'categories': {}, 'sheets': {}}
+
+class StatisticsAggregator:
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self.total = 0
+        self.sentiments = {'positive': 0, 'negative': 0, 'neutral': 0}
+        self.categories = {}
+        self.columns = {}
+        self.files = {}
+        self.sources = {'local': 0, 'cache': 0, 'llm': 0, 'base': 0}
+        self.dangerous = 0
+        self.danger_histogram = [0] * HISTOGRAM_BINS
+        self.importance_histogram = [0] * HISTOGRAM_BINS
+        self._top_dangerous = []
+        self._top_important = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, result: dict, row: dict = None):
+        row = row or result
+        column_name = row.get('column_name', result.get('column_name', 'comment'))
+        tags = source_tags(result, row)
+
+        with self._lock:
+            self.total += 1
+            sentiment = result.get('sentiment', 'neutral')
+            self.sentiments[sentiment] = self.sentiments.get(sentiment, 0) + 1
+            category = result.get('category', 'その他')
+            self.categories[category] = self.categories.get(category, 0) + 1
+            self.columns[column_name] = self.columns.get(column_name, 0) + 1
+            source = result.get('source', 'llm')
+            self.sources[source] = self.sources.get(source, 0) + 1
+            if result.get('is_dangerous'):
+                self.dangerous += 1
+            self.danger_histogram[histogram_bin(result.get('danger_score', 0))] += 1
+            self.importance_histogram[histogram_bin(result.get('importance_score', 0))] += 1
+            if 'file_name' in tags:
+                file_stats = self.files.setdefault(tags['file_name'], empty_file_stats())
+                file_stats['total'] += 1
+                file_stats[sentiment] = file_stats.get(sentiment, 0) + 1
+                file_stats['categories'][category] = file_stats['categories'].get(category, 0) + 1
+                if result.get('is_dangerous'):
+                    file_stats['dangerous'] += 1
+                if 'sheet_name' in tags:
+                    file_stats['sheets'][tags['sheet_name']] = file_stats['sheets'].get(tags['sheet_name'], 0) + 1
+
+            entry = {
+                'row_id': row.get('row_id', result.get('row_id')),
+                'column_name': column_name,
+                'comment': str(row.get('comment', result.get('comment', '')))[:TOP_COMMENT_PREVIEW_LENGTH],
+                'danger_score': result.get('danger_score', 0),
+                'importance_score': result.get('importance_score', 0)
+            }
+            entry.update(tags)
+            self._push(self._top_dangerous, entry['danger_score'], entry)
+            self._push(self._top_important, entry['importance_score'], entry)
+
+    def add_many(self, results):
+        for result in results:
+            self.add(result)
+        return self
+
+    def _push(self, heap: list, score, entry: dict):
+        self._seq += 1
+        # 同点の場合は先に追加された（行番号が若い）コメントを残す
+        item = (score, -self._seq, entry)
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def merge(self, snapshot: dict):
+        if not snapshot:
+            return self
+        with self._lock:
+            self.total += snapshot.get('total', 0)
+            for key in ('positive', 'negative', 'neutral'):
+                self.sentiments[key] = self.sentiments.get(key, 0) + snapshot.get(key, 0)
+            for target, counts in ((self.categories, snapshot.get('categories')), (self.columns, snapshot.get('columns')),
+                                   (self.sources, snapshot.get('sources'))):
+                for key, count in (counts or {}).items():
+                    target[key] = target.get(key, 0) + count
+            self.dangerous += snapshot.get('dangerous', 0)
+            for file_name, counts in snapshot.get('files', {}).items():
+                file_stats = self.files.setdefault(file_name, empty_file_stats())
+                for key, value in counts.items():
+                    if isinstance(value, dict):
+                        for name, count in value.items():
+                            file_stats[key][name] = file_stats[key].get(name, 0) + count
+                    else:
+                        file_stats[key] = file_stats.get(key, 0) + value
+            for target, counts in ((self.danger_histogram, snapshot.get('danger_histogram')),
+                                   (self.importance_histogram, snapshot.get('importance_histogram'))):
+                for index, count in enumerate((counts or [])[:HISTOGRAM_BINS]):
+                    target[index] += count
+            for entry in snapshot.get('top_dangerous', []):
+                self._push(self._top_dangerous, entry.get('danger_score', 0), entry)
+            for entry in snapshot.get('top_important', []):
+                self._push(self._top_important, entry.get('importance_score', 0), entry)
+        return self
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'total': self.total,
+                'positive': self.sentiments.get('positive', 0),
+                'negative': self.sentiments.get('negative', 0),
+                'neutral': self.sentiments.get('neutral', 0),
+                'dangerous': self.dangerous,
+                'categories': dict(self.categories),
+                'columns': dict(self.columns),
+                'files': {file_name: dict(counts, categories=dict(counts['categories']), sheets=dict(counts['sheets']))
+                          for file_name, counts in self.files.items()},
+                'sources': dict(self.sources),
+                'danger_histogram': list(self.danger_histogram),
+                'importance_histogram': list(self.importance_histogram),
+                'top_dangerous': [entry for _, _, entry in sorted(self._top_dangerous, reverse=True)],
+                'top_important': [entry for _, _, entry in sorted(self._top_important, reverse=True)]
+            }
+
+    def source_stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.sources)
+            total = self.total
+        counts['local_share'] = round(counts.get('local', 0) / total, 4) if total else 0.0
+        return counts
+
+def merge_statistics(snapshots) -> StatisticsAggregator:
+    aggregator = StatisticsAggregator()
+    for snapshot in snapshots:
+        aggregator.merge(snapshot)
+    return aggregator
+
+class AlertCollector:
+    def __init__(self, started_at: float, first_alert_seconds=None, max_alerts: int = MAX_ALERTS, on_alert=None):
+        self.started_at = started_at
+        self.first_alert_seconds = first_alert_seconds
+        self.max_alerts = max_alerts
+        self.on_alert = on_alert
+        self.count = 0
+        self.alerts = []
+        self._lock = threading.Lock()
+
+    def add(self, result: dict, row: dict = None):
+        if not result.get('is_dangerous'):
+            return
+        row = row or result
+
+        with self._lock:
+            self.count += 1
+            if self.first_alert_seconds is None:
+                self.first_alert_seconds = round(time.time() - self.started_at, 3)
+            if len(self.alerts) < self.max_alerts:
+                alert = {
+                    'row_id': row.get('row_id', result.get('row_id')),
+                    'column_name': row.get('column_name', result.get('column_name')),
+                    'comment': str(row.get('comment', result.get('comment', '')))[:TOP_COMMENT_PREVIEW_LENGTH],
+                    'danger_score': result.get('danger_score', 0),
+                    'danger_reasons': result.get('danger_reasons', ''),
+                    'source': result.get('source', 'llm'),
+                    'detected_seconds': round(time.time() - self.started_at, 3)
+                }
+                alert.update(source_tags(result, row))
+                self.alerts.append(alert)
+
+        if self.on_alert:
+            self.on_alert(self.snapshot())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'count': self.count,
+                'first_alert_seconds': self.first_alert_seconds,
+                'alerts': list(self.alerts)
+            }
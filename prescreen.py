@@ -0,0 +1,214 @@
+import logging
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DANGER_THRESHOLD = 0.9
+DEFAULT_MAX_LOCAL_LENGTH = 60
+DEFAULT_MIN_POSITIVE_HITS = 1
+DEFAULT_EMPTY_MAX_LENGTH = 10
+
+RISK_NEGATIVE_WEIGHT = 0.1
+RISK_NEGATIVE_WEIGHT_CAP = 0.3
+RISK_LENGTH_WEIGHT = 0.1
+RISK_LENGTH_SCALE = 200
+
+DANGER_KEYWORDS = {
+    '死ね': 1.0, 'しね': 0.95, '殺す': 0.95, 'ころす': 0.95, '消えろ': 0.9, '氏ね': 0.9,
+    '死んで': 0.85, 'ゴミ': 0.8, 'カス': 0.8, 'キモい': 0.8, 'きもい': 0.8, 'キモ': 0.75,
+    'バカ': 0.8, 'ばか': 0.8, '馬鹿': 0.8, 'アホ': 0.8, 'あほ': 0.8,
+    'クソ': 0.8, 'くそ': 0.75, '糞': 0.8, 'ムカつく': 0.75, 'むかつく': 0.75,
+    'うざい': 0.75, 'ウザい': 0.75, 'うぜ': 0.75, 'ウザ': 0.7,
+    '最悪': 0.7, 'ひどい': 0.65, '酷い': 0.65, 'ふざけ': 0.65
+}
+
+POSITIVE_KEYWORDS = (
+    'ありがとう', '分かりやす', 'わかりやす', '理解しやす', '面白', 'おもしろ', '楽しかった', '楽しい',
+    '勉強になり', '良かった', 'よかった', '良い授業', '興味深', '参考にな', '丁寧', '満足', '感謝'
+)
+
+NEGATIVE_KEYWORDS = (
+    'ない', 'なかった', 'にくい', 'づらい', '難し', 'ほしい', '欲しい', '改善', '不満', 'つまらな',
+    '嫌', '遅', '早すぎ', '速すぎ', '少な', '多すぎ', '残念', 'しかし', 'でも', 'ただ', 'もう少し',
+    'もっと', '?', '困'
+)
+
+CATEGORY_KEYWORDS = {
+    '講義内容': ('内容', '説明', '授業', '講義', '解説', '例', '話'),
+    '講義資料': ('資料', 'スライド', 'プリント', '教科書', 'レジュメ', '板書', '動画'),
+    '運営': ('時間', '教室', '連絡', '課題', '提出', '成績', '出席', 'システム', '日程', 'マイク')
+}
+
+EMPTY_PHRASES = (
+    'なし', '無し', 'ない', '特になし', '特に無し', '特にない', '特にありません', 'ありません',
+    'とくになし', 'none', 'na', 'n/a'
+)
+
+def normalize_prescreen_text(text) -> str:
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    return ''.join(ch for ch in text if not ch.isspace())
+
+# ひらがなだけの語は「少しねむい」「ところすごく」のように普通の文の途中にも現れるため、
+# 単独では危険と判定せずBedrockに回す（優先順位の推定には使う）
+def is_ambiguous_danger_keyword(keyword: str) -> bool:
+    return all('\u3041' <= ch <= '\u309f' or ch == 'ー' for ch in keyword)
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword in keywords:
+            self._insert(normalize_prescreen_text(keyword), keyword)
+        self._build_failure_links()
+
+    def _insert(self, pattern, keyword):
+        state = 0
+        for ch in pattern:
+            if ch not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][ch] = len(self._goto) - 1
+            state = self._goto[state][ch]
+        self._output[state].append(keyword)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, normalized_text: str) -> list:
+        matches = []
+        state = 0
+        for ch in normalized_text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            matches.extend(self._output[state])
+        return matches
+
+class KeywordPrescreener:
+    def __init__(self, danger_threshold: float = DEFAULT_DANGER_THRESHOLD, max_local_length: int = DEFAULT_MAX_LOCAL_LENGTH,
+                 min_positive_hits: int = DEFAULT_MIN_POSITIVE_HITS, empty_max_length: int = DEFAULT_EMPTY_MAX_LENGTH):
+        self.danger_threshold = float(danger_threshold)
+        self.max_local_length = int(max_local_length)
+        self.min_positive_hits = int(min_positive_hits)
+        self.empty_max_length = int(empty_max_length)
+
+        self._danger = {normalize_prescreen_text(k): v for k, v in DANGER_KEYWORDS.items()}
+        self._ambiguous_danger = set(normalize_prescreen_text(k) for k in DANGER_KEYWORDS if is_ambiguous_danger_keyword(k))
+        self._positive = set(normalize_prescreen_text(k) for k in POSITIVE_KEYWORDS)
+        self._categories = {
+            normalize_prescreen_text(keyword): category
+            for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords
+        }
+        self._empty_phrases = set(normalize_prescreen_text(p) for p in EMPTY_PHRASES)
+        self._matcher = KeywordMatcher(
+            list(self._danger) + list(self._positive) + list(self._categories) + [normalize_prescreen_text(k) for k in NEGATIVE_KEYWORDS]
+        )
+
+    def config(self) -> dict:
+        return {
+            'danger_threshold': self.danger_threshold,
+            'max_local_length': self.max_local_length,
+            'min_positive_hits': self.min_positive_hits,
+            'empty_max_length': self.empty_max_length
+        }
+
+    def classify(self, comment):
+        text = normalize_prescreen_text(comment)
+
+        if not text or (len(text) <= self.empty_max_length and text.rstrip('。.!！') in self._empty_phrases):
+            return {
+                'sentiment': 'neutral',
+                'sentiment_score': 0.5,
+                'category': 'その他',
+                'category_confidence': 0.9,
+                'is_dangerous': False,
+                'danger_score': 0.0,
+                'importance_score': 0.1
+            }
+
+        matches = set(self._matcher.find_all(text))
+        danger_hits = [k for k in matches if k in self._danger]
+        positive_hits = [k for k in matches if k in self._positive]
+        negative_hits = [k for k in matches if k not in self._danger and k not in self._positive and k not in self._categories]
+        category = self._guess_category(matches)
+
+        if danger_hits:
+            labeled_hits = [k for k in danger_hits if k not in self._ambiguous_danger]
+            danger_score = max((self._danger[k] for k in labeled_hits), default=0.0)
+            if danger_score < self.danger_threshold:
+                return None
+            return {
+                'sentiment': 'negative',
+                'sentiment_score': 0.1,
+                'category': category,
+                'category_confidence': 0.5,
+                'is_dangerous': True,
+                'danger_score': danger_score,
+                'importance_score': 0.9,
+                'matched_keywords': sorted(labeled_hits)
+            }
+
+        if len(text) > self.max_local_length or negative_hits or len(positive_hits) < self.min_positive_hits:
+            return None
+
+        return {
+            'sentiment': 'positive',
+            'sentiment_score': round(min(0.95, 0.7 + 0.1 * len(positive_hits)), 2),
+            'category': category,
+            'category_confidence': 0.6 if category != 'その他' else 0.5,
+            'is_dangerous': False,
+            'danger_score': 0.05,
+            'importance_score': 0.3
+        }
+
+    def _guess_category(self, matches) -> str:
+        counts = {}
+        for keyword in matches:
+            category = self._categories.get(keyword)
+            if category:
+                counts[category] = counts.get(category, 0) + 1
+        if not counts:
+            return 'その他'
+        return max(counts, key=counts.get)
+
+class RiskEstimator:
+    def __init__(self):
+        self._danger = {normalize_prescreen_text(k): v for k, v in DANGER_KEYWORDS.items()}
+        self._negative = set(normalize_prescreen_text(k) for k in NEGATIVE_KEYWORDS)
+        self._matcher = KeywordMatcher(list(self._danger) + list(self._negative))
+
+    def score(self, comment) -> float:
+        text = normalize_prescreen_text(comment)
+        matches = set(self._matcher.find_all(text))
+        danger = max((self._danger[k] for k in matches if k in self._danger), default=0.0)
+        negative_hits = sum(1 for k in matches if k in self._negative)
+        return danger + min(RISK_NEGATIVE_WEIGHT_CAP, RISK_NEGATIVE_WEIGHT * negative_hits) + RISK_LENGTH_WEIGHT * min(1.0, len(text) / RISK_LENGTH_SCALE)
+
+    def order(self, comments) -> list:
+        scores = [self.score(c['comment']) for c in comments]
+        return sorted(range(len(comments)), key=lambda i: -scores[i])
+
+def create_prescreener(options):
+    if not options:
+        return None
+    if options is True:
+        return KeywordPrescreener()
+    if isinstance(options, dict):
+        allowed = ('danger_threshold', 'max_local_length', 'min_positive_hits', 'empty_max_length')
+        unknown = [key for key in options if key not in allowed]
+        if unknown:
+            raise ValueError(f"不明な事前判定オプション: {', '.join(unknown)}")
+        return KeywordPrescreener(**options)
+    raise ValueError(f"不正な事前判定設定: {options}")
@@ -0,0 +1,177 @@
+TEXT_COMPLETION_FORMAT = 'text_completion'
+MESSAGES_FORMAT = 'messages'
+MESSAGES_API_VERSION = 'bedrock-2023-05-31'
+# v4（Messages形式）はBedrockでの応答形式の確認が済むまで明示指定時のみ使う
+DEFAULT_PROMPT_TEMPLATE = 'v3'
+# テンプレートの版を保存していない古いジョブが使っていた版
+LEGACY_PROMPT_TEMPLATE = 'v3'
+# Bedrockでプロンプトキャッシュ（cache_control）に対応を確認したモデル。日付まで含めて照合し、後継モデルには指定を付けない
+PROMPT_CACHING_MODELS = (
+    'anthropic.claude-3-5-haiku-20241022',
+    'anthropic.claude-3-7-sonnet-20250219',
+    'anthropic.claude-sonnet-4-20250514',
+    'anthropic.claude-opus-4-20250514'
+)
+
+RESULT_FORMAT_EXAMPLE = """[
+  {
+    "id": 1,
+    "sentiment": "positive",
+    "sentiment_score": 0.8,
+    "category": "講義内容",
+    "category_confidence": 0.9,
+    "is_dangerous": false,
+    "danger_score": 0.1,
+    "importance_score": 0.7
+  }
+]"""
+
+ANALYSIS_CRITERIA = """分析基準:
+1. sentiment: "positive"(肯定的), "negative"(否定的), "neutral"(中立)
+2. category: 必ず「講義内容」「講義資料」「運営」「その他」のいずれかを選択
+
+3. 危険コメント判定基準（講義運営の観点）:
+   以下に該当する場合はis_dangerous: true、danger_score: 0.7以上に設定:
+
+   【誹謗中傷・人格攻撃】
+   - 講師・教員への人格否定、侮辱、悪口
+   - 他の学生への攻撃的言及
+   - 個人の外見・能力・人格への中傷
+
+   【運営への攻撃・悪口】
+   - 大学・学部・学科・授業運営への不当な攻撃
+   - 運営方針への建設的でない批判
+   - システムや制度への破壊的批判
+
+   【運営妨害行為】
+   - 授業妨害を示唆する内容
+   - 他学生の学習を妨げる行為の示唆
+   - 破壊的・反社会的行為の提案
+
+   【不適切な言葉遣い】
+   - 汚い言葉、罵詈雑言
+   - 差別的表現、ヘイトスピーチ
+   - 暴力的・脅迫的表現
+   - 性的・わいせつな表現
+   - 「死ね」「殺す」「バカ」「クソ」「ムカつく」「最悪」「ひどい」「うざい」など
+
+4. danger_score設定:
+   - 0.9-1.0: 緊急対応必要（脅迫・暴力的表現）
+   - 0.8-0.9: 即座に対応必要（人格攻撃・誹謗中傷）
+   - 0.7-0.8: 要注意（運営攻撃・不適切言葉）
+   - 0.5-0.7: 注意（建設的でない強い批判）
+   - 0.0-0.5: 安全（建設的意見・要望）
+
+5. importance_score: コメントの重要度（0.0-1.0）
+
+注意：「つまらない」「わからない」「嫌い」「やめたい」程度でも、文脈や表現によっては危険度0.5-0.7として判定してください。攻撃的な表現や感情的な否定は積極的に危険と判定してください。"""
+
+def supports_prompt_caching(model_id: str) -> bool:
+    # クロスリージョン推論の接頭辞（apac.など）は除いて照合する
+    start = model_id.find('anthropic.')
+    return start >= 0 and model_id[start:].startswith(PROMPT_CACHING_MODELS)
+
+class PromptTemplate:
+    def __init__(self, version: str, request_format: str, head: str, tail: str = '', system: str = None):
+        self.version = version
+        self.request_format = request_format
+        self.head = head
+        self.tail = tail
+        self.system = system
+
+    def build_body(self, batch_comments: list) -> str:
+        count = str(len(batch_comments))
+        parts = [self.head.replace('{count}', count)]
+        parts.extend(f"[{i}] {str(comment_data['comment']).strip()}\n" for i, comment_data in enumerate(batch_comments, 1))
+        parts.append(self.tail.replace('{count}', count))
+        return ''.join(parts)
+
+    def build_request(self, batch_comments: list, model_id: str, max_tokens: int, temperature: float = 0.1, top_p: float = 0.9):
+        body = self.build_body(batch_comments)
+        if self.request_format == TEXT_COMPLETION_FORMAT:
+            request = {
+                "prompt": f"Human: {body}\n\nAssistant:",
+                "max_tokens_to_sample": max_tokens,
+                "temperature": temperature,
+                "top_p": top_p,
+                "stop_sequences": ["Human:", "Assistant:"]
+            }
+            return request, body
+
+        # cache_controlを付けるときだけブロック形式にする
+        system = self.system
+        if supports_prompt_caching(model_id):
+            system = [{"type": "text", "text": self.system, "cache_control": {"type": "ephemeral"}}]
+        # 新しいモデルはtemperatureとtop_pの同時指定を受け付けないため、Messages形式ではtemperatureのみ送る
+        request = {
+            "anthropic_version": MESSAGES_API_VERSION,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "system": system,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": body}]}]
+        }
+        return request, self.system + body
+
+    def parse_response(self, response_body: dict, headers: dict = None):
+        usage = {}
+        headers = headers or {}
+        if 'x-amzn-bedrock-input-token-count' in headers:
+            usage['inputTokenCount'] = headers['x-amzn-bedrock-input-token-count']
+            usage['outputTokenCount'] = headers.get('x-amzn-bedrock-output-token-count', 0)
+        if self.request_format == TEXT_COMPLETION_FORMAT:
+            return response_body.get('completion', ''), response_body.get('stop_reason'), usage
+
+        text = ''.join(block.get('text', '') for block in response_body.get('content', []) if block.get('type') == 'text')
+        usage.update(self._messages_usage(response_body.get('usage')))
+        return text, response_body.get('stop_reason'), usage
+
+    def parse_stream_event(self, payload: dict):
+        usage = dict(payload.get('amazon-bedrock-invocationMetrics') or {})
+        if self.request_format == TEXT_COMPLETION_FORMAT:
+            return payload.get('completion', ''), payload.get('stop_reason'), usage
+
+        event_type = payload.get('type')
+        if event_type == 'content_block_delta':
+            return payload.get('delta', {}).get('text', ''), None, usage
+        if event_type == 'message_start':
+            usage.update(self._messages_usage(payload.get('message', {}).get('usage')))
+        elif event_type == 'message_delta':
+            usage.update(self._messages_usage(payload.get('usage')))
+            return '', payload.get('delta', {}).get('stop_reason'), usage
+        return '', None, usage
+
+    def _messages_usage(self, usage: dict) -> dict:
+        # Messages形式の使用量をinvocationMetricsと同じ名前にそろえる
+        names = {
+            'input_tokens': 'inputTokenCount',
+            'output_tokens': 'outputTokenCount',
+            'cache_read_input_tokens': 'cacheReadInputTokenCount',
+            'cache_creation_input_tokens': 'cacheWriteInputTokenCount'
+        }
+        return {names[key]: value for key, value in (usage or {}).items() if key in names and value is not None}
+
+PROMPT_TEMPLATES = {
+    # 従来のHuman:/Assistant:形式。基準を毎回コメントの後ろに連結する
+    'v3': PromptTemplate(
+        'v3',
+        TEXT_COMPLETION_FORMAT,
+        head="以下の講義コメントを大学運営の観点から分析してください。\n\n",
+        tail=("\n\n各コメント（全{count}件）について、コメント番号をidに入れた{count}個の要素を持つ以下の形式のJSON配列で回答してください:\n"
+              f"{RESULT_FORMAT_EXAMPLE}\n\n{ANALYSIS_CRITERIA}")
+    ),
+    # 基準を固定のシステムプロンプトに分け、バッチごとに変わるのはコメント部分だけにする
+    'v4': PromptTemplate(
+        'v4',
+        MESSAGES_FORMAT,
+        head="以下の講義コメント（全{count}件）を分析し、{count}個の要素を持つJSON配列のみで回答してください。\n\n",
+        system=("あなたは講義コメントを大学運営の観点から分析します。\n"
+                "番号付きで渡される各コメントについて、コメント番号をidに入れた以下の形式のJSON配列のみで回答してください:\n"
+                f"{RESULT_FORMAT_EXAMPLE}\n\n{ANALYSIS_CRITERIA}")
+    )
+}
+
+def get_prompt_template(name=None) -> PromptTemplate:
+    name = name or DEFAULT_PROMPT_TEMPLATE
+    if name not in PROMPT_TEMPLATES:
+        raise ValueError(f"不明なプロンプトテンプレート: {name}（{', '.join(PROMPT_TEMPLATES)}のいずれかを指定してください）")
+    return PROMPT_TEMPLATES[name]
@@ -0,0 +1,337 @@
+import math
+from array import array
+
+RESULT_WIRE_FORMAT = 'columnar'
+RESULT_WIRE_VERSION = 1
+
+# 行に戻すときはこの順に項目を並べる（従来の結果と同じ順）
+FIELD_ORDER = (
+    'comment', 'row_id', 'column_name', 'sentiment', 'sentiment_score', 'category', 'category_confidence',
+    'is_dangerous', 'danger_score', 'danger_reasons', 'importance_score', 'specificity_score', 'urgency_score',
+    'commonality_score', 'source', 'file_name', 'sheet_name'
+)
+# 複数ファイル・複数シートのジョブで結果の出どころを表す項目
+SOURCE_FIELDS = ('file_name', 'sheet_name')
+INTEGER_FIELDS = ('row_id',)
+FLOAT_FIELDS = ('sentiment_score', 'category_confidence', 'danger_score', 'importance_score')
+FLAG_FIELDS = ('is_dangerous',)
+TEXT_FIELDS = ('comment',)
+
+MISSING = object()
+
+class TextColumn:
+    kind = 'text'
+
+    def __init__(self):
+        # コメント本文は読み込み時の文字列をそのまま参照し、コピーしない
+        self.data = []
+
+    def grow(self, count):
+        self.data.extend([None] * count)
+
+    def set(self, index, value):
+        if value is not MISSING and not isinstance(value, str):
+            return False
+        self.data[index] = None if value is MISSING else value
+        return True
+
+    def get(self, index):
+        value = self.data[index]
+        return MISSING if value is None else value
+
+    def take(self, indices):
+        taken = TextColumn()
+        taken.data = [self.data[index] for index in indices]
+        return taken
+
+    def to_wire(self):
+        return {'type': self.kind, 'data': self.data}
+
+    def load_wire(self, column, count):
+        self.data = list(column['data'])
+
+class IntegerColumn:
+    kind = 'int'
+    NULL = -(2 ** 63)
+
+    def __init__(self):
+        self.data = array('q')
+
+    def grow(self, count):
+        self.data.extend([self.NULL] * count)
+
+    def set(self, index, value):
+        if value is MISSING:
+            self.data[index] = self.NULL
+            return True
+        if not isinstance(value, int) or isinstance(value, bool) or not self.NULL < value < 2 ** 63:
+            return False
+        self.data[index] = value
+        return True
+
+    def get(self, index):
+        value = self.data[index]
+        return MISSING if value == self.NULL else value
+
+    def take(self, indices):
+        taken = IntegerColumn()
+        taken.data = array('q', (self.data[index] for index in indices))
+        return taken
+
+    def to_wire(self):
+        return {'type': self.kind, 'data': [None if value == self.NULL else value for value in self.data]}
+
+    def load_wire(self, column, count):
+        self.data = array('q', (self.NULL if value is None else value for value in column['data']))
+
+class FloatColumn:
+    kind = 'float'
+
+    def __init__(self):
+        self.data = array('d')
+
+    def grow(self, count):
+        self.data.extend([math.nan] * count)
+
+    def set(self, index, value):
+        if value is MISSING:
+            self.data[index] = math.nan
+            return True
+        if not isinstance(value, float):
+            return False
+        self.data[index] = value
+        return True
+
+    def get(self, index):
+        value = self.data[index]
+        return MISSING if math.isnan(value) else value
+
+    def take(self, indices):
+        taken = FloatColumn()
+        taken.data = array('d', (self.data[index] for index in indices))
+        return taken
+
+    def to_wire(self):
+        return {'type': self.kind, 'data': [None if math.isnan(value) else value for value in self.data]}
+
+    def load_wire(self, column, count):
+        self.data = array('d', (math.nan if value is None else float(value) for value in column['data']))
+
+class FlagColumn:
+    kind = 'flag'
+
+    def __init__(self):
+        self.data = array('b')
+
+    def grow(self, count):
+        self.data.extend([-1] * count)
+
+    def set(self, index, value):
+        if value is MISSING:
+            self.data[index] = -1
+            return True
+        if not isinstance(value, bool):
+            return False
+        self.data[index] = 1 if value else 0
+        return True
+
+    def get(self, index):
+        value = self.data[index]
+        return MISSING if value < 0 else value == 1
+
+    def take(self, indices):
+        taken = FlagColumn()
+        taken.data = array('b', (self.data[index] for index in indices))
+        return taken
+
+    def to_wire(self):
+        return {'type': self.kind, 'data': [None if value < 0 else value for value in self.data]}
+
+    def load_wire(self, column, count):
+        self.data = array('b', (-1 if value is None else int(value) for value in column['data']))
+
+class CodedColumn:
+    # 種類の少ない項目は値の一覧と番号で持つ。ほぼ固定値のspecificity_score等は1つの値にまとまる
+    kind = 'coded'
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self._index = {}
+
+    def _code(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def grow(self, count):
+        self.codes.extend([self._code(None)] * count)
+
+    def set(self, index, value):
+        if value is not MISSING and not isinstance(value, (str, float)):
+            return False
+        self.codes[index] = self._code(None if value is MISSING else value)
+        return True
+
+    def get(self, index):
+        value = self.values[self.codes[index]]
+        return MISSING if value is None else value
+
+    def take(self, indices):
+        taken = CodedColumn()
+        taken.values = list(self.values)
+        taken._index = dict(self._index)
+        taken.codes = array('I', (self.codes[index] for index in indices))
+        return taken
+
+    def to_wire(self):
+        # 確保しただけで使われなかった値（未確定行の空値など）は送らない
+        used = sorted(set(self.codes))
+        column = {'type': self.kind, 'values': [self.values[code] for code in used]}
+        # 全行が同じ値の列は値だけを送る
+        if len(used) > 1:
+            renumber = {code: position for position, code in enumerate(used)}
+            column['codes'] = [renumber[code] for code in self.codes]
+        return column
+
+    def load_wire(self, column, count):
+        self.values = list(column['values'])
+        self._index = {value: code for code, value in enumerate(self.values)}
+        codes = column.get('codes')
+        self.codes = array('I', codes if codes is not None else [0] * count)
+
+def create_column(field):
+    if field in TEXT_FIELDS:
+        return TextColumn()
+    if field in INTEGER_FIELDS:
+        return IntegerColumn()
+    if field in FLOAT_FIELDS:
+        return FloatColumn()
+    if field in FLAG_FIELDS:
+        return FlagColumn()
+    return CodedColumn()
+
+class ResultColumns:
+    def __init__(self, rows=None):
+        self.count = 0
+        self.columns = {field: create_column(field) for field in FIELD_ORDER}
+        # 列に収まらない項目・値（想定外の型や追加項目）は行番号ごとにそのまま持つ
+        self.extras = {}
+        if rows is not None:
+            self.extend(rows)
+
+    def grow(self, count: int):
+        # 結果が確定する前に行の領域を確保しておき、確定した行から番号を指定して書き込む
+        for column in self.columns.values():
+            column.grow(count)
+        self.count += count
+
+    def set(self, index: int, row: dict):
+        extra = {}
+        for field, column in self.columns.items():
+            value = row.get(field, MISSING)
+            if not column.set(index, value):
+                column.set(index, MISSING)
+                extra[field] = value
+        for field, value in row.items():
+            if field not in self.columns:
+                extra[field] = value
+        if extra:
+            self.extras[index] = extra
+        else:
+            self.extras.pop(index, None)
+
+    def update(self, index: int, fields: dict):
+        extra = self.extras.get(index, {})
+        for field, value in fields.items():
+            column = self.columns.get(field)
+            if column is not None and column.set(index, value):
+                extra.pop(field, None)
+            else:
+                if column is not None:
+                    column.set(index, MISSING)
+                extra[field] = value
+        if extra:
+            self.extras[index] = extra
+        else:
+            self.extras.pop(index, None)
+
+    def append(self, row: dict):
+        self.grow(1)
+        self.set(self.count - 1, row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def row(self, index: int) -> dict:
+        row = {}
+        for field, column in self.columns.items():
+            value = column.get(index)
+            if value is not MISSING:
+                row[field] = value
+        if index in self.extras:
+            row.update(self.extras[index])
+        return row
+
+    def take(self, indices):
+        # 行の辞書に戻さず、列ごとに指定した順の行を取り出す
+        indices = list(indices)
+        taken = ResultColumns()
+        taken.count = len(indices)
+        taken.columns = {field: column.take(indices) for field, column in self.columns.items()}
+        taken.extras = {position: dict(self.extras[index]) for position, index in enumerate(indices) if index in self.extras}
+        return taken
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.row(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(self.count))]
+        return self.row(self._position(index))
+
+    def __setitem__(self, index, row):
+        self.set(self._position(index), row)
+
+    def _position(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('result index out of range')
+        return index
+
+    def to_wire(self) -> dict:
+        columns = {}
+        for field, column in self.columns.items():
+            # 単一ファイルのジョブのfile_nameなど、全行にない項目は送らない
+            if self.count and all(column.get(index) is MISSING for index in range(self.count)):
+                continue
+            columns[field] = column.to_wire()
+        wire = {'format': RESULT_WIRE_FORMAT, 'version': RESULT_WIRE_VERSION, 'count': self.count, 'columns': columns}
+        if self.extras:
+            wire['extras'] = {str(index): extra for index, extra in self.extras.items()}
+        return wire
+
+    @classmethod
+    def from_wire(cls, data):
+        # 列形式に対応する前のシャード結果などは行の配列のまま届く
+        if isinstance(data, list):
+            return cls(data)
+        if data.get('format') != RESULT_WIRE_FORMAT or data.get('version') != RESULT_WIRE_VERSION:
+            raise ValueError(f"対応していない結果形式です: {data.get('format')} (version {data.get('version')})")
+        store = cls()
+        store.count = data['count']
+        for field, column in store.columns.items():
+            if field in data['columns']:
+                column.load_wire(data['columns'][field], store.count)
+            else:
+                column.grow(store.count)
+        store.extras = {int(index): extra for index, extra in (data.get('extras') or {}).items()}
+        return store
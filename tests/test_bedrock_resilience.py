@@ -0,0 +1,150 @@
+import threading
+import time
+from botocore.exceptions import ClientError
+from bedrock_resilience import ResilientInvoker, AttemptCancelled, HEDGE_MIN_SAMPLES
+
+class Limiter:
+    def __init__(self):
+        self.in_flight = 0
+        self.released = []
+
+    def acquire(self):
+        self.in_flight += 1
+
+    def release(self, throttled=False):
+        self.in_flight -= 1
+        self.released.append(throttled)
+
+class Stream:
+    def __init__(self, events, delay=0.0):
+        self.events = events
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for event in self.events:
+            time.sleep(self.delay)
+            if self.closed:
+                return
+            yield event
+
+    def close(self):
+        self.closed = True
+
+def test_limiter_slot_is_held_until_stream_is_read():
+    limiter = Limiter()
+    seen = []
+    invoker = ResilientInvoker(lambda **kwargs: {'body': Stream(['a', 'b'])}, max_workers=1, hedging=False)
+
+    def read(response):
+        for event in response['body']:
+            seen.append((event, limiter.in_flight))
+        return 'done'
+
+    assert invoker.invoke(limiter, read=read) == 'done'
+    assert seen == [('a', 1), ('b', 1)]
+    assert limiter.in_flight == 0
+
+def test_error_in_stream_is_retried():
+    calls = []
+
+    def call(**kwargs):
+        calls.append(kwargs)
+        return {'body': Stream(['a'])}
+
+    def read(response):
+        list(response['body'])
+        if len(calls) == 1:
+            raise ClientError({'Error': {'Code': 'throttlingException', 'Message': 'slow down'}}, 'InvokeModelWithResponseStream')
+        return len(calls)
+
+    limiter = Limiter()
+    invoker = ResilientInvoker(call, max_workers=1, hedging=False)
+    assert invoker.invoke(limiter, read=read) == 2
+    assert limiter.released == [True, False]
+    assert invoker.stats()['retries'] == 1
+
+def test_losing_hedge_stream_is_closed():
+    streams = []
+    lock = threading.Lock()
+
+    def call(**kwargs):
+        with lock:
+            # 1本目は遅く、ヘッジした2本目はすぐに読み終わる
+            stream = Stream(['a'] * 50, delay=0.05 if not streams else 0.0)
+            streams.append(stream)
+        return {'body': stream}
+
+    invoker = ResilientInvoker(call, max_workers=1)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        invoker.latency.record(0.01)
+    invoker.latency.hedge_delay = lambda: 0.05
+
+    result = invoker.invoke(read=lambda response: len(list(response['body'])))
+    invoker.close()
+    assert result == 50
+    assert invoker.stats()['hedge_wins'] == 1
+    assert streams[0].closed
+
+def test_cancelled_attempt_is_not_retried():
+    from bedrock_resilience import is_retryable_error
+    assert not is_retryable_error(AttemptCancelled())
+
+def test_stop_interrupts_retry_backoff():
+    from bedrock_resilience import BedrockUnavailableError
+
+    def call(**kwargs):
+        raise ClientError({'Error': {'Code': 'throttlingException', 'Message': 'slow down'}}, 'InvokeModel')
+
+    invoker = ResilientInvoker(call, max_workers=1, hedging=False)
+    errors = []
+
+    def run():
+        try:
+            invoker.invoke(Limiter())
+        except BedrockUnavailableError as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=run)
+    started = time.monotonic()
+    worker.start()
+    time.sleep(0.2)
+    invoker.stop()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert len(errors) == 1
+    assert time.monotonic() - started < 5
+
+def test_stop_releases_calls_waiting_for_open_breaker():
+    from bedrock_resilience import BedrockUnavailableError
+    invoker = ResilientInvoker(lambda **kwargs: 'ok', max_workers=1, hedging=False)
+    invoker.breaker.state = 'open'
+    invoker.breaker._opened_at = time.monotonic()
+    errors = []
+
+    def run():
+        try:
+            invoker.invoke(Limiter())
+        except BedrockUnavailableError as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    time.sleep(0.1)
+    invoker.stop()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert len(errors) == 1
+
+def test_non_retryable_error_does_not_close_half_open_breaker():
+    def call(**kwargs):
+        raise ClientError({'Error': {'Code': 'ValidationException', 'Message': 'bad input'}}, 'InvokeModel')
+
+    invoker = ResilientInvoker(call, max_workers=1, hedging=False)
+    invoker.breaker.state = 'half_open'
+    try:
+        invoker.invoke(Limiter())
+    except ClientError:
+        pass
+    assert invoker.breaker.state == 'half_open'
+    assert not invoker.breaker._trial_in_flight
@@ -0,0 +1,98 @@
+import io
+import zipfile
+import pytest
+import comment_analyzer
+from openpyxl import Workbook
+from comment_analyzer import prioritize_comments, restore_row_order, iter_file_comments
+from result_store import ResultColumns
+
+def rows(texts):
+    return [{'comment': text, 'row_id': i + 2, 'column_name': 'Q1'} for i, text in enumerate(texts)]
+
+def test_prioritize_reads_only_one_window_ahead():
+    consumed = []
+    
+    def source():
+        for row in rows(['普通', '死ね', '普通', '普通', '殺す', '普通']):
+            consumed.append(row['row_id'])
+            yield row
+    
+    order = []
+    stream = prioritize_comments(source(), order, window=3)
+    first = next(stream)
+    assert first['comment'] == '死ね'
+    assert len(consumed) == 3
+    assert [row['comment'] for row in stream][2] == '殺す'
+    assert sorted(order) == list(range(6))
+
+def test_restore_row_order_after_prioritize():
+    comments = rows(['a', '死ね', 'b', 'c', '殺す'])
+    order = []
+    dispatched = list(prioritize_comments(comments, order, window=2))
+    results = restore_row_order(ResultColumns(dispatched), order)
+    assert [row['row_id'] for row in results] == [2, 3, 4, 5, 6]
+
+def workbook(*sheets):
+    book = Workbook()
+    for position, title in enumerate(sheets):
+        sheet = book.active if position == 0 else book.create_sheet()
+        sheet.title = title
+        sheet.append(['番号', '感想'])
+        sheet.append([1, f'{title}の講義はとても分かりやすかったです。'])
+    data = io.BytesIO()
+    book.save(data)
+    return data.getvalue()
+
+def sheet_names(comments):
+    return [comment['sheet_name'] for comment in comments]
+
+def test_single_workbook_reads_active_sheet_by_default():
+    data = workbook('前期', '後期')
+    assert sheet_names(iter_file_comments(data)) == ['前期']
+    assert sheet_names(iter_file_comments(data, all_sheets=True)) == ['前期', '後期']
+
+def test_zipped_workbooks_read_all_sheets_by_default():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('a.xlsx', workbook('前期', '後期'))
+    comments = list(iter_file_comments([('all.zip', archive.getvalue())]))
+    assert sheet_names(comments) == ['前期', '後期']
+    assert {comment['file_name'] for comment in comments} == {'a.xlsx'}
+    assert sheet_names(iter_file_comments([('all.zip', archive.getvalue())], all_sheets=False)) == ['前期']
+
+def test_zip_over_size_limit_is_rejected_before_reading(monkeypatch):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('a.xlsx', workbook('前期'))
+        zf.writestr('b.xlsx', workbook('後期'))
+    sizes = [info.file_size for info in zipfile.ZipFile(io.BytesIO(archive.getvalue())).infolist()]
+    read = []
+    monkeypatch.setattr(zipfile.ZipFile, 'read', lambda self, name, pwd=None: read.append(name))
+
+    monkeypatch.setattr(comment_analyzer, 'MAX_ARCHIVE_MEMBER_BYTES', min(sizes) - 1)
+    with pytest.raises(ValueError, match='展開後のサイズ'):
+        list(iter_file_comments([('all.zip', archive.getvalue())]))
+
+    monkeypatch.setattr(comment_analyzer, 'MAX_ARCHIVE_MEMBER_BYTES', max(sizes))
+    monkeypatch.setattr(comment_analyzer, 'MAX_ARCHIVE_TOTAL_BYTES', sum(sizes) - 1)
+    with pytest.raises(ValueError, match='合計サイズ'):
+        list(iter_file_comments([('all.zip', archive.getvalue())]))
+    assert read == []
+
+def test_batch_cap_shrinks_when_repair_requests_do_not_fill_the_batch(monkeypatch):
+    monkeypatch.setattr(comment_analyzer, 'get_bedrock_client', lambda: None)
+    analyzer = comment_analyzer.CommentAnalyzer(max_concurrency=1)
+    requests = []
+
+    def analyze(limiter, batch_comments, on_item=None):
+        # 最後のコメントの結果だけ毎回欠落させる
+        requests.append(len(batch_comments))
+        return [{'sentiment': 'neutral'} for _ in batch_comments[:-1]] + [None]
+
+    analyzer._analyze_batch_with_bedrock = analyze
+    comments = [{'row_id': i, 'comment': f'コメント{i}です。十分な長さがあります。'} for i in range(8)]
+    results = analyzer._dispatch_batch(None, comments, list(range(8)))
+
+    assert requests == [8] + [1] * comment_analyzer.MAX_REPAIR_REQUESTS
+    assert results[-1]['danger_reasons'] == '分析エラー'
+    assert analyzer._batch_item_cap == 4
@@ -0,0 +1,47 @@
+from incremental import BaseResultIndex
+
+def row(row_id, comment, **extra):
+    return dict({'comment': comment, 'row_id': row_id, 'column_name': 'Q1', 'sentiment': 'positive', 'danger_reasons': ''}, **extra)
+
+def test_failed_base_rows_are_not_reused():
+    index = BaseResultIndex('base', [row(2, '良い'), row(3, '悪い', danger_reasons="分析エラー")])
+    assert index.lookup(row(2, '良い')) is not None
+    assert index.lookup(row(3, '悪い')) is None
+    assert index.failed == 1
+
+def test_summarize_separates_edited_added_and_removed_rows():
+    index = BaseResultIndex('base', [row(2, 'a'), row(3, 'b'), row(4, 'c'), row(5, 'd', danger_reasons="分析エラー")])
+    results = [row(2, 'a'), row(3, 'b2'), row(5, 'd'), row(6, 'e')]
+    assert index.summarize(results) == {
+        'base_job_id': 'base',
+        'base_comments': 4,
+        'reused': 1,
+        'changed': 2,
+        'added': 1,
+        'removed': 1
+    }
+
+def test_renamed_single_file_rerun_reuses_rows():
+    base = [row(2, 'a', file_name='survey_2026-10-01.xlsx', sheet_name='回答')]
+    index = BaseResultIndex('base', base)
+    rerun = row(2, 'a', file_name='survey_2026-10-15.xlsx', sheet_name='回答')
+    assert index.lookup(rerun) is not None
+    assert index.summarize([rerun]) == {
+        'base_job_id': 'base',
+        'base_comments': 1,
+        'reused': 1,
+        'changed': 0,
+        'added': 0,
+        'removed': 0
+    }
+
+def test_file_name_is_matched_when_base_job_has_several_files():
+    base = [row(2, 'a', file_name='A.xlsx', sheet_name='回答'), row(2, 'a', file_name='B.xlsx', sheet_name='回答')]
+    index = BaseResultIndex('base', base)
+    assert index.lookup(row(2, 'a', file_name='A.xlsx', sheet_name='回答')) is not None
+    assert index.lookup(row(2, 'a', file_name='C.xlsx', sheet_name='回答')) is None
+
+def test_file_name_is_matched_when_new_job_has_several_files():
+    index = BaseResultIndex('base', [row(2, 'a', file_name='A.xlsx', sheet_name='回答')], multiple_files=True)
+    assert index.lookup(row(2, 'a', file_name='B.xlsx', sheet_name='回答')) is None
+    assert index.lookup(row(2, 'a', file_name='A.xlsx', sheet_name='回答')) is not None
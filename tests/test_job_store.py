@@ -0,0 +1,61 @@
+import pytest
+from job_store import SqliteJobStore, JobVersionConflict, JobNotFound, MAX_CAS_RETRIES
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteJobStore(str(tmp_path / 'jobs.sqlite3'))
+
+def test_put_with_stale_version_conflicts(store):
+    assert store.put('job', {'status': 'started'}) == 1
+    assert store.put('job', {'status': 'processing'}, expected_version=1) == 2
+    with pytest.raises(JobVersionConflict) as error:
+        store.put('job', {'status': 'completed'}, expected_version=1)
+    assert error.value.current_version == 2
+    assert store.get('job') == {'status': 'processing', 'version': 2}
+
+def test_update_with_stale_version_keeps_fields(store):
+    store.put('job', {'status': 'processing', 'progress': 10})
+    store.update('job', {'progress': 20}, expected_version=1)
+    with pytest.raises(JobVersionConflict):
+        store.update('job', {'progress': 30}, remove=('status',), expected_version=1)
+    assert store.get('job') == {'status': 'processing', 'progress': 20, 'version': 2}
+
+def test_update_missing_job_raises_not_found(store):
+    with pytest.raises(JobNotFound):
+        store.update('missing', {'progress': 1})
+
+def test_modify_retries_after_concurrent_write(store):
+    store.put('job', {'status': 'processing', 'processed': 0})
+    calls = []
+    
+    def mutate(document):
+        calls.append(document['processed'])
+        if len(calls) == 1:
+            # 読み込み後に別のワーカーが書き込んだ状態を再現する
+            store.update('job', {'processed': 5})
+        document['processed'] += 1
+    
+    document = store.modify('job', mutate)
+    assert calls == [0, 5]
+    assert document['processed'] == 6
+    assert store.get('job') == {'status': 'processing', 'processed': 6, 'version': 3}
+
+def test_modify_gives_up_after_retries(store):
+    store.put('job', {'processed': 0})
+    calls = []
+    
+    def mutate(document):
+        calls.append(1)
+        store.update('job', {'processed': len(calls)})
+        document['processed'] = -1
+    
+    with pytest.raises(JobVersionConflict):
+        store.modify('job', mutate)
+    assert len(calls) == MAX_CAS_RETRIES
+    assert store.get('job')['processed'] == MAX_CAS_RETRIES
+
+def test_modify_skips_write_when_mutate_returns_false(store):
+    store.put('job', {'status': 'completed'})
+    assert store.modify('job', lambda document: False) == {'status': 'completed', 'version': 1}
+    assert store.get('job')['version'] == 1
+    assert store.modify('missing', lambda document: None) is None
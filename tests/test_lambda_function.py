@@ -0,0 +1,21 @@
+import pytest
+from lambda_function import parse_int_param, parse_seconds_param
+
+def test_int_param_is_clamped_to_range():
+    assert parse_int_param({}, 'limit', 1000, 1, 5000) == 1000
+    assert parse_int_param({'limit': '20'}, 'limit', 1000, 1, 5000) == 20
+    assert parse_int_param({'limit': 99999}, 'limit', 1000, 1, 5000) == 5000
+    assert parse_int_param({'cursor': -5}, 'cursor', 0, 0) == 0
+
+@pytest.mark.parametrize('value', ['abc', '', None, 1.5, True, [1]])
+def test_non_integer_param_is_rejected(value):
+    with pytest.raises(ValueError, match='cursorには0以上の整数'):
+        parse_int_param({'cursor': value}, 'cursor', 0, 0)
+
+def test_seconds_param_is_clamped_and_validated():
+    assert parse_seconds_param({}, 'wait_seconds', 5) == 0.0
+    assert parse_seconds_param({'wait_seconds': '2.5'}, 'wait_seconds', 5) == 2.5
+    assert parse_seconds_param({'wait_seconds': 60}, 'wait_seconds', 5) == 5
+    assert parse_seconds_param({'wait_seconds': -1}, 'wait_seconds', 5) == 0.0
+    with pytest.raises(ValueError, match='wait_secondsには0〜5の秒数'):
+        parse_seconds_param({'wait_seconds': 'soon'}, 'wait_seconds', 5)
@@ -0,0 +1,43 @@
+import pytest
+from prescreen import KeywordPrescreener, DANGER_KEYWORDS, is_ambiguous_danger_keyword
+
+@pytest.fixture
+def prescreener():
+    return KeywordPrescreener()
+
+@pytest.mark.parametrize('comment', [
+    'もう少しねばって説明してほしい',
+    '授業が少しねむかった',
+    'ところすごく分かりやすかったです',
+    '課題ばかりで大変でした',
+])
+def test_kana_near_misses_are_sent_to_model(prescreener, comment):
+    assert prescreener.classify(comment) is None
+
+@pytest.mark.parametrize('comment', ['しね', 'お前ころすぞ'])
+def test_kana_only_danger_words_are_not_labeled_locally(prescreener, comment):
+    assert prescreener.classify(comment) is None
+
+def test_explicit_danger_word_is_labeled(prescreener):
+    result = prescreener.classify('先生は死ねばいいと思います')
+    assert result['is_dangerous'] is True
+    assert result['danger_score'] == DANGER_KEYWORDS['死ね']
+    assert result['matched_keywords'] == ['死ね']
+
+def test_kana_hit_does_not_raise_labeled_score(prescreener):
+    result = prescreener.classify('死ねとしね')
+    assert result['matched_keywords'] == ['死ね']
+
+def test_ambiguous_keywords_are_hiragana_only():
+    assert is_ambiguous_danger_keyword('しね')
+    assert is_ambiguous_danger_keyword('ころす')
+    assert not is_ambiguous_danger_keyword('死ね')
+    assert not is_ambiguous_danger_keyword('キモい')
+
+def test_short_positive_comment_is_labeled(prescreener):
+    result = prescreener.classify('ありがとうございました')
+    assert result['sentiment'] == 'positive'
+    assert result['is_dangerous'] is False
+
+def test_empty_answer_is_neutral(prescreener):
+    assert prescreener.classify('特になし')['sentiment'] == 'neutral'
@@ -0,0 +1,28 @@
+import pytest
+from prompt_templates import get_prompt_template, supports_prompt_caching, DEFAULT_PROMPT_TEMPLATE
+
+COMMENTS = [{'comment': '分かりやすかった'}]
+
+def test_default_template_is_text_completion():
+    assert DEFAULT_PROMPT_TEMPLATE == 'v3'
+    request, _ = get_prompt_template().build_request(COMMENTS, 'anthropic.claude-instant-v1', 100)
+    assert request['prompt'].startswith('Human:')
+
+@pytest.mark.parametrize('model_id, expected', [
+    ('anthropic.claude-sonnet-4-20250514-v1:0', True),
+    ('apac.anthropic.claude-3-7-sonnet-20250219-v1:0', True),
+    ('anthropic.claude-sonnet-4-5-20250929-v1:0', False),
+    ('anthropic.claude-opus-4-1-20250805-v1:0', False),
+    ('anthropic.claude-instant-v1', False),
+])
+def test_prompt_caching_models_match_exact_versions(model_id, expected):
+    assert supports_prompt_caching(model_id) is expected
+
+def test_messages_request_sends_plain_system_without_caching():
+    request, _ = get_prompt_template('v4').build_request(COMMENTS, 'anthropic.claude-sonnet-4-5-20250929-v1:0', 100)
+    assert isinstance(request['system'], str)
+    assert 'temperature' in request and 'top_p' not in request
+
+def test_messages_request_attaches_cache_control_on_caching_models():
+    request, _ = get_prompt_template('v4').build_request(COMMENTS, 'anthropic.claude-sonnet-4-20250514-v1:0', 100)
+    assert request['system'][0]['cache_control'] == {'type': 'ephemeral'}
@@ -0,0 +1,85 @@
+import json
+import pytest
+from result_store import ResultColumns
+
+def result(row_id, sentiment='positive', **extra):
+    return dict({'comment': f'コメント{row_id}', 'row_id': row_id, 'column_name': 'Q1', 'sentiment': sentiment,
+                 'danger_score': 0.1, 'is_dangerous': False}, **extra)
+
+def test_grow_then_set_by_index_in_any_order():
+    results = ResultColumns()
+    results.grow(3)
+    results[2] = result(4)
+    results[0] = result(2, 'negative')
+    assert len(results) == 3
+    assert results[1] == {}
+    assert results[0] == result(2, 'negative')
+    assert results[2] == result(4)
+
+def test_set_replaces_previous_extras():
+    results = ResultColumns()
+    results.grow(1)
+    results[0] = result(2, danger_score='high', note='x')
+    assert results[0]['danger_score'] == 'high'
+    results[0] = result(2)
+    assert results[0] == result(2)
+    assert results.extras == {}
+
+def test_take_reorders_columns_and_extras():
+    results = ResultColumns([result(2), result(3, 'negative', note='x'), result(4)])
+    taken = results.take([1, 0, 1])
+    assert [row['row_id'] for row in taken] == [3, 2, 3]
+    assert taken[0]['note'] == 'x' and taken[2]['note'] == 'x'
+    assert 'note' not in taken[1]
+
+def test_update_changes_only_given_fields():
+    results = ResultColumns([result(2, note='x')])
+    results.update(0, {'comment': '別のコメント', 'row_id': 9, 'file_name': 'a.xlsx'})
+    row = results[0]
+    assert row['comment'] == '別のコメント' and row['row_id'] == 9 and row['file_name'] == 'a.xlsx'
+    assert row['sentiment'] == 'positive' and row['note'] == 'x'
+
+def round_trip(results):
+    return ResultColumns.from_wire(json.loads(json.dumps(results.to_wire(), ensure_ascii=False)))
+
+def test_wire_round_trip_preserves_rows():
+    rows = [
+        result(2, sentiment_score=0.8, is_dangerous=True, file_name='a.xlsx', sheet_name='前期'),
+        result(3, 'negative', danger_reasons='攻撃的な表現', file_name='a.xlsx', sheet_name='後期'),
+        {'comment': '項目の少ない行', 'row_id': 4}
+    ]
+    assert list(round_trip(ResultColumns(rows))) == rows
+
+def test_wire_round_trip_keeps_unexpected_values_in_extras():
+    rows = [result(2, danger_score='0.9', sentiment_score=1, is_dangerous='true'), dict(result(3), row_id=None, note=['x'])]
+    wire = ResultColumns(rows).to_wire()
+    assert set(wire['extras']) == {'0', '1'}
+    assert list(round_trip(ResultColumns(rows))) == rows
+
+def test_wire_omits_codes_and_columns_without_variation():
+    wire = ResultColumns([result(2), result(3)]).to_wire()
+    assert wire['columns']['sentiment'] == {'type': 'coded', 'values': ['positive']}
+    assert 'file_name' not in wire['columns']
+    assert wire['count'] == 2
+
+def test_wire_skips_values_only_used_by_overwritten_rows():
+    results = ResultColumns()
+    results.grow(2)
+    results[0] = result(2, 'negative')
+    results[0] = result(2)
+    results[1] = result(3)
+    assert results.to_wire()['columns']['sentiment'] == {'type': 'coded', 'values': ['positive']}
+    assert list(round_trip(results)) == [result(2), result(3)]
+
+def test_empty_results_round_trip():
+    assert len(round_trip(ResultColumns())) == 0
+
+def test_from_wire_accepts_legacy_row_lists():
+    rows = [result(2), result(3)]
+    assert list(ResultColumns.from_wire(rows)) == rows
+
+def test_from_wire_rejects_unknown_versions():
+    wire = ResultColumns([result(2)]).to_wire()
+    wire['version'] = 99
+    with pytest.raises(ValueError):
+        ResultColumns.from_wire(wire)
@@ -0,0 +1,59 @@
+import json
+from comment_analyzer import StreamingResultParser
+
+def item_json(item_id=None, sentiment='positive', reason='良い'):
+    item = {'sentiment': sentiment, 'danger_score': 0.1, 'danger_reasons': reason}
+    if item_id is not None:
+        item['id'] = item_id
+    return json.dumps(item, ensure_ascii=False)
+
+def feed_in_pieces(parser, text, size=7):
+    placed = []
+    for start in range(0, len(text), size):
+        placed.extend(parser.feed(text[start:start + size]))
+    return placed
+
+def sentiments(items):
+    return [item and item['sentiment'] for item in items]
+
+def test_items_are_placed_as_soon_as_each_object_closes():
+    parser = StreamingResultParser(2)
+    assert parser.feed('[' + item_json(2, 'negative') + ',') == [(1, parser.items[1])]
+    assert parser.feed(item_json(1)[:-1]) == []
+    assert parser.feed('}]') == [(0, parser.items[0])]
+    assert sentiments(parser.finish()) == ['positive', 'negative']
+
+def test_truncated_output_keeps_complete_items():
+    parser = StreamingResultParser(3)
+    text = '[' + item_json(1) + ',' + item_json(2, 'neutral') + ',' + item_json(3)[:20]
+    feed_in_pieces(parser, text)
+    assert sentiments(parser.finish()) == ['positive', 'neutral', None]
+    assert parser.received_text
+
+def test_braces_inside_strings_do_not_split_objects():
+    parser = StreamingResultParser(1)
+    feed_in_pieces(parser, '説明: [' + item_json(1, reason='括弧 } と { を含む "引用"') + ']', size=3)
+    assert parser.finish()[0]['sentiment'] == 'positive'
+    assert parser.invalid_count == 0
+
+def test_unnumbered_items_are_used_in_order_when_count_matches():
+    parser = StreamingResultParser(2)
+    feed_in_pieces(parser, '[' + item_json(sentiment='negative') + ',' + item_json() + ']')
+    assert sentiments(parser.finish()) == ['negative', 'positive']
+
+def test_unnumbered_items_are_dropped_when_count_differs():
+    parser = StreamingResultParser(3)
+    feed_in_pieces(parser, '[' + item_json() + ',' + item_json() + ']')
+    assert sentiments(parser.finish()) == [None, None, None]
+
+def test_unnumbered_items_are_ignored_once_numbered_items_arrive():
+    parser = StreamingResultParser(2)
+    feed_in_pieces(parser, '[' + item_json(2) + ',' + item_json(sentiment='negative') + ']')
+    assert sentiments(parser.finish()) == [None, 'positive']
+
+def test_invalid_duplicate_and_out_of_range_ids_are_counted():
+    parser = StreamingResultParser(2)
+    text = '[' + ','.join([item_json(1), item_json(1, 'negative'), item_json(5), item_json(2, 'unknown')]) + ']'
+    feed_in_pieces(parser, text)
+    assert sentiments(parser.finish()) == ['positive', None]
+    assert parser.invalid_count == 3